@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class AiConfig(AppConfig):
+    name = 'ai'
+
+    def ready(self):
+        from . import signals  # noqa: F401
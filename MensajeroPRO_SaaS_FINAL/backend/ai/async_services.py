@@ -0,0 +1,152 @@
+"""
+Async (ASGI) versions of the AIService reply paths.
+
+Same caches, prompts, model routing and resilience as ai.services, but the
+Groq call is awaited (AsyncGroq) and the ORM is used through its async API,
+so one process can hold hundreds of slow upstream calls at once.
+"""
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .cache import reply_cache
+from .similarity import similarity_cache
+from .resilience import AIUnavailable, DEGRADED_REPLY
+from .services import model_router
+
+logger = logging.getLogger(__name__)
+
+
+def _usage(response) -> dict:
+    return {
+        "prompt_tokens": response.usage.prompt_tokens,
+        "completion_tokens": response.usage.completion_tokens,
+        "total_tokens": response.usage.total_tokens,
+    }
+
+
+class AsyncAIService:
+    """Async counterpart of AIService (reply and chat paths)."""
+    
+    @staticmethod
+    async def generate_reply(message: str, context: str = None, max_tokens: int = 500,
+                             business_id: int = None, plan: str = None, context_key: str = None) -> dict:
+        """Async AIService.generate_reply (same cache keys and result shape)."""
+        try:
+            params = {
+                "tier": model_router.tier_for("reply", message, plan),
+                "max_tokens": max_tokens,
+                "temperature": 0.7,
+            }
+            scope = context_key or context
+            
+            cached_reply = await sync_to_async(reply_cache.get, thread_sensitive=False)(
+                message, scope, business_id, **params
+            )
+            if cached_reply is not None:
+                return {"reply": cached_reply, "success": True, "cached": True}
+            
+            if settings.AI_SIMILARITY_CACHE_ENABLED:
+                similar_reply = await sync_to_async(similarity_cache.lookup, thread_sensitive=False)(
+                    message, scope, business_id, **params
+                )
+                if similar_reply is not None:
+                    await sync_to_async(reply_cache.set, thread_sensitive=False)(
+                        message, similar_reply, scope, business_id, **params
+                    )
+                    return {"reply": similar_reply, "success": True, "cached": True}
+            
+            messages = []
+            if context:
+                messages.append({"role": "system", "content": context})
+            messages.append({"role": "user", "content": message})
+            
+            response, model = await model_router.acreate("reply", messages, **params)
+            reply = response.choices[0].message.content
+            
+            await sync_to_async(AsyncAIService._store, thread_sensitive=False)(
+                message, reply, scope, business_id, params
+            )
+            return {"reply": reply, "usage": _usage(response), "model": model, "success": True}
+            
+        except AIUnavailable as e:
+            logger.warning(f"AI unavailable, degraded reply: {str(e)}")
+            return {"reply": DEGRADED_REPLY, "success": False, "degraded": True, "error": str(e)}
+        except Exception as e:
+            logger.error(f"Error generating AI reply: {str(e)}", exc_info=True)
+            return {
+                "reply": "Lo siento, no puedo procesar tu mensaje en este momento.",
+                "success": False,
+                "error": str(e)
+            }
+    
+    @staticmethod
+    def _store(message, reply, scope, business_id, params):
+        reply_cache.set(message, reply, scope, business_id, **params)
+        if settings.AI_SIMILARITY_CACHE_ENABLED:
+            similarity_cache.add(message, reply, scope, business_id, **params)
+    
+    @staticmethod
+    async def generate_chat_response(messages: list, temperature: float = 0.7, plan: str = None) -> dict:
+        """Async AIService.generate_chat_response."""
+        try:
+            response, model = await model_router.acreate(
+                "reply",
+                messages,
+                text=messages[-1].get("content", ""),
+                plan=plan,
+                max_tokens=800,
+                temperature=temperature,
+            )
+            return {
+                "model": model,
+                "reply": response.choices[0].message.content,
+                "usage": _usage(response),
+                "success": True
+            }
+        except AIUnavailable as e:
+            logger.warning(f"AI unavailable, degraded chat reply: {str(e)}")
+            return {"reply": DEGRADED_REPLY, "success": False, "degraded": True, "error": str(e)}
+        except Exception as e:
+            logger.error(f"Error in chat response: {str(e)}")
+            return {"reply": "Error al generar respuesta.", "success": False, "error": str(e)}
+    
+    @staticmethod
+    async def generate_conversation_reply(business, customer_phone: str, message: str, plan: str = None) -> dict:
+        """Async AIService.generate_conversation_reply (async ORM for turns)."""
+        from .conversations import aget_conversation, aappend_turn, abuild_context
+        from .prompts import business_prompt
+        
+        conversation = await aget_conversation(business.id, customer_phone)
+        has_history = conversation.summary or await conversation.turns.aexists()
+        
+        system_prompt, prompt_key = await sync_to_async(business_prompt, thread_sensitive=False)(business, message)
+        
+        if has_history:
+            messages = await abuild_context(conversation, system_prompt, message)
+            result = await AsyncAIService.generate_chat_response(messages, plan=plan)
+        else:
+            result = await AsyncAIService.generate_reply(
+                message, context=system_prompt, business_id=business.id, plan=plan, context_key=prompt_key
+            )
+        
+        await aappend_turn(conversation, "user", message)
+        if result.get("success"):
+            await aappend_turn(conversation, "assistant", result["reply"])
+        return result
+
+
+async def agenerate_business_reply(msg: str, business=None, customer_phone: str = None) -> dict:
+    """Async generate_business_reply."""
+    if business is None:
+        return await AsyncAIService.generate_reply(msg)
+    
+    from users.metering import owner_plan
+    from .prompts import business_prompt
+    
+    plan = await sync_to_async(owner_plan, thread_sensitive=False)(business.owner_id)
+    if customer_phone and settings.AI_CONVERSATION_MEMORY_ENABLED:
+        return await AsyncAIService.generate_conversation_reply(business, customer_phone, msg, plan=plan)
+    context, context_key = await sync_to_async(business_prompt, thread_sensitive=False)(business, msg)
+    return await AsyncAIService.generate_reply(
+        msg, context=context, business_id=business.id, plan=plan, context_key=context_key
+    )
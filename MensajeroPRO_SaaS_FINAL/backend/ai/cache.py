@@ -0,0 +1,106 @@
+import hashlib
+import json
+import logging
+import re
+import time
+from django.conf import settings
+from django.core.cache import caches
+from .intents import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_message(message: str) -> str:
+    """Normalize a message for cache keys: case, accents, whitespace and edge punctuation."""
+    text = normalize_text(message)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip(' ¿?¡!.,;:')
+
+
+def content_hash(*parts) -> str:
+    """Stable (process independent) hash of the given parts."""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ReplyCache:
+    """
+    Tenant-scoped cache for AI replies.
+
+    Keys are a SHA-256 over the normalized message, the business context and
+    the model parameters, so every worker computes the same key. Each business
+    has its own namespace version; bumping it invalidates all of its entries
+    at once without scanning keys. Versions are millisecond timestamps, so a
+    version evicted by the cache is re-seeded newer than any previous one and
+    never brings old entries back.
+    """
+
+    STATS_KEYS = ('hits', 'misses', 'bytes_stored', 'bytes_served')
+
+    def __init__(self, alias: str = None, ttl: int = None, max_bytes: int = None):
+        self.alias = alias or settings.AI_REPLY_CACHE_ALIAS
+        self.ttl = ttl if ttl is not None else settings.AI_REPLY_CACHE_TTL
+        self.max_bytes = max_bytes if max_bytes is not None else settings.AI_REPLY_CACHE_MAX_BYTES
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _namespace(self, business_id) -> str:
+        scope = business_id if business_id is not None else 'global'
+        version = self.cache.get_or_set(f'ai_reply_ns:{scope}', self._new_version, None)
+        return f'ai_reply:{scope}:v{version}'
+
+    @staticmethod
+    def _new_version(current: int = 0) -> int:
+        return max(time.time_ns() // 1_000_000, current + 1)
+
+    def make_key(self, message: str, context: str = None, business_id: int = None, **params) -> str:
+        """Cache key for a message under a business namespace and model parameters."""
+        digest = content_hash(normalize_message(message), context or '', params)
+        return f'{self._namespace(business_id)}:{digest}'
+
+    def get(self, message: str, context: str = None, business_id: int = None, **params):
+        """Return the cached reply or None."""
+        reply = self.cache.get(self.make_key(message, context, business_id, **params))
+        if reply is None:
+            self._incr('misses')
+            return None
+        self._incr('hits')
+        self._incr('bytes_served', len(reply.encode('utf-8')))
+        return reply
+
+    def set(self, message: str, reply: str, context: str = None, business_id: int = None, **params):
+        """Store a reply (replies larger than max_bytes are not cached)."""
+        size = len(reply.encode('utf-8'))
+        if self.max_bytes and size > self.max_bytes:
+            return
+        self.cache.set(self.make_key(message, context, business_id, **params), reply, self.ttl)
+        self._incr('bytes_stored', size)
+
+    def invalidate(self, business_id: int = None):
+        """Drop every cached reply of a business (old entries expire by TTL)."""
+        scope = business_id if business_id is not None else 'global'
+        key = f'ai_reply_ns:{scope}'
+        # Nunca se reinicia en 1: si la versión fue expulsada, la nueva es posterior
+        self.cache.set(key, self._new_version(self.cache.get(key) or 0), None)
+        logger.info(f"AI reply cache invalidated for business {scope}")
+
+    def _incr(self, name: str, amount: int = 1):
+        key = f'ai_reply_stats:{name}'
+        self.cache.add(key, 0, None)
+        try:
+            self.cache.incr(key, amount)
+        except ValueError:
+            pass
+
+    def stats(self) -> dict:
+        """Hit/miss/bytes counters shared by all workers."""
+        values = self.cache.get_many([f'ai_reply_stats:{name}' for name in self.STATS_KEYS])
+        data = {name: values.get(f'ai_reply_stats:{name}', 0) for name in self.STATS_KEYS}
+        lookups = data['hits'] + data['misses']
+        data['hit_rate'] = round(data['hits'] / lookups, 4) if lookups else 0.0
+        return data
+
+
+reply_cache = ReplyCache()
@@ -0,0 +1,169 @@
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from .models import Conversation, ConversationTurn
+from .tokens import count_tokens, MESSAGE_OVERHEAD
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_HEADER = "\n\nResumen de la conversación hasta ahora:\n"
+
+
+def get_conversation(business_id: int, customer_phone: str) -> Conversation:
+    """Conversation of a customer with a business (created on first message)."""
+    conversation, _ = Conversation.objects.get_or_create(
+        business_id=business_id,
+        customer_phone=customer_phone,
+    )
+    return conversation
+
+
+async def aget_conversation(business_id: int, customer_phone: str) -> Conversation:
+    """get_conversation() with the async ORM."""
+    conversation, _ = await Conversation.objects.aget_or_create(
+        business_id=business_id,
+        customer_phone=customer_phone,
+    )
+    return conversation
+
+
+def append_turn(conversation: Conversation, role: str, content: str) -> ConversationTurn:
+    """
+    Append a turn and schedule summarization when too many tokens are pending.
+    """
+    tokens = count_tokens(content) + MESSAGE_OVERHEAD
+    turn = ConversationTurn.objects.create(
+        conversation=conversation,
+        role=role,
+        content=content,
+        tokens=tokens,
+    )
+    Conversation.objects.filter(pk=conversation.pk).update(pending_tokens=F('pending_tokens') + tokens)
+    conversation.pending_tokens += tokens
+
+    if conversation.pending_tokens > settings.AI_SUMMARY_TRIGGER_TOKENS:
+        schedule_summary(conversation.pk)
+    return turn
+
+
+async def aappend_turn(conversation: Conversation, role: str, content: str) -> ConversationTurn:
+    """append_turn() with the async ORM."""
+    tokens = count_tokens(content) + MESSAGE_OVERHEAD
+    turn = await ConversationTurn.objects.acreate(
+        conversation=conversation,
+        role=role,
+        content=content,
+        tokens=tokens,
+    )
+    await Conversation.objects.filter(pk=conversation.pk).aupdate(pending_tokens=F('pending_tokens') + tokens)
+    conversation.pending_tokens += tokens
+
+    if conversation.pending_tokens > settings.AI_SUMMARY_TRIGGER_TOKENS:
+        await sync_to_async(schedule_summary, thread_sensitive=False)(conversation.pk)
+    return turn
+
+
+def schedule_summary(conversation_id: int):
+    """Enqueue a summarization task (at most one in flight per conversation)."""
+    from .tasks import summarize_conversation
+
+    if cache.add(f'conversation_summary_lock:{conversation_id}', 1, 300):
+        summarize_conversation.delay(conversation_id)
+
+
+def build_context(conversation: Conversation, system_prompt: str, message: str,
+                  budget: int = None) -> list:
+    """
+    Assemble the prompt for a new message within a fixed token budget.
+
+    The system prompt and the rolling summary always go first; the most recent
+    unsummarized turns are added newest-first while they fit.
+
+    Returns:
+        list of chat messages (system, recent turns, new user message)
+    """
+    system, remaining = _context_head(conversation, system_prompt, message, budget)
+    recent = []
+    for role, content, tokens in _recent_turns(conversation).iterator(chunk_size=50):
+        if tokens > remaining:
+            break
+        recent.append({"role": role, "content": content})
+        remaining -= tokens
+    return _context_messages(system, recent, message)
+
+
+async def abuild_context(conversation: Conversation, system_prompt: str, message: str,
+                         budget: int = None) -> list:
+    """build_context() with the async ORM (ASGI path)."""
+    system, remaining = _context_head(conversation, system_prompt, message, budget)
+    recent = []
+    async for role, content, tokens in _recent_turns(conversation):
+        if tokens > remaining:
+            break
+        recent.append({"role": role, "content": content})
+        remaining -= tokens
+    return _context_messages(system, recent, message)
+
+
+def _context_head(conversation, system_prompt, message, budget):
+    budget = budget or settings.AI_CONTEXT_TOKEN_BUDGET
+    system = (system_prompt or '') + (SUMMARY_HEADER + conversation.summary if conversation.summary else '')
+    remaining = budget - count_tokens(system) - count_tokens(message) - 2 * MESSAGE_OVERHEAD
+    return system, remaining
+
+
+def _recent_turns(conversation):
+    return (
+        conversation.turns
+        .filter(id__gt=conversation.summarized_until)
+        .order_by('-id')
+        .values_list('role', 'content', 'tokens')
+    )
+
+
+def _context_messages(system, recent, message):
+    head = [{"role": "system", "content": system}] if system else []
+    return head + list(reversed(recent)) + [{"role": "user", "content": message}]
+
+
+def summarize(conversation_id: int, summarize_fn) -> bool:
+    """
+    Fold the older unsummarized turns into the rolling summary.
+
+    The newest AI_RECENT_WINDOW_TOKENS worth of turns stay verbatim; everything
+    older is merged into the summary by `summarize_fn(summary, turns) -> str`.
+
+    Returns:
+        True if the summary was updated
+    """
+    conversation = Conversation.objects.get(pk=conversation_id)
+    turns = list(
+        conversation.turns
+        .filter(id__gt=conversation.summarized_until)
+        .order_by('-id')
+        .values_list('id', 'role', 'content', 'tokens')
+    )
+
+    window = 0
+    keep = 0
+    for _, _, _, tokens in turns:
+        if window + tokens > settings.AI_RECENT_WINDOW_TOKENS:
+            break
+        window += tokens
+        keep += 1
+
+    to_fold = list(reversed(turns[keep:]))
+    if not to_fold:
+        return False
+
+    summary = summarize_fn(conversation.summary, [(role, content) for _, role, content, _ in to_fold])
+    folded_tokens = sum(tokens for _, _, _, tokens in to_fold)
+    Conversation.objects.filter(pk=conversation_id).update(
+        summary=summary,
+        summarized_until=to_fold[-1][0],
+        pending_tokens=F('pending_tokens') - folded_tokens,
+    )
+    logger.info(f"Conversation {conversation_id} summarized ({len(to_fold)} turns, {folded_tokens} tokens)")
+    return True
@@ -0,0 +1,249 @@
+import logging
+import unicodedata
+from collections import deque
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Palabras clave por intención (texto normalizado: minúsculas y sin tildes)
+DEFAULT_RULES = {
+    'pay': ['pagar', 'pago', 'quiero pagar', 'link de pago', 'como pago'],
+    'hours': ['horario', 'horarios', 'a que hora', 'a q hora', 'abren', 'cierran', 'hora de atencion'],
+    'menu': ['menu', 'catalogo', 'productos', 'precios', 'lista de precios'],
+    'booking': ['reservar', 'reserva', 'agendar', 'cita', 'turno'],
+}
+
+# Reglas adicionales según Business.business_type
+BUSINESS_TYPE_RULES = {
+    'restaurant': {
+        'menu': ['carta', 'platos', 'que tienen de comer', 'domicilio'],
+        'booking': ['mesa para', 'reservar mesa'],
+    },
+    'store': {
+        'menu': ['stock', 'disponible', 'tienen'],
+    },
+    'medical': {
+        'booking': ['consulta', 'agendar cita', 'pedir cita'],
+    },
+    'barbershop': {
+        'booking': ['corte', 'agendar corte'],
+    },
+    'transport': {
+        'menu': ['tarifa', 'tarifas', 'rutas', 'pasaje'],
+        'booking': ['reservar viaje', 'reservar puesto'],
+    },
+}
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase and strip accents so keywords match regardless of spelling."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over a set of keywords.
+
+    Scans a message once (O(len(text) + matches)) no matter how many
+    keywords are loaded. Only whole-word matches are reported.
+    """
+
+    def __init__(self, keywords: dict):
+        """
+        Args:
+            keywords: dict mapping keyword -> intent
+        """
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for keyword, intent in keywords.items():
+            node = 0
+            for char in keyword:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.output[node].append((len(keyword), intent))
+
+        # BFS para construir los enlaces de fallo
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text: str) -> list:
+        """Return the intents found in `text`, in order of appearance."""
+        found = []
+        node = 0
+        for end, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for length, intent in self.output[node]:
+                start = end - length + 1
+                before = text[start - 1] if start > 0 else ' '
+                after = text[end + 1] if end + 1 < len(text) else ' '
+                if not before.isalnum() and not after.isalnum() and intent not in found:
+                    found.append(intent)
+        return found
+
+
+class IntentRouter:
+    """
+    Keyword-based intent routing stage that runs before AIService.
+
+    Matched intents are answered by registered handlers without calling the
+    model. A handler may return None to let the message fall through to the LLM;
+    a handler that raises (e.g. PayPal down) is logged and skipped the same way.
+    """
+
+    STATS_TTL = 60 * 60 * 24 * 30
+
+    def __init__(self, rules: dict = None, business_type_rules: dict = None):
+        self.rules = rules or DEFAULT_RULES
+        self.business_type_rules = business_type_rules or BUSINESS_TYPE_RULES
+        self.handlers = {}
+        self._matchers = {}
+
+    def register(self, intent: str):
+        """Decorator to register the handler for an intent: handler(text, business) -> str | None."""
+        def decorator(func):
+            self.handlers[intent] = func
+            return func
+        return decorator
+
+    def matcher_for(self, business_type: str) -> KeywordMatcher:
+        """Compiled matcher for a business type (built once per process)."""
+        business_type = business_type or 'generic'
+        if business_type not in self._matchers:
+            keywords = {}
+            extra = self.business_type_rules.get(business_type, {})
+            for intent in set(self.rules) | set(extra):
+                for keyword in self.rules.get(intent, []) + extra.get(intent, []):
+                    keywords[normalize_text(keyword)] = intent
+            self._matchers[business_type] = KeywordMatcher(keywords)
+        return self._matchers[business_type]
+
+    def detect(self, text: str, business_type: str = None) -> list:
+        """Return the intents detected in a message."""
+        return self.matcher_for(business_type).find(normalize_text(text))
+
+    def route(self, text: str, business=None):
+        """
+        Try to answer a message without the LLM.
+
+        Args:
+            text: Customer message
+            business: Optional Business (business_type, name and compiled ai_context)
+
+        Returns:
+            dict with 'intent' and 'reply' keys, or None if the LLM should answer
+        """
+        business_type = getattr(business, 'business_type', None)
+        for intent in self.detect(text, business_type):
+            handler = self.handlers.get(intent)
+            if not handler:
+                continue
+            try:
+                reply = handler(text, business)
+            except Exception as e:
+                # Un handler caído no tumba el mensaje: sigue con el siguiente intent o el LLM
+                logger.error(f"Intent handler '{intent}' failed: {str(e)}")
+                self._record(intent, failed=True)
+                continue
+            if reply:
+                self._record(intent)
+                logger.info(f"Intent '{intent}' answered without LLM")
+                return {'intent': intent, 'reply': reply}
+        self._record(None)
+        return None
+
+    def _record(self, intent, failed: bool = False):
+        """Increment shared hit/failure counters (works across workers with a shared cache)."""
+        if failed:
+            keys = ['intent_router:errors', f'intent_router:errors:{intent}']
+        else:
+            keys = ['intent_router:total']
+            if intent:
+                keys += ['intent_router:hits', f'intent_router:hits:{intent}']
+        for key in keys:
+            cache.add(key, 0, self.STATS_TTL)
+            try:
+                cache.incr(key)
+            except ValueError:
+                pass
+
+    def stats(self) -> dict:
+        """Hit rate of the router (share of messages that skipped the LLM)."""
+        total = cache.get('intent_router:total', 0)
+        hits = cache.get('intent_router:hits', 0)
+        intents = set(self.rules) | {i for extra in self.business_type_rules.values() for i in extra}
+        return {
+            'total': total,
+            'hits': hits,
+            'hit_rate': round(hits / total, 4) if total else 0.0,
+            'by_intent': {i: cache.get(f'intent_router:hits:{i}', 0) for i in sorted(intents)},
+            'errors': cache.get('intent_router:errors', 0),
+            'errors_by_intent': {i: cache.get(f'intent_router:errors:{i}', 0) for i in sorted(intents)},
+        }
+
+
+def business_context(business) -> str:
+    """ai_context of a business as compiled in the prompt cache (no query on a hit)."""
+    if business is None:
+        return ''
+    from .prompts import compiled_for
+
+    return '\n'.join(section['text'] for section in compiled_for(business)['sections'])
+
+
+def extract_context_section(context: str, keywords: list) -> str:
+    """Return the lines of ai_context that mention any of the keywords."""
+    if not context:
+        return ''
+    lines = [line.strip() for line in context.splitlines() if line.strip()]
+    wanted = [normalize_text(k) for k in keywords]
+    return '\n'.join(line for line in lines if any(k in normalize_text(line) for k in wanted))
+
+
+router = IntentRouter()
+
+
+@router.register('pay')
+def pay_handler(text, business):
+    from payments.paypal import create_order, approval_link
+
+    order = create_order(10)
+    return f'Paga aquí: {approval_link(order)}'
+
+
+@router.register('hours')
+def hours_handler(text, business):
+    section = extract_context_section(business_context(business), ['horario', 'abrimos', 'atencion'])
+    return f'Nuestro horario:\n{section}' if section else None
+
+
+@router.register('menu')
+def menu_handler(text, business):
+    section = extract_context_section(
+        business_context(business),
+        ['menu', 'carta', 'precio', 'catalogo', 'tarifa', '$'],
+    )
+    return f'Esto es lo que ofrecemos:\n{section}' if section else None
+
+
+@router.register('booking')
+def booking_handler(text, business):
+    name = getattr(business, 'name', None)
+    greeting = f'¡Con gusto te ayudamos a reservar en {name}!' if name else '¡Con gusto te ayudamos a reservar!'
+    return f'{greeting} Indícanos el día, la hora y tu nombre, y te confirmamos la disponibilidad.'
@@ -0,0 +1,67 @@
+import re
+import time
+from types import SimpleNamespace
+from django.core.management.base import BaseCommand
+import ai.services as ai_services
+from ai.services import AIService
+
+SAMPLE_TEXTS = [
+    'Excelente servicio, muy amables, gracias!',
+    'El pedido llegó frío y tarde, pésimo',
+    '¿A qué hora abren mañana?',
+    'Me encanta la pizza de ustedes',
+    'Quiero hacer un reclamo por el cobro',
+    'Ok, lo reviso y les aviso',
+    'No fue tan bueno como esperaba',
+    'Necesito cambiar la dirección de entrega',
+]
+
+
+class FakeGroqClient:
+    """Offline stand-in for the Groq client that simulates network latency."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, messages, **kwargs):
+        time.sleep(self.latency)
+        items = len(re.findall(r'^\d+\. ', messages[-1]['content'], re.MULTILINE)) or 1
+        content = '[' + ', '.join(['"neutral"'] * items) + ']' if items > 1 else 'neutral'
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class Command(BaseCommand):
+    help = 'Benchmark sentiment analysis throughput (texts/second), batch vs one call per text'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500, help='Number of texts')
+        parser.add_argument('--fake-latency', type=float, default=None,
+                            help='Use an offline fake client with this latency in seconds per call')
+        parser.add_argument('--baseline', action='store_true',
+                            help='Also measure analyze_sentiment (one call per text)')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        texts = [SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)] + f' #{i}' for i in range(count)]
+
+        if options['fake_latency'] is not None:
+            ai_services.model_router.client = FakeGroqClient(options['fake_latency'])
+            self.stdout.write(f"Using fake client ({options['fake_latency']}s per call)")
+
+        if options['baseline']:
+            start = time.perf_counter()
+            for text in texts:
+                AIService.analyze_sentiment(text)
+            self._report('One call per text', count, time.perf_counter() - start, count)
+
+        for use_lexicon, label in ((False, 'Batch (LLM only)'), (True, 'Batch + lexicon')):
+            start = time.perf_counter()
+            result = AIService.analyze_sentiment_batch(texts, use_lexicon=use_lexicon)
+            self._report(label, count, time.perf_counter() - start, result['llm_calls'], result['local'])
+
+    def _report(self, label, count, elapsed, llm_calls, local=0):
+        self.stdout.write(self.style.SUCCESS(
+            f'{label}: {count / elapsed:,.1f} texts/s '
+            f'({elapsed:.2f}s, {llm_calls} LLM calls, {local} resolved locally)'
+        ))
@@ -0,0 +1,56 @@
+import os
+import re
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Lo que importa un worker al arrancar: settings + apps + URLs (vistas, servicios, clientes)
+STARTUP_SCRIPT = 'import django; django.setup(); import core.urls'
+
+IMPORTTIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark process startup: wall time of a fresh interpreter running django.setup() '
+        'and loading the URLconf, plus the slowest imports (python -X importtime)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters to time')
+        parser.add_argument('--top', type=int, default=15, help='Slowest top-level imports to list')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'core.settings'))
+        cwd = str(settings.BASE_DIR)
+
+        timings = []
+        for _ in range(options['runs']):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=cwd, env=env, check=True)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        self.stdout.write(self.style.SUCCESS(
+            f"Startup: min {timings[0] * 1000:.0f} ms, "
+            f"median {timings[len(timings) // 2] * 1000:.0f} ms ({len(timings)} runs)"
+        ))
+
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+                                cwd=cwd, env=env, check=True, capture_output=True, text=True)
+        self._report_imports(result.stderr, options['top'])
+
+    def _report_imports(self, output, top):
+        # Solo módulos de primer nivel (sin sangría): su tiempo acumulado incluye sus dependencias
+        imports = []
+        for line in output.splitlines():
+            match = IMPORTTIME.match(line)
+            if match and len(match.group(3)) == 1:
+                imports.append((int(match.group(2)), match.group(4)))
+        imports.sort(reverse=True)
+
+        total = sum(cumulative for cumulative, _ in imports)
+        self.stdout.write(f'Import time: {total / 1000:.0f} ms in {len(imports)} top-level modules')
+        for cumulative, module in imports[:top]:
+            self.stdout.write(f'  {cumulative / 1000:8.1f} ms  {module}')
@@ -0,0 +1,77 @@
+from django.db import models
+
+
+class Conversation(models.Model):
+    """WhatsApp conversation between a business and a customer."""
+    
+    business = models.ForeignKey(
+        'users.Business',
+        on_delete=models.CASCADE,
+        related_name='conversations'
+    )
+    customer_phone = models.CharField(max_length=20)
+    
+    # Resumen incremental de los turnos antiguos
+    summary = models.TextField(blank=True)
+    summarized_until = models.BigIntegerField(default=0, help_text="Último turno incluido en el resumen")
+    pending_tokens = models.IntegerField(default=0, help_text="Tokens de turnos aún sin resumir")
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['business', 'customer_phone'], name='unique_conversation'),
+        ]
+    
+    def __str__(self):
+        return f"{self.customer_phone} @ {self.business_id}"
+
+
+class ConversationTurn(models.Model):
+    """One message of a conversation (append-only)."""
+    
+    ROLE_CHOICES = [
+        ('user', 'User'),
+        ('assistant', 'Assistant'),
+    ]
+    
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='turns'
+    )
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    content = models.TextField()
+    tokens = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', '-id']),
+        ]
+
+
+class CompiledPrompt(models.Model):
+    """System prompt of a business, compiled from business_type + ai_context on save."""
+    
+    business = models.OneToOneField(
+        'users.Business',
+        on_delete=models.CASCADE,
+        related_name='compiled_prompt'
+    )
+    version = models.PositiveIntegerField(default=1, help_text="Se incrementa en cada compilación")
+    compiler_version = models.PositiveIntegerField(default=1)
+    source_hash = models.CharField(max_length=64)
+    
+    # Encabezado fijo (tipo de negocio + instrucciones) y secciones del contexto
+    header = models.TextField()
+    header_tokens = models.PositiveIntegerField(default=0)
+    sections = models.JSONField(default=list, help_text="[{text, tokens, terms}] en el orden original")
+    total_tokens = models.PositiveIntegerField(default=0)
+    token_budget = models.PositiveIntegerField(default=0, help_text="Tokens de sistema permitidos por el plan")
+    
+    compiled_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.business_id} v{self.version} ({self.total_tokens} tokens)"
@@ -0,0 +1,241 @@
+"""
+Per-business prompt compiler.
+
+business_type + ai_context are compiled once (on save) into a fixed header
+and a list of token-counted sections. At reply time the full prompt is used
+when it fits the plan's token budget; longer contexts only send the
+sections relevant to the customer's message.
+"""
+import logging
+import re
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .cache import content_hash
+from .intents import normalize_text
+from .models import CompiledPrompt
+from .similarity import STOPWORDS
+from .tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Subir al cambiar el formato del prompt compilado: los prompts viejos se recompilan solos
+COMPILER_VERSION = 1
+
+PROMPT_CACHE_TTL = 60 * 60 * 24
+
+BUSINESS_TYPE_PROMPTS = {
+    'generic': "Eres el asistente de WhatsApp de {name}.",
+    'transport': "Eres el asistente de WhatsApp de {name}, un servicio de transporte. Ayuda con rutas, horarios, tarifas y reservas.",
+    'restaurant': "Eres el asistente de WhatsApp de {name}, un restaurante. Ayuda con el menú, precios, horarios, pedidos y reservaciones.",
+    'store': "Eres el asistente de WhatsApp de {name}, una tienda. Ayuda con productos, precios, existencias, envíos y pagos.",
+    'medical': "Eres el asistente de WhatsApp de {name}, un consultorio médico. Ayuda con citas, horarios y servicios; nunca des diagnósticos.",
+    'barbershop': "Eres el asistente de WhatsApp de {name}, una barbería. Ayuda con servicios, precios, horarios y citas.",
+}
+
+INSTRUCTIONS = (
+    "Responde en español, breve y amable. Usa solo la información del negocio; "
+    "si no la tienes, dilo y ofrece comunicar al cliente con una persona."
+)
+
+CONTEXT_HEADER = "\n\nInformación del negocio:\n"
+
+# Una línea que termina en ':' o empieza con '#' abre una sección nueva
+_HEADING_RE = re.compile(r'^\s*(#+\s*.+|[^.!?]{2,60}:)\s*$')
+
+
+def terms(text: str) -> set:
+    """Meaningful words of a text, accent-free and cut to a 5-letter stem (taco/tacos)."""
+    words = re.findall(r'\w+', normalize_text(text))
+    return {word[:5] for word in words if word not in STOPWORDS and len(word) > 2}
+
+
+def split_sections(context: str) -> list:
+    """Split ai_context into sections at blank lines and heading lines."""
+    sections, current = [], []
+    for line in (context or '').splitlines():
+        if not line.strip() or _HEADING_RE.match(line):
+            if current:
+                sections.append('\n'.join(current))
+            current = [line.strip()] if line.strip() else []
+            continue
+        current.append(line.strip())
+    if current:
+        sections.append('\n'.join(current))
+    return sections
+
+
+def plan_budget(owner_id: int, use_cache: bool = True) -> int:
+    """System-prompt tokens allowed by the owner's plan (no active plan = basic)."""
+    from users.metering import owner_plan
+
+    budgets = settings.AI_PROMPT_TOKEN_BUDGETS
+    return budgets.get(owner_plan(owner_id, use_cache), budgets['basic'])
+
+
+def compile_prompt(business, force: bool = False) -> CompiledPrompt:
+    """
+    Compile and store the system prompt of a business.
+    
+    Skips the work when business_type/name/ai_context did not change
+    since the stored compilation (unless force=True).
+    """
+    source_hash = content_hash(business.ai_context or '', {
+        'type': business.business_type, 'name': business.name, 'compiler': COMPILER_VERSION,
+    })
+    compiled = CompiledPrompt.objects.filter(business_id=business.pk).first()
+    if compiled and compiled.source_hash == source_hash and not force:
+        return compiled
+    
+    template = BUSINESS_TYPE_PROMPTS.get(business.business_type, BUSINESS_TYPE_PROMPTS['generic'])
+    header = f"{template.format(name=business.name)} {INSTRUCTIONS}"
+    sections = [
+        {'text': text, 'tokens': count_tokens(text), 'terms': sorted(terms(text))}
+        for text in split_sections(business.ai_context)
+    ]
+    header_tokens = count_tokens(header) + (count_tokens(CONTEXT_HEADER) if sections else 0)
+    
+    if compiled is None:
+        compiled = CompiledPrompt(business_id=business.pk, version=0)
+    compiled.version += 1
+    compiled.compiler_version = COMPILER_VERSION
+    compiled.source_hash = source_hash
+    compiled.header = header
+    compiled.header_tokens = header_tokens
+    compiled.sections = sections
+    compiled.total_tokens = header_tokens + sum(section['tokens'] for section in sections)
+    compiled.token_budget = plan_budget(business.owner_id)
+    compiled.save()
+    
+    _cache_compiled(compiled)
+    logger.info(
+        f"Prompt compiled for business {business.pk} v{compiled.version}: "
+        f"{len(sections)} sections, {compiled.total_tokens} tokens"
+    )
+    return compiled
+
+
+def refresh_budgets(owner_ids):
+    """
+    Apply the current plan budget to the compiled prompts of these owners
+    (plan changes). The cached prompts are dropped after commit.
+    """
+    keys = []
+    for owner_id in owner_ids:
+        compiled = CompiledPrompt.objects.filter(business__owner_id=owner_id)
+        # El plan cacheado se invalida al confirmar: se lee de la base de datos
+        compiled.update(token_budget=plan_budget(owner_id, use_cache=False))
+        keys.extend(_cache_key(business_id) for business_id in compiled.values_list('business_id', flat=True))
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _cache_key(business_id):
+    return f'ai_prompt:{business_id}'
+
+
+def _cache_compiled(compiled: CompiledPrompt) -> dict:
+    data = {
+        'version': compiled.version,
+        'compiler_version': compiled.compiler_version,
+        'header': compiled.header,
+        'header_tokens': compiled.header_tokens,
+        'sections': compiled.sections,
+        'total_tokens': compiled.total_tokens,
+        'token_budget': compiled.token_budget,
+    }
+    cache.set(_cache_key(compiled.business_id), data, PROMPT_CACHE_TTL)
+    return data
+
+
+def forget_compiled(business_id: int):
+    cache.delete(_cache_key(business_id))
+
+
+def compiled_for(business) -> dict:
+    """Compiled prompt of a business from the cache (loaded or compiled on a miss)."""
+    data = cache.get(_cache_key(business.pk))
+    if data is not None and data['compiler_version'] == COMPILER_VERSION:
+        return data
+    compiled = CompiledPrompt.objects.filter(business_id=business.pk).first()
+    if compiled is None or compiled.compiler_version != COMPILER_VERSION:
+        compiled = compile_prompt(business, force=True)
+    return _cache_compiled(compiled)
+
+
+def render_prompt(compiled: dict, message: str) -> str:
+    """
+    System prompt for one message, within the compiled token budget.
+    
+    Sections are ranked by the terms they share with the message and
+    added best-first while they fit; they are emitted in their original
+    order. With no overlap, the leading sections are kept (the start of a
+    context usually describes the business).
+    """
+    sections = compiled['sections']
+    if not sections:
+        return compiled['header']
+    budget = compiled['token_budget']
+    if compiled['total_tokens'] <= budget:
+        return compiled['header'] + CONTEXT_HEADER + '\n\n'.join(s['text'] for s in sections)
+    
+    wanted = terms(message)
+    scores = [len(wanted.intersection(section['terms'])) for section in sections]
+    order = sorted(range(len(sections)), key=lambda i: (-scores[i], i))
+    
+    remaining = budget - compiled['header_tokens']
+    chosen = {}
+    for i in order:
+        if sections[i]['tokens'] <= remaining:
+            chosen[i] = sections[i]['text']
+            remaining -= sections[i]['tokens']
+        elif scores[i]:
+            # Sección relevante pero enorme (p. ej. un catálogo): solo las líneas que coinciden
+            excerpt = trim_section(sections[i]['text'], wanted, remaining)
+            if excerpt:
+                chosen[i] = excerpt
+                remaining -= count_tokens(excerpt)
+    
+    if not chosen:
+        return compiled['header']
+    return compiled['header'] + CONTEXT_HEADER + '\n\n'.join(chosen[i] for i in sorted(chosen))
+
+
+def trim_section(text: str, wanted: set, budget: int) -> str:
+    """Heading plus the lines of a section that best match the message, within budget."""
+    lines = text.splitlines()
+    heading = lines[0] if _HEADING_RE.match(lines[0]) else None
+    body = lines[1:] if heading else lines
+    used = count_tokens(heading) if heading else 0
+    
+    scored = [(len(wanted.intersection(terms(line))), i) for i, line in enumerate(body)]
+    kept = []
+    for score, i in sorted(scored, key=lambda item: (-item[0], item[1])):
+        tokens = count_tokens(body[i])
+        if not score or used + tokens > budget:
+            break
+        kept.append(i)
+        used += tokens
+    
+    if not kept:
+        return ''
+    return '\n'.join(([heading] if heading else []) + [body[i] for i in sorted(kept)])
+
+
+def prompt_version(compiled: dict) -> str:
+    """
+    Identity of a compiled prompt for the reply caches: the rendered prompt
+    depends on the message, so replies are keyed by the compilation instead
+    (it changes on recompile and on plan budget changes).
+    """
+    return f"prompt:{compiled['version']}:{compiled['compiler_version']}:{compiled['token_budget']}"
+
+
+def system_prompt_for(business, message: str) -> str:
+    """Compiled, budgeted system prompt of a business for a customer message."""
+    return render_prompt(compiled_for(business), message)
+
+
+def business_prompt(business, message: str) -> tuple:
+    """(system prompt for the message, prompt_version() for the reply caches)."""
+    compiled = compiled_for(business)
+    return render_prompt(compiled, message), prompt_version(compiled)
@@ -0,0 +1,298 @@
+"""
+Resilience layer shared by every Groq call.
+
+- ConcurrencyLimiter: per-process semaphore plus a cluster-wide Redis
+  semaphore, so a Groq slowdown cannot pile up every worker on it.
+- CircuitBreaker: opens when too many recent calls fail or are slow; while
+  open, calls fail immediately (AIUnavailable) and AIService answers with a
+  degraded reply instead of waiting.
+- Deadline: every call has a total time budget shared by its retries and
+  failover attempts.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+import weakref
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+DEGRADED_REPLY = (
+    "Gracias por tu mensaje. Estamos con mucha demanda en este momento; "
+    "te responderemos en unos minutos."
+)
+
+
+class AIUnavailable(Exception):
+    """The model provider is not being called (breaker open, no free slot or deadline exceeded)."""
+
+
+class Deadline:
+    """Time budget of one logical call."""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def check(self):
+        if self.remaining() <= 0:
+            raise AIUnavailable("Deadline exceeded")
+
+
+class CircuitBreaker:
+    """
+    Closed -> open when the failure rate of the last calls (slow calls count
+    as failures) crosses the threshold; open -> half-open after the
+    cooldown, where one probe decides whether to close again.
+
+    The open state is also published in the cache so every worker stops
+    calling the provider, not only the one that saw the errors.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = self.CLOSED
+        self.outcomes = deque(maxlen=settings.AI_BREAKER_WINDOW)
+        self.opened_until = 0.0
+        self.opened_count = 0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def _shared_key(self):
+        return f'ai_breaker:{self.name}:open'
+
+    def allow(self) -> bool:
+        """Whether a call may go to the provider now."""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == self.CLOSED:
+                if not cache.get(self._shared_key):
+                    return True
+                self._open(now, publish=False)
+            if self.state == self.OPEN and now >= self.opened_until:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def cancel(self):
+        """A permitted call never reached the provider (e.g. no free slot): free the probe."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+
+    def record(self, ok: bool, latency_ms: float = 0.0):
+        slow = latency_ms > settings.AI_BREAKER_SLOW_MS
+        success = ok and not slow
+        now = time.monotonic()
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                if success:
+                    self.state = self.CLOSED
+                    self.outcomes.clear()
+                    cache.delete(self._shared_key)
+                    logger.info(f"Circuit breaker {self.name} closed")
+                else:
+                    self._open(now)
+                return
+
+            self.outcomes.append(success)
+            failures = self.outcomes.count(False)
+            if (self.state == self.CLOSED
+                    and len(self.outcomes) >= settings.AI_BREAKER_MIN_CALLS
+                    and failures / len(self.outcomes) >= settings.AI_BREAKER_FAILURE_RATE):
+                self._open(now)
+
+    def _open(self, now: float, publish: bool = True):
+        self.state = self.OPEN
+        self.opened_until = now + settings.AI_BREAKER_COOLDOWN
+        self.opened_count += 1
+        self.outcomes.clear()
+        if publish:
+            cache.set(self._shared_key, 1, settings.AI_BREAKER_COOLDOWN)
+            logger.warning(f"Circuit breaker {self.name} opened for {settings.AI_BREAKER_COOLDOWN}s")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'state': self.state,
+                'state_code': {self.CLOSED: 0, self.HALF_OPEN: 1, self.OPEN: 2}[self.state],
+                'opened': self.opened_count,
+                'rejected': self.rejected,
+                'recent_failures': self.outcomes.count(False),
+                'recent_calls': len(self.outcomes),
+            }
+
+
+class ConcurrencyLimiter:
+    """Per-process semaphore plus an optional cluster-wide Redis semaphore."""
+
+    def __init__(self, name: str, local_limit: int, cluster_limit: int = 0):
+        self.name = name
+        self.local_limit = local_limit
+        self.cluster_limit = cluster_limit
+        self._local = threading.BoundedSemaphore(local_limit)
+        self._async_semaphores = weakref.WeakKeyDictionary()
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def _key(self):
+        return f'ai_semaphore:{self.name}'
+
+    @contextmanager
+    def slot(self, deadline: Deadline):
+        """Hold one slot for the duration of a call; AIUnavailable if none frees up in time."""
+        wait = min(settings.AI_CONCURRENCY_WAIT, deadline.remaining())
+        if not self._local.acquire(timeout=wait):
+            self._reject()
+        token = None
+        try:
+            if self.cluster_limit:
+                token = self._acquire_cluster(deadline)
+            with self._lock:
+                self.in_flight += 1
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+        finally:
+            if token:
+                self._release_cluster(token)
+            self._local.release()
+
+    @asynccontextmanager
+    async def aslot(self, deadline: Deadline):
+        """Async variant of slot() for the ASGI path (asyncio semaphore per event loop)."""
+        semaphore = self._async_semaphore()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), min(settings.AI_CONCURRENCY_WAIT, deadline.remaining()))
+        except asyncio.TimeoutError:
+            self._reject()
+        token = None
+        try:
+            if self.cluster_limit:
+                token = await self._aacquire_cluster(deadline)
+            with self._lock:
+                self.in_flight += 1
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+        finally:
+            if token:
+                await sync_to_async(self._release_cluster, thread_sensitive=False)(token)
+            semaphore.release()
+
+    def _async_semaphore(self) -> asyncio.Semaphore:
+        # Un proceso ASGI atiende cientos de llamadas: su límite propio es AI_MAX_ASYNC_CONCURRENCY
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_semaphores:
+            self._async_semaphores[loop] = asyncio.Semaphore(settings.AI_MAX_ASYNC_CONCURRENCY)
+        return self._async_semaphores[loop]
+
+    def _reject(self):
+        with self._lock:
+            self.rejected += 1
+        raise AIUnavailable(f"No free {self.name} slot")
+
+    def _acquire_cluster(self, deadline: Deadline):
+        """
+        Sorted-set semaphore: add a timestamped token and keep it only if it
+        ranks within the limit. Tokens of crashed holders expire after the
+        call timeout.
+        """
+        token = uuid.uuid4().hex
+        give_up = time.monotonic() + min(settings.AI_CONCURRENCY_WAIT, deadline.remaining())
+        try:
+            while not self._try_cluster(token):
+                if time.monotonic() >= give_up:
+                    self._reject()
+                time.sleep(0.05)
+        except AIUnavailable:
+            raise
+        except Exception as e:
+            # Sin Redis solo queda el límite local (mejor que bloquear todo)
+            logger.warning(f"Cluster semaphore unavailable: {str(e)}")
+            return None
+        return token
+
+    async def _aacquire_cluster(self, deadline: Deadline):
+        """_acquire_cluster() that waits on the event loop, not in a worker thread."""
+        token = uuid.uuid4().hex
+        give_up = time.monotonic() + min(settings.AI_CONCURRENCY_WAIT, deadline.remaining())
+        try_cluster = sync_to_async(self._try_cluster, thread_sensitive=False)
+        try:
+            while not await try_cluster(token):
+                if time.monotonic() >= give_up:
+                    self._reject()
+                await asyncio.sleep(0.05)
+        except AIUnavailable:
+            raise
+        except Exception as e:
+            logger.warning(f"Cluster semaphore unavailable: {str(e)}")
+            return None
+        return token
+
+    def _try_cluster(self, token: str) -> bool:
+        """One attempt to take a cluster slot with ``token``."""
+        r = get_redis()
+        now = time.time()
+        pipe = r.pipeline()
+        pipe.zremrangebyscore(self._key, '-inf', now - settings.AI_CALL_TIMEOUT - 5)
+        pipe.zadd(self._key, {token: now})
+        pipe.zrank(self._key, token)
+        pipe.expire(self._key, int(settings.AI_CALL_TIMEOUT) + 5)
+        rank = pipe.execute()[2]
+        if rank is not None and rank < self.cluster_limit:
+            return True
+        r.zrem(self._key, token)
+        return False
+
+    def _release_cluster(self, token: str):
+        try:
+            get_redis().zrem(self._key, token)
+        except Exception as e:
+            logger.warning(f"Error releasing cluster semaphore: {str(e)}")
+
+    def stats(self) -> dict:
+        stats = {
+            'in_flight': self.in_flight,
+            'local_limit': self.local_limit,
+            'cluster_limit': self.cluster_limit,
+            'rejected': self.rejected,
+        }
+        if self.cluster_limit:
+            try:
+                stats['cluster_in_flight'] = get_redis().zcard(self._key)
+            except Exception:
+                stats['cluster_in_flight'] = None
+        return stats
+
+
+breaker = CircuitBreaker('groq')
+limiter = ConcurrencyLimiter(
+    'groq',
+    local_limit=settings.AI_MAX_CONCURRENCY,
+    cluster_limit=settings.AI_CLUSTER_CONCURRENCY,
+)
@@ -0,0 +1,265 @@
+"""
+Model routing for Groq calls.
+
+Each call type maps to a tier (fast/large); replies are tiered by message
+complexity and capped by the tenant's plan. Every model keeps a rolling
+window of latencies and errors; a model whose p95 or error rate crosses
+the thresholds is skipped for a cooldown and the next model of the tier
+takes over.
+"""
+import logging
+import math
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from .resilience import AIUnavailable, Deadline, breaker, limiter
+from .tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Tier por tipo de llamada ('reply' se decide por complejidad)
+CALL_TIERS = {
+    'classify': 'fast',
+    'summary': 'fast',
+    'description': 'large',
+    'chat': 'large',
+}
+
+_QUESTION_MARKERS = ('?', '¿', ' por que ', ' porque ', ' como ', ' cuanto ', ' explica')
+
+
+def reply_tier(text: str) -> str:
+    """Short, single-question messages go to the fast tier; longer ones to the large tier."""
+    tokens = count_tokens(text)
+    if tokens <= settings.AI_ROUTER_SHORT_TOKENS:
+        return 'fast'
+    questions = sum(text.lower().count(marker) for marker in _QUESTION_MARKERS)
+    if tokens <= settings.AI_ROUTER_SHORT_TOKENS * 3 and questions <= 1:
+        return 'fast'
+    return 'large'
+
+
+class ModelStats:
+    """Rolling latency/error window of one model."""
+
+    def __init__(self, window: int):
+        self.samples = deque(maxlen=window)  # (latency_ms, ok)
+        self.calls = 0
+        self.errors = 0
+        self.tripped_until = 0.0
+
+    def record(self, latency_ms: float, ok: bool):
+        self.samples.append((latency_ms, ok))
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+
+    def p95(self) -> float:
+        latencies = sorted(latency for latency, ok in self.samples if ok)
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, math.ceil(0.95 * len(latencies)) - 1)]
+
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+
+class ModelRouter:
+    """
+    Pick the model for a call and fail over when it is slow or failing.
+
+    Args:
+        client: Groq-compatible client (``client.chat.completions.create``);
+            tests assign a fake that simulates latency and errors.
+        async_client: AsyncGroq-compatible client used by acreate() (ASGI path)
+        client_factory: Zero-argument callable that builds the client on
+            first use, when no client was given (keeps startup cheap)
+        async_client_factory: Same for async_client
+    """
+
+    def __init__(self, client=None, async_client=None, tiers: dict = None, window: int = None,
+                 client_factory=None, async_client_factory=None):
+        self._client = client
+        self._async_client = async_client
+        self.client_factory = client_factory
+        self.async_client_factory = async_client_factory
+        self.tiers = tiers or settings.AI_MODEL_TIERS
+        self.window = window or settings.AI_ROUTER_WINDOW
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._build('_client', self.client_factory)
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = self._build('_async_client', self.async_client_factory)
+        return self._async_client
+
+    @async_client.setter
+    def async_client(self, value):
+        self._async_client = value
+
+    def _build(self, attr: str, factory):
+        # Un solo hilo construye el cliente; los demás esperan y lo reutilizan
+        with self._client_lock:
+            client = getattr(self, attr)
+            if client is None:
+                if factory is None:
+                    raise ImproperlyConfigured(f"ModelRouter has no {attr.lstrip('_')} or factory")
+                client = factory()
+            return client
+
+    def tier_for(self, call_type: str, text: str = None, plan: str = None) -> str:
+        tier = CALL_TIERS.get(call_type) or reply_tier(text or '')
+        # El plan puede limitar el tier máximo (p. ej. básico -> solo 'fast')
+        if tier == 'large' and settings.AI_PLAN_MAX_TIER.get(plan) == 'fast':
+            return 'fast'
+        return tier
+
+    def candidates(self, tier: str) -> list:
+        """Models of a tier, healthy ones first (in configured order)."""
+        models = list(self.tiers[tier])
+        healthy = [model for model in models if self.is_healthy(model)]
+        return healthy + [model for model in models if model not in healthy]
+
+    def is_healthy(self, model: str) -> bool:
+        with self._lock:
+            stats = self._stats.get(model)
+            if stats is None:
+                return True
+            now = time.monotonic()
+            if stats.tripped_until > now:
+                return False
+            if stats.tripped_until:
+                # Fin del enfriamiento: se le da otra oportunidad con ventana limpia
+                stats.tripped_until = 0.0
+                stats.samples.clear()
+                return True
+            if len(stats.samples) < settings.AI_ROUTER_MIN_SAMPLES:
+                return True
+            if stats.p95() > settings.AI_ROUTER_MAX_P95_MS or stats.error_rate() > settings.AI_ROUTER_MAX_ERROR_RATE:
+                stats.tripped_until = now + settings.AI_ROUTER_COOLDOWN
+                logger.warning(
+                    f"Model {model} degraded (p95 {stats.p95():.0f} ms, errors {stats.error_rate():.0%}); "
+                    f"failing over for {settings.AI_ROUTER_COOLDOWN}s"
+                )
+                return False
+            return True
+
+    def record(self, model: str, latency_ms: float, ok: bool):
+        with self._lock:
+            stats = self._stats.get(model)
+            if stats is None:
+                stats = self._stats[model] = ModelStats(self.window)
+            stats.record(latency_ms, ok)
+
+    def create(self, call_type: str, messages: list, text: str = None, plan: str = None,
+               tier: str = None, **params):
+        """
+        Run ``chat.completions.create`` on the best model for the call.
+
+        Tries the models of the tier in order until one answers, all within
+        one deadline (AI_CALL_TIMEOUT) and one concurrency slot; the last
+        error is raised if all fail. Raises AIUnavailable without calling
+        the provider while the circuit breaker is open. For ``stream=True``
+        the slot and the latency cover the time until the stream opens.
+
+        Returns:
+            (response, model)
+        """
+        if not breaker.allow():
+            raise AIUnavailable("Circuit breaker open")
+        tier = tier or self.tier_for(call_type, text, plan)
+        deadline = Deadline(settings.AI_CALL_TIMEOUT)
+        last_error = None
+        try:
+            with limiter.slot(deadline):
+                for model in self.candidates(tier):
+                    if not deadline.remaining():
+                        break
+                    started = time.monotonic()
+                    try:
+                        response = self.client.chat.completions.create(
+                            model=model, messages=messages, timeout=deadline.remaining(), **params
+                        )
+                    except Exception as e:
+                        self.record(model, (time.monotonic() - started) * 1000, False)
+                        logger.warning(f"Model {model} failed for {call_type}: {str(e)}")
+                        last_error = e
+                        continue
+                    latency_ms = (time.monotonic() - started) * 1000
+                    self.record(model, latency_ms, True)
+                    breaker.record(True, latency_ms)
+                    return response, model
+        except AIUnavailable:
+            breaker.cancel()
+            raise
+        breaker.record(False)
+        raise last_error or AIUnavailable("Deadline exceeded")
+
+    async def acreate(self, call_type: str, messages: list, text: str = None, plan: str = None,
+                      tier: str = None, **params):
+        """Async create() on ``async_client``: same tiers, stats, breaker and deadline."""
+        if not breaker.allow():
+            raise AIUnavailable("Circuit breaker open")
+        tier = tier or self.tier_for(call_type, text, plan)
+        deadline = Deadline(settings.AI_CALL_TIMEOUT)
+        last_error = None
+        try:
+            async with limiter.aslot(deadline):
+                for model in self.candidates(tier):
+                    if not deadline.remaining():
+                        break
+                    started = time.monotonic()
+                    try:
+                        response = await self.async_client.chat.completions.create(
+                            model=model, messages=messages, timeout=deadline.remaining(), **params
+                        )
+                    except Exception as e:
+                        self.record(model, (time.monotonic() - started) * 1000, False)
+                        logger.warning(f"Model {model} failed for {call_type}: {str(e)}")
+                        last_error = e
+                        continue
+                    latency_ms = (time.monotonic() - started) * 1000
+                    self.record(model, latency_ms, True)
+                    breaker.record(True, latency_ms)
+                    return response, model
+        except AIUnavailable:
+            breaker.cancel()
+            raise
+        breaker.record(False)
+        raise last_error or AIUnavailable("Deadline exceeded")
+
+    def stats(self) -> dict:
+        """Per-model calls, errors, rolling p95 and health."""
+        with self._lock:
+            snapshot = {
+                model: {
+                    'calls': stats.calls,
+                    'errors': stats.errors,
+                    'p95_ms': round(stats.p95(), 1),
+                    'error_rate': round(stats.error_rate(), 4),
+                    'tripped': stats.tripped_until > time.monotonic(),
+                }
+                for model, stats in self._stats.items()
+            }
+        return {
+            'tiers': self.tiers,
+            'models': snapshot,
+            'breaker': breaker.stats(),
+            'concurrency': limiter.stats(),
+        }
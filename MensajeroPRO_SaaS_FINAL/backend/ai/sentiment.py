@@ -0,0 +1,100 @@
+import json
+import logging
+import re
+from .intents import normalize_text
+from .tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+LABELS = ('positivo', 'negativo', 'neutral')
+
+# Léxico básico (texto normalizado, sin tildes)
+POSITIVE_WORDS = {
+    'gracias': 1, 'excelente': 2, 'genial': 2, 'bueno': 1, 'buena': 1, 'buenisimo': 2,
+    'perfecto': 2, 'encanta': 2, 'encanto': 2, 'feliz': 2, 'contento': 2, 'contenta': 2,
+    'recomendado': 2, 'recomiendo': 2, 'rapido': 1, 'amable': 1, 'delicioso': 2, 'rico': 1,
+    'increible': 2, 'mejor': 1, 'satisfecho': 2, 'satisfecha': 2, 'chevere': 2,
+}
+NEGATIVE_WORDS = {
+    'malo': 2, 'mala': 2, 'pesimo': 3, 'pesima': 3, 'terrible': 3, 'horrible': 3, 'queja': 2,
+    'reclamo': 2, 'lento': 1, 'tarde': 1, 'frio': 1, 'caro': 1, 'molesto': 2, 'molesta': 2,
+    'decepcion': 2, 'decepcionado': 2, 'peor': 2, 'estafa': 3, 'devolucion': 1,
+    'cancelar': 1, 'problema': 1, 'error': 1, 'sucio': 2, 'grosero': 2, 'odio': 3,
+}
+NEGATIONS = {'no', 'ni', 'nunca', 'nada', 'tampoco', 'sin'}
+INTENSIFIERS = {'muy': 2, 'super': 2, 'demasiado': 2, 'tan': 1.5, 'bastante': 1.5}
+
+# Umbral a partir del cual el léxico decide sin consultar al modelo
+LEXICON_THRESHOLD = 2
+
+
+def lexicon_score(text: str) -> float:
+    """Signed lexicon score of a text (negations flip, intensifiers amplify)."""
+    words = re.findall(r'\w+', normalize_text(text))
+    score = 0.0
+    for i, word in enumerate(words):
+        weight = POSITIVE_WORDS.get(word, 0) - NEGATIVE_WORDS.get(word, 0)
+        if not weight:
+            continue
+        previous = words[max(0, i - 3):i]
+        for prev in previous:
+            weight *= INTENSIFIERS.get(prev, 1)
+        if any(prev in NEGATIONS for prev in previous):
+            weight = -weight
+        score += weight
+    return score
+
+
+def classify_local(text: str):
+    """
+    Resolve obvious cases with the lexicon.
+
+    Returns:
+        'positivo', 'negativo' or None when the text is ambiguous
+    """
+    score = lexicon_score(text)
+    if score >= LEXICON_THRESHOLD:
+        return 'positivo'
+    if score <= -LEXICON_THRESHOLD:
+        return 'negativo'
+    return None
+
+
+def chunk_by_tokens(items: list, max_tokens: int, max_items: int) -> list:
+    """Split (index, text) pairs into chunks that fit a prompt token budget."""
+    chunks, current, used = [], [], 0
+    for index, text in items:
+        tokens = count_tokens(text) + 4  # numeración y separadores
+        if current and (used + tokens > max_tokens or len(current) >= max_items):
+            chunks.append(current)
+            current, used = [], 0
+        current.append((index, text))
+        used += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def build_batch_prompt(texts: list) -> str:
+    numbered = '\n'.join(f'{i + 1}. {text.replace(chr(10), " ")}' for i, text in enumerate(texts))
+    return f"""Analiza el sentimiento de cada uno de los siguientes textos numerados.
+Responde SOLO con un arreglo JSON con una etiqueta por texto, en el mismo orden, usando únicamente: positivo, negativo, neutral.
+Ejemplo para 3 textos: ["positivo", "neutral", "negativo"]
+
+{numbered}"""
+
+
+def parse_batch_labels(content: str, expected: int) -> list:
+    """Parse the model answer into `expected` labels (None for unparseable items)."""
+    labels = []
+    match = re.search(r'\[.*\]', content, re.DOTALL)
+    if match:
+        try:
+            labels = [str(label).strip().lower() for label in json.loads(match.group(0))]
+        except ValueError:
+            labels = []
+    if not labels:
+        # Formato alternativo: "1. positivo"
+        labels = [m.group(1) for m in re.finditer(r'(positivo|negativo|neutral)', content.lower())]
+    labels = [label if label in LABELS else None for label in labels[:expected]]
+    return labels + [None] * (expected - len(labels))
@@ -1,17 +1,44 @@
 import logging
-from groq import Groq
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
-from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from .cache import reply_cache
+from .routing import ModelRouter
+from .resilience import AIUnavailable, DEGRADED_REPLY
+from .similarity import similarity_cache
+from .sentiment import classify_local, chunk_by_tokens, build_batch_prompt, parse_batch_labels
 
 logger = logging.getLogger(__name__)
-client = Groq(api_key=settings.GROQ_API_KEY)
+
+
+def _groq_options() -> dict:
+    if not settings.GROQ_API_KEY:
+        raise ImproperlyConfigured("GROQ_API_KEY is not set")
+    # El plazo total por llamada lo controla el router; aquí solo un reintento rápido
+    return {'api_key': settings.GROQ_API_KEY, 'timeout': settings.AI_CALL_TIMEOUT, 'max_retries': 1}
+
+
+def groq_client():
+    """Groq client, built on the first model call (importing groq is slow)."""
+    from groq import Groq
+    return Groq(**_groq_options())
+
+
+def async_groq_client():
+    """AsyncGroq client for the ASGI path, built on first use."""
+    from groq import AsyncGroq
+    return AsyncGroq(**_groq_options())
+
+
+model_router = ModelRouter(client_factory=groq_client, async_client_factory=async_groq_client)
 
 
 class AIService:
     """Service for AI-powered responses using Groq (gratis!)."""
     
     @staticmethod
-    def generate_reply(message: str, context: str = None, max_tokens: int = 500) -> dict:
+    def generate_reply(message: str, context: str = None, max_tokens: int = 500,
+                       business_id: int = None, plan: str = None, context_key: str = None) -> dict:
         """
         Generate AI reply for a given message.
         
@@ -19,17 +46,38 @@ class AIService:
             message: User's message
             context: Optional context for the conversation
             max_tokens: Maximum tokens in response
+            business_id: Business the message belongs to (cache namespace)
+            plan: Plan of the business owner (may cap the model tier)
+            context_key: What the caches key the context by (the compiled
+                prompt version for business prompts); defaults to the context
             
         Returns:
             dict with 'reply' and 'success' keys
         """
         try:
+            # El caché se indexa por tier, no por modelo: un failover no lo fragmenta
+            params = {
+                "tier": model_router.tier_for("reply", message, plan),
+                "max_tokens": max_tokens,
+                "temperature": 0.7,
+            }
+            
+            # El prompt renderizado cambia con cada mensaje: se indexa por su compilación
+            scope = context_key or context
+            
             # Check cache first
-            cache_key = f"ai_reply_{hash(message)}"
-            cached_reply = cache.get(cache_key)
-            if cached_reply:
+            cached_reply = reply_cache.get(message, scope, business_id, **params)
+            if cached_reply is not None:
                 logger.info(f"Cache hit for message: {message[:50]}")
-                return {"reply": cached_reply, "success": True}
+                return {"reply": cached_reply, "success": True, "cached": True}
+            
+            # Near-duplicate question already answered?
+            if settings.AI_SIMILARITY_CACHE_ENABLED:
+                similar_reply = similarity_cache.lookup(message, scope, business_id, **params)
+                if similar_reply is not None:
+                    logger.info(f"Similarity cache hit for message: {message[:50]}")
+                    reply_cache.set(message, similar_reply, scope, business_id, **params)
+                    return {"reply": similar_reply, "success": True, "cached": True}
             
             # Build messages
             messages = []
@@ -38,21 +86,29 @@ class AIService:
             messages.append({"role": "user", "content": message})
             
             # Call Groq (API gratis, ultra rápida!)
-            response = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",  # Modelo gratis y potente
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=0.7,
-            )
+            response, model = model_router.create("reply", messages, **params)
             
             reply = response.choices[0].message.content
             
-            # Cache for 1 hour
-            cache.set(cache_key, reply, 3600)
+            reply_cache.set(message, reply, scope, business_id, **params)
+            if settings.AI_SIMILARITY_CACHE_ENABLED:
+                similarity_cache.add(message, reply, scope, business_id, **params)
             
             logger.info(f"AI reply generated successfully for message: {message[:50]}")
-            return {"reply": reply, "success": True}
+            return {
+                "reply": reply,
+                "usage": {
+                    "prompt_tokens": response.usage.prompt_tokens,
+                    "completion_tokens": response.usage.completion_tokens,
+                    "total_tokens": response.usage.total_tokens
+                },
+                "model": model,
+                "success": True
+            }
             
+        except AIUnavailable as e:
+            logger.warning(f"AI unavailable, degraded reply: {str(e)}")
+            return {"reply": DEGRADED_REPLY, "success": False, "degraded": True, "error": str(e)}
         except Exception as e:
             logger.error(f"Error generating AI reply: {str(e)}", exc_info=True)
             return {
@@ -72,9 +128,9 @@ Características:
 
 La descripción debe ser persuasiva, mencionar beneficios clave y tener un tono profesional."""
             
-            response = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[{"role": "user", "content": prompt}],
+            response, _ = model_router.create(
+                "description",
+                [{"role": "user", "content": prompt}],
                 max_tokens=300,
                 temperature=0.8,
             )
@@ -94,9 +150,9 @@ La descripción debe ser persuasiva, mencionar beneficios clave y tener un tono
 
 Texto: {text}"""
             
-            response = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[{"role": "user", "content": prompt}],
+            response, _ = model_router.create(
+                "classify",
+                [{"role": "user", "content": prompt}],
                 max_tokens=10,
                 temperature=0,
             )
@@ -104,31 +160,102 @@ Texto: {text}"""
             sentiment = response.choices[0].message.content.strip().lower()
             return {"sentiment": sentiment, "success": True}
             
+        except AIUnavailable as e:
+            return {"sentiment": classify_local(text) or "neutral", "success": False, "degraded": True, "error": str(e)}
         except Exception as e:
             logger.error(f"Error analyzing sentiment: {str(e)}")
             return {"sentiment": "neutral", "success": False, "error": str(e)}
     
     @staticmethod
-    def generate_chat_response(messages: list, temperature: float = 0.7) -> dict:
+    def analyze_sentiment_batch(texts: list, use_lexicon: bool = True) -> dict:
+        """
+        Analyze the sentiment of many texts at once.
+        
+        Obvious cases are resolved by the local Spanish lexicon; the rest are
+        packed into token-budgeted prompts (one Groq call per chunk) that run
+        concurrently.
+        
+        Args:
+            texts: List of texts
+            use_lexicon: Resolve obvious cases locally before calling the model
+            
+        Returns:
+            dict with 'sentiments' (one label per text, same order), 'success',
+            'local' (resolved by the lexicon) and 'llm_calls'
+        """
+        sentiments = [None] * len(texts)
+        pending = []
+        for index, text in enumerate(texts):
+            label = classify_local(text) if use_lexicon else None
+            if label:
+                sentiments[index] = label
+            else:
+                pending.append((index, text))
+        local = len(texts) - len(pending)
+        
+        chunks = chunk_by_tokens(
+            pending,
+            max_tokens=settings.AI_SENTIMENT_BATCH_TOKENS,
+            max_items=settings.AI_SENTIMENT_BATCH_SIZE,
+        )
+        
+        def classify_chunk(chunk):
+            response, _ = model_router.create(
+                "classify",
+                [{"role": "user", "content": build_batch_prompt([text for _, text in chunk])}],
+                max_tokens=8 * len(chunk) + 10,
+                temperature=0,
+            )
+            return parse_batch_labels(response.choices[0].message.content, len(chunk))
+        
+        success = True
+        if chunks:
+            with ThreadPoolExecutor(max_workers=settings.AI_SENTIMENT_CONCURRENCY) as executor:
+                futures = [(chunk, executor.submit(classify_chunk, chunk)) for chunk in chunks]
+                for chunk, future in futures:
+                    try:
+                        labels = future.result()
+                    except Exception as e:
+                        logger.error(f"Error analyzing sentiment batch: {str(e)}")
+                        labels = [None] * len(chunk)
+                    for (index, _), label in zip(chunk, labels):
+                        if label is None:
+                            success = False
+                        sentiments[index] = label or "neutral"
+        
+        return {
+            "sentiments": sentiments,
+            "success": success,
+            "local": local,
+            "llm_calls": len(chunks),
+        }
+    
+    @staticmethod
+    def generate_chat_response(messages: list, temperature: float = 0.7, plan: str = None) -> dict:
         """
         Generate response for a multi-turn conversation.
         
         Args:
             messages: List of message dicts with 'role' and 'content'
             temperature: Response creativity (0-1)
+            plan: Plan of the business owner (may cap the model tier)
             
         Returns:
             dict with response data
         """
         try:
-            response = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=messages,
+            # El tier lo decide el último mensaje del cliente
+            response, model = model_router.create(
+                "reply",
+                messages,
+                text=messages[-1].get("content", ""),
+                plan=plan,
                 max_tokens=800,
                 temperature=temperature,
             )
             
             return {
+                "model": model,
                 "reply": response.choices[0].message.content,
                 "usage": {
                     "prompt_tokens": response.usage.prompt_tokens,
@@ -138,6 +265,9 @@ Texto: {text}"""
                 "success": True
             }
             
+        except AIUnavailable as e:
+            logger.warning(f"AI unavailable, degraded chat reply: {str(e)}")
+            return {"reply": DEGRADED_REPLY, "success": False, "degraded": True, "error": str(e)}
         except Exception as e:
             logger.error(f"Error in chat response: {str(e)}")
             return {
@@ -146,9 +276,130 @@ Texto: {text}"""
                 "error": str(e)
             }
 
+    @staticmethod
+    def stream_chat_response(messages: list, temperature: float = 0.7, on_usage=None):
+        """
+        Stream a multi-turn conversation response token by token.
+        
+        Args:
+            messages: List of message dicts with 'role' and 'content'
+            temperature: Response creativity (0-1)
+            on_usage: Optional callback called with the usage dict when the stream ends
+            
+        Yields:
+            Text fragments as they arrive from the model
+        """
+        stream, _ = model_router.create(
+            "chat",
+            messages,
+            max_tokens=800,
+            temperature=temperature,
+            stream=True,
+        )
+        
+        usage = None
+        chunks = 0
+        for chunk in stream:
+            # Groq reporta el uso en el último chunk (x_groq.usage)
+            chunk_usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or getattr(chunk, "usage", None)
+            if chunk_usage:
+                usage = chunk_usage
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if token:
+                chunks += 1
+                yield token
+        
+        if usage:
+            usage = {
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+                "total_tokens": usage.total_tokens,
+            }
+        else:
+            usage = {"prompt_tokens": 0, "completion_tokens": chunks, "total_tokens": chunks}
+        
+        logger.info(f"Streamed chat response: {usage['total_tokens']} tokens")
+        if on_usage:
+            on_usage(usage)
+    
+    @staticmethod
+    def generate_conversation_reply(business, customer_phone: str, message: str, plan: str = None) -> dict:
+        """
+        Reply within a stored conversation, keeping the prompt within a fixed budget.
+        
+        The first message of a conversation has no history, so it goes through
+        the cached generate_reply path; later turns are answered with the
+        summary plus the most recent turns.
+        
+        Returns:
+            dict with 'reply' and 'success' keys
+        """
+        from .conversations import get_conversation, append_turn, build_context
+        from .prompts import business_prompt
+        
+        conversation = get_conversation(business.id, customer_phone)
+        has_history = conversation.summary or conversation.turns.exists()
+        
+        system_prompt, prompt_key = business_prompt(business, message)
+        
+        if has_history:
+            messages = build_context(conversation, system_prompt, message)
+            result = AIService.generate_chat_response(messages, plan=plan)
+        else:
+            result = AIService.generate_reply(
+                message, context=system_prompt, business_id=business.id, plan=plan, context_key=prompt_key
+            )
+        
+        append_turn(conversation, "user", message)
+        if result.get("success"):
+            append_turn(conversation, "assistant", result["reply"])
+        return result
+    
+    @staticmethod
+    def summarize_turns(summary: str, turns: list) -> str:
+        """Merge older conversation turns into the rolling summary."""
+        transcript = "\n".join(
+            f"{'Cliente' if role == 'user' else 'Asistente'}: {content}" for role, content in turns
+        )
+        prompt = f"""Actualiza el resumen de una conversación de WhatsApp entre un negocio y su cliente.
+Conserva datos concretos (nombres, pedidos, fechas, direcciones, acuerdos) y omite saludos. Máximo 120 palabras.
+
+Resumen actual:
+{summary or '(vacío)'}
+
+Nuevos mensajes:
+{transcript}"""
+        
+        response, _ = model_router.create(
+            "summary",
+            [{"role": "user", "content": prompt}],
+            max_tokens=250,
+            temperature=0,
+        )
+        return response.choices[0].message.content.strip()
+
+
+def generate_business_reply(msg: str, business=None, customer_phone: str = None) -> dict:
+    """Reply to a customer message, using the business context and conversation when available."""
+    if business is None:
+        return AIService.generate_reply(msg)
+    
+    from users.metering import owner_plan
+    from .prompts import business_prompt
+    
+    plan = owner_plan(business.owner_id)
+    if customer_phone and settings.AI_CONVERSATION_MEMORY_ENABLED:
+        return AIService.generate_conversation_reply(business, customer_phone, msg, plan=plan)
+    context, context_key = business_prompt(business, msg)
+    return AIService.generate_reply(
+        msg, context=context, business_id=business.id, plan=plan, context_key=context_key
+    )
+
 
 # Convenience function for backward compatibility
-def ai_reply(msg: str) -> str:
-    """Simple wrapper for generating AI replies."""
-    result = AIService.generate_reply(msg)
+def ai_reply(msg: str, business=None, customer_phone: str = None) -> str:
+    """Simple wrapper for generating AI replies (optionally for a Business conversation)."""
+    result = generate_business_reply(msg, business, customer_phone)
     return result.get("reply", "Error al generar respuesta.")
\ No newline at end of file
@@ -0,0 +1,36 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from users.models import Business
+from .cache import reply_cache
+from .similarity import similarity_cache
+from .prompts import compile_prompt, forget_compiled
+
+
+@receiver(pre_save, sender=Business)
+def track_ai_context_change(sender, instance, **kwargs):
+    """Remember what changed so post_save can invalidate caches and recompile the prompt."""
+    if not instance.pk:
+        instance._ai_context_changed = False
+        instance._prompt_changed = True
+        return
+    old = sender.objects.filter(pk=instance.pk).values('ai_context', 'business_type', 'name').first()
+    instance._ai_context_changed = old is not None and old['ai_context'] != instance.ai_context
+    instance._prompt_changed = old is None or any(
+        old[field] != getattr(instance, field) for field in ('ai_context', 'business_type', 'name')
+    )
+
+
+@receiver(post_save, sender=Business)
+def invalidate_replies_on_context_change(sender, instance, created, **kwargs):
+    if getattr(instance, '_ai_context_changed', False):
+        reply_cache.invalidate(instance.pk)
+        similarity_cache.clear_local(instance.pk)
+    if getattr(instance, '_prompt_changed', True):
+        compile_prompt(instance)
+
+
+@receiver(post_delete, sender=Business)
+def invalidate_replies_on_delete(sender, instance, **kwargs):
+    reply_cache.invalidate(instance.pk)
+    similarity_cache.clear_local(instance.pk)
+    forget_compiled(instance.pk)
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from core.redis import get_redis
+from .cache import normalize_message, content_hash
+
+logger = logging.getLogger(__name__)
+
+# Palabras que no aportan al significado de la pregunta
+STOPWORDS = {
+    'a', 'al', 'el', 'la', 'los', 'las', 'un', 'una', 'de', 'del', 'en', 'y', 'o', 'u',
+    'es', 'son', 'hay', 'me', 'mi', 'te', 'se', 'por', 'para', 'con', 'que', 'q', 'cual',
+    'cuales', 'como', 'donde', 'cuando', 'favor', 'porfa', 'hola', 'buenas', 'buenos',
+    'dias', 'tardes', 'noches', 'quisiera', 'saber', 'quiero', 'seria', 'ustedes',
+}
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def shingles(message: str) -> set:
+    """Character trigrams of the meaningful words of a message."""
+    words = [w for w in re.findall(r'\w+', normalize_message(message)) if w not in STOPWORDS]
+    result = set()
+    for word in words:
+        padded = f' {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def hash_band(values) -> str:
+    return hashlib.blake2b(repr(values).encode('utf-8'), digest_size=8).hexdigest()
+
+
+class MinHasher:
+    """MinHash signatures with fixed, seeded permutations (identical in every process)."""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.coefficients = [
+            (rng.randint(1, MERSENNE_PRIME - 1), rng.randint(0, MERSENNE_PRIME - 1))
+            for _ in range(num_perm)
+        ]
+
+    def signature(self, items: set) -> tuple:
+        hashes = [
+            int.from_bytes(hashlib.blake2b(item.encode('utf-8'), digest_size=8).digest(), 'big')
+            for item in items
+        ]
+        return tuple(
+            min(((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes)
+            for a, b in self.coefficients
+        )
+
+    @staticmethod
+    def similarity(sig_a, sig_b) -> float:
+        """Estimated Jaccard similarity of two signatures."""
+        return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+class LocalIndex:
+    """In-process LSH index for one scope, LRU-bounded."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries = OrderedDict()  # entry_id -> (signature, reply, band_keys)
+        self.buckets = {}             # band key -> set(entry_id)
+
+    def candidates(self, band_keys):
+        found = set()
+        for key in band_keys:
+            found |= self.buckets.get(key, set())
+        return found
+
+    def add(self, entry_id, signature, reply, band_keys):
+        if entry_id in self.entries:
+            self.entries.move_to_end(entry_id)
+            return
+        self.entries[entry_id] = (signature, reply, band_keys)
+        for key in band_keys:
+            self.buckets.setdefault(key, set()).add(entry_id)
+        while len(self.entries) > self.capacity:
+            old_id, (_, _, old_keys) = self.entries.popitem(last=False)
+            for key in old_keys:
+                bucket = self.buckets.get(key)
+                if bucket:
+                    bucket.discard(old_id)
+                    if not bucket:
+                        del self.buckets[key]
+
+
+class SimilarityCache:
+    """
+    Near-duplicate question cache (MinHash + LSH banding).
+
+    Each scope (business + context + model parameters) has an in-process
+    index backed by a shared Redis index, so a question answered by one
+    worker can be reused by any other. Entries are bounded per scope and the
+    least recently added ones are evicted first; the in-process indexes are
+    also bounded (AI_SIMILARITY_LOCAL_SCOPES, least recently used dropped).
+    """
+
+    MIN_SHINGLES = 4
+
+    def __init__(self, threshold: float = None, capacity: int = None, ttl: int = None,
+                 num_perm: int = 64, bands: int = 16, max_scopes: int = None):
+        self.threshold = threshold if threshold is not None else settings.AI_SIMILARITY_THRESHOLD
+        self.capacity = capacity if capacity is not None else settings.AI_SIMILARITY_CAPACITY
+        self.ttl = ttl if ttl is not None else settings.AI_SIMILARITY_TTL
+        self.max_scopes = max_scopes if max_scopes is not None else settings.AI_SIMILARITY_LOCAL_SCOPES
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._local = OrderedDict()  # scope -> LocalIndex
+        self._lock = threading.Lock()
+
+    def scope(self, context: str = None, business_id: int = None, **params) -> str:
+        """Index scope; a different context or model gets a fresh index automatically."""
+        owner = business_id if business_id is not None else 'global'
+        return f'{owner}:{content_hash(context or "", params)[:16]}'
+
+    def _band_keys(self, signature) -> list:
+        return [
+            f'{band}:{hash_band(signature[band * self.rows:(band + 1) * self.rows])}'
+            for band in range(self.bands)
+        ]
+
+    def _local_index(self, scope: str) -> LocalIndex:
+        # Llamar con self._lock tomado; el índice expulsado sigue disponible en Redis
+        index = self._local.get(scope)
+        if index is None:
+            index = self._local[scope] = LocalIndex(self.capacity)
+            while len(self._local) > self.max_scopes:
+                self._local.popitem(last=False)
+        else:
+            self._local.move_to_end(scope)
+        return index
+
+    def lookup(self, message: str, context: str = None, business_id: int = None, **params):
+        """
+        Return the stored reply of a sufficiently similar question, or None.
+        """
+        items = shingles(message)
+        if len(items) < self.MIN_SHINGLES:
+            return None
+        signature = self.hasher.signature(items)
+        band_keys = self._band_keys(signature)
+        scope = self.scope(context, business_id, **params)
+
+        with self._lock:
+            index = self._local_index(scope)
+            best = self._best(signature, {
+                entry_id: index.entries[entry_id][:2]
+                for entry_id in index.candidates(band_keys)
+            })
+        if best:
+            return best[1]
+
+        remote = self._remote_candidates(scope, band_keys)
+        best = self._best(signature, remote)
+        if best:
+            entry_id, reply, remote_signature = best[0], best[1], remote[best[0]][0]
+            with self._lock:
+                self._local_index(scope).add(entry_id, remote_signature, reply, self._band_keys(remote_signature))
+            return reply
+        return None
+
+    def add(self, message: str, reply: str, context: str = None, business_id: int = None, **params):
+        """Index an answered question."""
+        items = shingles(message)
+        if len(items) < self.MIN_SHINGLES:
+            return
+        signature = self.hasher.signature(items)
+        band_keys = self._band_keys(signature)
+        scope = self.scope(context, business_id, **params)
+        entry_id = content_hash(sorted(items))[:16]
+
+        with self._lock:
+            self._local_index(scope).add(entry_id, signature, reply, band_keys)
+        self._remote_add(scope, entry_id, signature, reply, band_keys)
+
+    def clear_local(self, business_id: int):
+        """Drop the in-process indexes of a business."""
+        prefix = f'{business_id}:'
+        with self._lock:
+            for scope in [s for s in self._local if s.startswith(prefix)]:
+                del self._local[scope]
+
+    def _best(self, signature, candidates: dict):
+        best, best_score = None, self.threshold
+        for entry_id, (candidate_sig, reply) in candidates.items():
+            score = MinHasher.similarity(signature, candidate_sig)
+            if score >= best_score:
+                best, best_score = (entry_id, reply), score
+        return best
+
+    def _remote_candidates(self, scope: str, band_keys: list) -> dict:
+        try:
+            r = get_redis()
+            ids = r.sunion([f'ai_sim:{scope}:b:{key}' for key in band_keys])
+            if not ids:
+                return {}
+            raw = r.hmget(f'ai_sim:{scope}:entries', list(ids))
+        except Exception as e:
+            logger.warning(f"Similarity cache Redis lookup failed: {str(e)}")
+            return {}
+        candidates = {}
+        for entry_id, value in zip(ids, raw):
+            if value:
+                data = json.loads(value)
+                candidates[entry_id.decode()] = (tuple(data['sig']), data['reply'])
+        return candidates
+
+    def _remote_add(self, scope, entry_id, signature, reply, band_keys):
+        entries_key, lru_key = f'ai_sim:{scope}:entries', f'ai_sim:{scope}:lru'
+        try:
+            r = get_redis()
+            pipe = r.pipeline()
+            pipe.hset(entries_key, entry_id, json.dumps({'sig': signature, 'reply': reply, 'keys': band_keys}))
+            pipe.zadd(lru_key, {entry_id: time.time()})
+            for key in band_keys:
+                pipe.sadd(f'ai_sim:{scope}:b:{key}', entry_id)
+                pipe.expire(f'ai_sim:{scope}:b:{key}', self.ttl)
+            pipe.expire(entries_key, self.ttl)
+            pipe.expire(lru_key, self.ttl)
+            pipe.zcard(lru_key)
+            size = pipe.execute()[-1]
+
+            if size > self.capacity:
+                self._remote_evict(r, scope, size - self.capacity)
+        except Exception as e:
+            logger.warning(f"Similarity cache Redis write failed: {str(e)}")
+
+    def _remote_evict(self, r, scope, count):
+        entries_key, lru_key = f'ai_sim:{scope}:entries', f'ai_sim:{scope}:lru'
+        old_ids = [i.decode() for i in r.zrange(lru_key, 0, count - 1)]
+        raw = r.hmget(entries_key, old_ids)
+        pipe = r.pipeline()
+        for entry_id, value in zip(old_ids, raw):
+            if value:
+                for key in json.loads(value)['keys']:
+                    pipe.srem(f'ai_sim:{scope}:b:{key}', entry_id)
+        pipe.hdel(entries_key, *old_ids)
+        pipe.zrem(lru_key, *old_ids)
+        pipe.execute()
+
+
+similarity_cache = SimilarityCache()
@@ -0,0 +1,13 @@
+from celery import shared_task
+from django.core.cache import cache
+from .conversations import summarize
+from .services import AIService
+
+
+@shared_task(ignore_result=True)
+def summarize_conversation(conversation_id: int):
+    """Update the rolling summary of a conversation off the request path."""
+    try:
+        summarize(conversation_id, AIService.summarize_turns)
+    finally:
+        cache.delete(f'conversation_summary_lock:{conversation_id}')
@@ -0,0 +1,101 @@
+import time
+from types import SimpleNamespace
+from django.test import SimpleTestCase, override_settings
+from django.core.cache import cache
+from .intents import IntentRouter
+from .routing import ModelRouter
+
+FAST, LARGE = 'fast-model', 'large-model'
+
+
+class FakeGroq:
+    """Groq-compatible client: per-model latency (seconds) and failures."""
+
+    def __init__(self, latency: dict = None, failing: set = ()):
+        self.latency = latency or {}
+        self.failing = set(failing)
+        self.calls = []
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, model, messages, **params):
+        self.calls.append(model)
+        time.sleep(self.latency.get(model, 0))
+        if model in self.failing:
+            raise RuntimeError(f'{model} 503')
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=model))],
+            usage=SimpleNamespace(prompt_tokens=1, completion_tokens=1, total_tokens=2),
+        )
+
+
+@override_settings(AI_ROUTER_MIN_SAMPLES=5, AI_ROUTER_MAX_P95_MS=20, AI_ROUTER_COOLDOWN=60,
+                   AI_ROUTER_MAX_ERROR_RATE=0.25)
+class ModelRouterFailoverTests(SimpleTestCase):
+
+    def router(self, client):
+        return ModelRouter(client=client, tiers={'fast': [FAST, LARGE], 'large': [LARGE, FAST]})
+
+    def test_failing_model_falls_back_within_the_call(self):
+        client = FakeGroq(failing={FAST})
+        router = self.router(client)
+
+        _, model = router.create('classify', [{'role': 'user', 'content': 'hola'}])
+
+        self.assertEqual(model, LARGE)
+        self.assertEqual(client.calls, [FAST, LARGE])
+        self.assertEqual(router.stats()['models'][FAST]['errors'], 1)
+
+    def test_erroring_model_is_skipped_after_the_threshold(self):
+        client = FakeGroq(failing={FAST})
+        router = self.router(client)
+        for _ in range(5):
+            router.create('classify', [])
+        client.calls.clear()
+
+        _, model = router.create('classify', [])
+
+        self.assertEqual(model, LARGE)
+        self.assertEqual(client.calls, [LARGE])
+        self.assertTrue(router.stats()['models'][FAST]['tripped'])
+
+    def test_slow_model_is_skipped_after_p95_threshold(self):
+        client = FakeGroq(latency={FAST: 0.03})
+        router = self.router(client)
+        used = [router.create('classify', [])[1] for _ in range(8)]
+
+        self.assertEqual(used[:5], [FAST] * 5)
+        self.assertEqual(used[-1], LARGE)
+        self.assertGreater(router.stats()['models'][FAST]['p95_ms'], 20)
+
+    def test_reply_tier_follows_message_complexity_and_plan(self):
+        router = self.router(FakeGroq())
+        long_question = ('Me puedes explicar por qué el pedido de ayer llegó tarde y cómo puedo '
+                         'pedir un reembolso del envío, además quiero cambiar la dirección?')
+
+        self.assertEqual(router.tier_for('reply', 'hola'), 'fast')
+        self.assertEqual(router.tier_for('reply', long_question), 'large')
+        self.assertEqual(router.tier_for('classify'), 'fast')
+        with self.settings(AI_PLAN_MAX_TIER={'basic': 'fast'}):
+            self.assertEqual(router.tier_for('reply', long_question, plan='basic'), 'fast')
+
+
+class IntentRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_failing_handler_falls_through_and_is_counted(self):
+        router = IntentRouter(rules={'pay': ['pagar'], 'hours': ['horario']}, business_type_rules={})
+
+        @router.register('pay')
+        def pay_handler(text, business):
+            raise RuntimeError('PayPal unavailable')
+
+        router.register('hours')(lambda text, business: 'De 9 a 18 h')
+
+        self.assertIsNone(router.route('quiero pagar', None))
+        self.assertEqual(router.route('quiero pagar, ¿cuál es el horario?', None)['intent'], 'hours')
+        stats = router.stats()
+        self.assertEqual(stats['errors'], 2)
+        self.assertEqual(stats['errors_by_intent']['pay'], 2)
+        self.assertEqual(stats['hits'], 1)
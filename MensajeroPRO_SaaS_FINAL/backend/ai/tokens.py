@@ -0,0 +1,25 @@
+import math
+import re
+
+# Los modelos Llama tokenizan ~4 caracteres por token en español; las palabras
+# largas y la puntuación suben el conteo, por eso se toma el mayor de ambos estimados.
+CHARS_PER_TOKEN = 4
+_WORD_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def count_tokens(text: str) -> int:
+    """Estimate the number of tokens of a text without a tokenizer download."""
+    if not text:
+        return 0
+    by_chars = math.ceil(len(text) / CHARS_PER_TOKEN)
+    by_words = len(_WORD_RE.findall(text))
+    return max(by_chars, by_words)
+
+
+# Tokens extra por mensaje en el formato de chat (rol y separadores)
+MESSAGE_OVERHEAD = 4
+
+
+def count_message_tokens(messages: list) -> int:
+    """Estimate the prompt tokens of a list of chat messages."""
+    return sum(count_tokens(m.get('content', '')) + MESSAGE_OVERHEAD for m in messages)
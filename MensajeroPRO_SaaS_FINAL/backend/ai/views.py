@@ -0,0 +1,136 @@
+import json
+import logging
+from django.http import StreamingHttpResponse
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework import status
+from users.metering import check_quota, record_usage
+from users.models import Business
+from whatsapp.admission import admission
+from .intents import router
+from .cache import reply_cache
+from .services import AIService, model_router
+
+logger = logging.getLogger(__name__)
+
+
+class IntentRouterStatsView(APIView):
+    """Hit rate of the intent router (messages answered without the LLM)."""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(router.stats())
+
+
+class ReplyCacheStatsView(APIView):
+    """Hit/miss/bytes counters of the AI reply cache."""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(reply_cache.stats())
+
+
+class ModelRouterStatsView(APIView):
+    """Per-model latency/error stats, circuit breaker state and concurrency (this process)."""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(model_router.stats())
+
+
+CHAT_ROLES = ('user', 'assistant')
+MAX_CHAT_MESSAGES = 50
+
+
+def sse_event(data: dict, event: str = None) -> str:
+    """Format a Server-Sent Events message."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class ChatStreamView(APIView):
+    """
+    Stream a chat response as Server-Sent Events.
+
+    POST {"business_id": 1, "messages": [{"role": "user", "content": "..."}], "temperature": 0.7}
+
+    Only user/assistant turns are accepted (no client system prompts). The
+    call is metered against the caller's business like an inbound message:
+    admission control, message quota and token usage.
+
+    Emits one ``data: {"token": ...}`` event per fragment and a final
+    ``event: done`` with the token usage (``event: error`` on failure).
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        messages = request.data.get('messages')
+        if not isinstance(messages, list) or not messages or len(messages) > MAX_CHAT_MESSAGES:
+            return Response({'error': f'messages es requerido (máximo {MAX_CHAT_MESSAGES})'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not all(
+            isinstance(m, dict) and m.get('role') in CHAT_ROLES
+            and isinstance(m.get('content'), str) and m['content'].strip()
+            for m in messages
+        ):
+            return Response({'error': 'Cada mensaje necesita role (user/assistant) y content'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        # Solo se reenvía role/content: nada de system prompts ni campos extra del cliente
+        messages = [{'role': m['role'], 'content': m['content']} for m in messages]
+
+        try:
+            temperature = float(request.data.get('temperature', 0.7))
+        except (TypeError, ValueError):
+            temperature = None
+        if temperature is None or not 0 <= temperature <= 2:
+            return Response({'error': 'temperature debe ser un número entre 0 y 2'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        business = self.get_business(request)
+        if business is None:
+            return Response({'error': 'Negocio no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+        if not admission.admit({'from': f'chat:{request.user.id}'}, business):
+            return Response({'error': 'Demasiadas solicitudes, intenta en unos segundos'},
+                            status=status.HTTP_429_TOO_MANY_REQUESTS)
+        if not check_quota(business.id):
+            return Response({'error': 'Has alcanzado el límite de mensajes de tu plan'},
+                            status=status.HTTP_429_TOO_MANY_REQUESTS)
+        record_usage(business.id, messages=1)
+
+        def event_stream():
+            usage = {}
+            try:
+                for token in AIService.stream_chat_response(messages, temperature, on_usage=usage.update):
+                    yield sse_event({'token': token})
+                if usage:
+                    record_usage(business.id, usage=usage)
+                yield sse_event({'usage': usage}, event='done')
+            except Exception as e:
+                logger.error(f"Error in chat stream: {str(e)}")
+                yield sse_event({'error': 'Error al generar respuesta.'}, event='error')
+
+        response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # nginx: no bufferizar el stream
+        return response
+
+    @staticmethod
+    def get_business(request):
+        """Active business the call is billed to (business_id, or the caller's only one)."""
+        businesses = Business.objects.filter(is_active=True)
+        if not request.user.is_superuser:
+            businesses = businesses.filter(owner=request.user)
+        business_id = request.data.get('business_id')
+        if business_id is None:
+            # Sin business_id solo se elige si no hay ambigüedad
+            candidates = list(businesses.order_by('-created_at')[:2])
+            return candidates[0] if len(candidates) == 1 else None
+        try:
+            return businesses.get(pk=int(business_id))
+        except (TypeError, ValueError, Business.DoesNotExist):
+            return None
@@ -0,0 +1,14 @@
+"""
+ASGI config for core project.
+
+Used when SERVER_MODE='asgi' (e.g. `uvicorn core.asgi:application`), so the
+async webhook views run on the event loop instead of a worker thread.
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+application = get_asgi_application()
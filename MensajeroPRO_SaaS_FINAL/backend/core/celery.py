@@ -0,0 +1,22 @@
+import os
+import zlib
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+app = Celery('core')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
+
+
+def shard_queue(prefix: str, key: str, shards: int) -> str:
+    """
+    Map a key (e.g. a conversation) to one of `shards` queues.
+
+    Every message with the same key lands on the same queue. Running a single
+    worker process with concurrency 1 per shard queue keeps them in order:
+
+        celery -A core worker -Q whatsapp.inbound.0 -c 1
+    """
+    return f"{prefix}.{zlib.crc32(key.encode('utf-8')) % shards}"
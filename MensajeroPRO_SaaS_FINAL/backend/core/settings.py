@@ -1,8 +1,7 @@
 import os
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 from datetime import timedelta
-import sentry_sdk
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -63,6 +62,10 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'core.wsgi.application'
+ASGI_APPLICATION = 'core.asgi.application'
+
+# 'wsgi' or 'asgi': under ASGI the webhooks are served by native async views
+SERVER_MODE = config('SERVER_MODE', default='wsgi')
 
 # Database
 DATABASES = {
@@ -100,10 +103,26 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+AUTH_USER_MODEL = 'users.User'
+
+# Cache (compartido entre gunicorn y Celery)
+REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/1')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    },
+    # Respuestas IA: usar una instancia/db con maxmemory-policy allkeys-lru para la expulsión
+    'ai_replies': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('AI_REPLY_CACHE_URL', default=REDIS_URL),
+    },
+}
+
 # REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.ClaimsJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -126,34 +145,124 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    'TOKEN_OBTAIN_SERIALIZER': 'users.authentication.ClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'users.authentication.ClaimsTokenRefreshSerializer',
 }
 
 # CORS
 CORS_ALLOWED_ORIGINS = config('CORS_ALLOWED_ORIGINS', default='http://localhost:3000').split(',')
 CORS_ALLOW_CREDENTIALS = True
 
+# Credenciales de integraciones (opcionales para arrancar: manage.py, workers y tests
+# funcionan sin ellas; cada cliente falla en su primer uso si falta la suya)
+PAYPAL_CLIENT_ID = config('PAYPAL_CLIENT_ID', default='')
+PAYPAL_SECRET = config('PAYPAL_SECRET', default='')
+PAYPAL_WEBHOOK_ID = config('PAYPAL_WEBHOOK_ID', default='')
+GROQ_API_KEY = config('GROQ_API_KEY', default='')
+WHATSAPP_TOKEN = config('WHATSAPP_TOKEN', default='')
+WHATSAPP_PHONE_ID = config('WHATSAPP_PHONE_ID', default='')
+WHATSAPP_VERIFY_TOKEN = config('WHATSAPP_VERIFY_TOKEN', default='')
+WHATSAPP_APP_SECRET = config('WHATSAPP_APP_SECRET', default='')  # firma X-Hub-Signature-256
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+SENTRY_DSN = config('SENTRY_DSN', default='')
+
 # PayPal
-PAYPAL_CLIENT_ID = config('PAYPAL_CLIENT_ID')
-PAYPAL_SECRET = config('PAYPAL_SECRET')
 PAYPAL_MODE = config('PAYPAL_MODE', default='sandbox')
-PAYPAL_WEBHOOK_ID = config('PAYPAL_WEBHOOK_ID')
+# Solo para pruebas contra un servidor local (por defecto se usa PAYPAL_MODE)
+PAYPAL_BASE_URL = config('PAYPAL_BASE_URL', default='')
+# Eventos del webhook: colas por orden para procesarlos en orden
+PAYPAL_WEBHOOK_QUEUE = 'paypal.webhooks'
+PAYPAL_WEBHOOK_SHARDS = config('PAYPAL_WEBHOOK_SHARDS', default=4, cast=int)
 
-# Groq
-GROQ_API_KEY = config('GROQ_API_KEY')
+# AI pipeline
+# Responde pagos/horarios/menú/reservas sin llamar al modelo
+AI_INTENT_ROUTER_ENABLED = config('AI_INTENT_ROUTER_ENABLED', default=True, cast=bool)
+AI_REPLY_CACHE_ALIAS = 'ai_replies'
+AI_REPLY_CACHE_TTL = config('AI_REPLY_CACHE_TTL', default=3600, cast=int)
+AI_REPLY_CACHE_MAX_BYTES = config('AI_REPLY_CACHE_MAX_BYTES', default=16384, cast=int)
+# Caché de preguntas similares (MinHash/LSH)
+AI_SIMILARITY_CACHE_ENABLED = config('AI_SIMILARITY_CACHE_ENABLED', default=True, cast=bool)
+AI_SIMILARITY_THRESHOLD = config('AI_SIMILARITY_THRESHOLD', default=0.7, cast=float)
+AI_SIMILARITY_CAPACITY = config('AI_SIMILARITY_CAPACITY', default=500, cast=int)
+AI_SIMILARITY_LOCAL_SCOPES = config('AI_SIMILARITY_LOCAL_SCOPES', default=256, cast=int)  # índices en memoria (LRU)
+AI_SIMILARITY_TTL = config('AI_SIMILARITY_TTL', default=60 * 60 * 24 * 7, cast=int)
+# Análisis de sentimiento por lotes
+AI_SENTIMENT_BATCH_TOKENS = config('AI_SENTIMENT_BATCH_TOKENS', default=2000, cast=int)
+AI_SENTIMENT_BATCH_SIZE = config('AI_SENTIMENT_BATCH_SIZE', default=40, cast=int)
+AI_SENTIMENT_CONCURRENCY = config('AI_SENTIMENT_CONCURRENCY', default=4, cast=int)
+# Memoria de conversaciones: prompt de tamaño fijo sin importar la longitud de la conversación
+AI_CONVERSATION_MEMORY_ENABLED = config('AI_CONVERSATION_MEMORY_ENABLED', default=True, cast=bool)
+AI_CONTEXT_TOKEN_BUDGET = config('AI_CONTEXT_TOKEN_BUDGET', default=1500, cast=int)
+AI_RECENT_WINDOW_TOKENS = config('AI_RECENT_WINDOW_TOKENS', default=600, cast=int)
+AI_SUMMARY_TRIGGER_TOKENS = config('AI_SUMMARY_TRIGGER_TOKENS', default=1200, cast=int)
+# Tokens del prompt de sistema compilado por plan (contextos más largos se recortan por secciones)
+AI_PROMPT_TOKEN_BUDGETS = {
+    'basic': config('AI_PROMPT_TOKENS_BASIC', default=600, cast=int),
+    'pro': config('AI_PROMPT_TOKENS_PRO', default=1500, cast=int),
+    'enterprise': config('AI_PROMPT_TOKENS_ENTERPRISE', default=3000, cast=int),
+}
+# Modelos por tier (el primero es el preferido; los siguientes son el failover)
+AI_MODEL_TIERS = {
+    'fast': config('AI_MODELS_FAST', default='llama-3.1-8b-instant,llama-3.3-70b-versatile', cast=Csv()),
+    'large': config('AI_MODELS_LARGE', default='llama-3.3-70b-versatile,llama-3.1-8b-instant', cast=Csv()),
+}
+# Tier máximo de las respuestas por plan ('fast' = solo modelos rápidos; planes ausentes sin límite)
+AI_PLAN_MAX_TIER = {
+    'basic': config('AI_MAX_TIER_BASIC', default='large'),
+    'pro': config('AI_MAX_TIER_PRO', default='large'),
+}
+AI_ROUTER_SHORT_TOKENS = config('AI_ROUTER_SHORT_TOKENS', default=12, cast=int)
+AI_ROUTER_WINDOW = config('AI_ROUTER_WINDOW', default=100, cast=int)
+AI_ROUTER_MIN_SAMPLES = config('AI_ROUTER_MIN_SAMPLES', default=10, cast=int)
+AI_ROUTER_MAX_P95_MS = config('AI_ROUTER_MAX_P95_MS', default=4000, cast=int)
+AI_ROUTER_MAX_ERROR_RATE = config('AI_ROUTER_MAX_ERROR_RATE', default=0.25, cast=float)
+AI_ROUTER_COOLDOWN = config('AI_ROUTER_COOLDOWN', default=60, cast=int)
+# Resiliencia de las llamadas a Groq
+AI_CALL_TIMEOUT = config('AI_CALL_TIMEOUT', default=20, cast=float)
+AI_MAX_CONCURRENCY = config('AI_MAX_CONCURRENCY', default=8, cast=int)
+AI_MAX_ASYNC_CONCURRENCY = config('AI_MAX_ASYNC_CONCURRENCY', default=200, cast=int)
+AI_CLUSTER_CONCURRENCY = config('AI_CLUSTER_CONCURRENCY', default=64, cast=int)  # 0 = sin semáforo en Redis
+AI_CONCURRENCY_WAIT = config('AI_CONCURRENCY_WAIT', default=2, cast=float)
+AI_BREAKER_WINDOW = config('AI_BREAKER_WINDOW', default=20, cast=int)
+AI_BREAKER_MIN_CALLS = config('AI_BREAKER_MIN_CALLS', default=10, cast=int)
+AI_BREAKER_FAILURE_RATE = config('AI_BREAKER_FAILURE_RATE', default=0.5, cast=float)
+AI_BREAKER_SLOW_MS = config('AI_BREAKER_SLOW_MS', default=8000, cast=int)
+AI_BREAKER_COOLDOWN = config('AI_BREAKER_COOLDOWN', default=30, cast=int)
+# Cupo mensual de mensajes: 'degrade' = solo intenciones sin LLM, 'reject' = respuesta fija
+AI_QUOTA_MODE = config('AI_QUOTA_MODE', default='degrade')
+
+# WhatsApp inbound pipeline
+# 'sync' = responde dentro del request, 'async' = encola en Celery y responde 200 de inmediato
+WHATSAPP_INBOUND_MODE = config('WHATSAPP_INBOUND_MODE', default='sync')
+WHATSAPP_INBOUND_QUEUE = 'whatsapp.inbound'
+WHATSAPP_INBOUND_SHARDS = config('WHATSAPP_INBOUND_SHARDS', default=8, cast=int)
+# Índice número -> negocio (LRU local + hash en Redis)
+WHATSAPP_TENANT_CACHE_SIZE = config('WHATSAPP_TENANT_CACHE_SIZE', default=1024, cast=int)
+WHATSAPP_TENANT_LOCAL_TTL = config('WHATSAPP_TENANT_LOCAL_TTL', default=60, cast=int)
+# Control de admisión: buckets por negocio (PLAN_LIMITS) y por número de cliente
+WHATSAPP_ADMISSION_ENABLED = config('WHATSAPP_ADMISSION_ENABLED', default=True, cast=bool)
+WHATSAPP_CUSTOMER_PER_MINUTE = config('WHATSAPP_CUSTOMER_PER_MINUTE', default=6, cast=int)
+WHATSAPP_CUSTOMER_BURST = config('WHATSAPP_CUSTOMER_BURST', default=10, cast=int)
+WHATSAPP_SHED_NOTICE_TTL = config('WHATSAPP_SHED_NOTICE_TTL', default=300, cast=int)  # un aviso por cliente
 
-# WhatsApp
-WHATSAPP_TOKEN = config('WHATSAPP_TOKEN')
-WHATSAPP_PHONE_ID = config('WHATSAPP_PHONE_ID')
-WHATSAPP_VERIFY_TOKEN = config('WHATSAPP_VERIFY_TOKEN')
+# WhatsApp outbound (Cloud API)
+# Solo para pruebas contra un stub local de la Graph API
+WHATSAPP_GRAPH_URL = config('WHATSAPP_GRAPH_URL', default='https://graph.facebook.com/v19.0')
+WHATSAPP_SEND_CONCURRENCY = config('WHATSAPP_SEND_CONCURRENCY', default=8, cast=int)
+WHATSAPP_SEND_QUEUE_SIZE = config('WHATSAPP_SEND_QUEUE_SIZE', default=1000, cast=int)
+WHATSAPP_SEND_SESSIONS = config('WHATSAPP_SEND_SESSIONS', default=256, cast=int)  # sesiones keep-alive (LRU)
+WHATSAPP_SEND_RETRIES = config('WHATSAPP_SEND_RETRIES', default=3, cast=int)
+# Rendimiento por número de Meta (mensajes/segundo) y espera máxima por un turno
+WHATSAPP_NUMBER_MPS = config('WHATSAPP_NUMBER_MPS', default=80, cast=int)
+WHATSAPP_THROTTLE_WAIT = config('WHATSAPP_THROTTLE_WAIT', default=5, cast=float)
 
 # Email
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST = config('EMAIL_HOST', default='smtp.gmail.com')
 EMAIL_PORT = config('EMAIL_PORT', default=587, cast=int)
-EMAIL_HOST_USER = config('EMAIL_HOST_USER')
-EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=True, cast=bool)
-DEFAULT_FROM_EMAIL = config('EMAIL_HOST_USER')
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default=EMAIL_HOST_USER or 'webmaster@localhost')
 
 # Celery
 CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://localhost:6379/0')
@@ -162,6 +271,21 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# Modo local/offline: CELERY_BROKER_URL=memory:// y CELERY_TASK_ALWAYS_EAGER=True
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=False, cast=bool)
+CELERY_TASK_EAGER_PROPAGATES = True
+CELERY_BEAT_SCHEDULE = {
+    'flush-usage-counters': {
+        'task': 'users.tasks.flush_usage_counters',
+        'schedule': config('USAGE_FLUSH_INTERVAL', default=60, cast=int),
+    },
+    'send-outbox-emails': {
+        'task': 'payments.tasks.send_outbox_emails',
+        'schedule': config('EMAIL_OUTBOX_INTERVAL', default=30, cast=int),
+    },
+}
 
 # Logging
 LOGGING = {
@@ -209,11 +333,12 @@ if not DEBUG:
     SECURE_HSTS_INCLUDE_SUBDOMAINS = True
     SECURE_HSTS_PRELOAD = True
     
-    # Sentry
-    sentry_dsn = config('SENTRY_DSN', default='')
-    if sentry_dsn:
+    # Sentry (sentry_sdk solo se importa si hay DSN)
+    if SENTRY_DSN:
+        import sentry_sdk
+
         sentry_sdk.init(
-            dsn=sentry_dsn,
+            dsn=SENTRY_DSN,
             traces_sample_rate=0.1,
             profiles_sample_rate=0.1,
         )
\ No newline at end of file
@@ -1,10 +1,30 @@
+from django.conf import settings
 from django.urls import path
-from payments.views import CreatePayPalPayment
-from payments.webhooks import PayPalWebhook
-from whatsapp.views import WhatsAppWebhook
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from payments.views import CreatePayPalPayment, OutboxStats
+from users.webhooks import PayPalWebhookView, AsyncPayPalWebhookView
+from users.views import BusinessListCreateView, BusinessDetailView, UserDashboardView
+from whatsapp.views import WhatsAppWebhook, AsyncWhatsAppWebhook
+from ai.views import IntentRouterStatsView, ReplyCacheStatsView, ModelRouterStatsView, ChatStreamView
+
+# Under ASGI the webhooks are served by the async views so AI/PayPal calls don't pin a worker
+if settings.SERVER_MODE == 'asgi':
+    paypal_webhook, whatsapp_webhook = AsyncPayPalWebhookView, AsyncWhatsAppWebhook
+else:
+    paypal_webhook, whatsapp_webhook = PayPalWebhookView, WhatsAppWebhook
 
 urlpatterns = [
  path('api/payments/create/', CreatePayPalPayment.as_view()),
- path('api/payments/webhook/', PayPalWebhook.as_view()),
- path('api/whatsapp/', WhatsAppWebhook.as_view()),
+ path('api/payments/webhook/', paypal_webhook.as_view()),
+ path('api/payments/outbox/stats/', OutboxStats.as_view()),
+ path('api/whatsapp/', whatsapp_webhook.as_view()),
+ path('api/auth/token/', TokenObtainPairView.as_view()),
+ path('api/auth/token/refresh/', TokenRefreshView.as_view()),
+ path('api/businesses/', BusinessListCreateView.as_view()),
+ path('api/businesses/<int:business_id>/', BusinessDetailView.as_view()),
+ path('api/dashboard/', UserDashboardView.as_view()),
+ path('api/ai/intents/stats/', IntentRouterStatsView.as_view()),
+ path('api/ai/cache/stats/', ReplyCacheStatsView.as_view()),
+ path('api/ai/models/stats/', ModelRouterStatsView.as_view()),
+ path('api/ai/chat/stream/', ChatStreamView.as_view()),
 ]
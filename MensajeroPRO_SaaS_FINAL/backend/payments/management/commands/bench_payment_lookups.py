@@ -0,0 +1,67 @@
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from payments.models import Payment, PaymentStatus
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark webhook-style Payment lookups by paypal_order_id as the table grows. '
+        'Rows are inserted inside a transaction that is rolled back at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=str, default='10000,100000,1000000',
+                            help='Comma-separated table sizes to measure')
+        parser.add_argument('--lookups', type=int, default=2000, help='Lookups per size')
+        parser.add_argument('--batch', type=int, default=10000, help='bulk_create batch size')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        try:
+            with transaction.atomic():
+                self._run(sizes, options['lookups'], options['batch'])
+                raise Rollback()
+        except Rollback:
+            self.stdout.write('Benchmark rows rolled back')
+
+    def _run(self, sizes, lookups, batch):
+        user = User.objects.create(username=f'bench-{uuid.uuid4().hex[:8]}')
+        order_ids = []
+        statuses = list(PaymentStatus)
+
+        for size in sizes:
+            while len(order_ids) < size:
+                count = min(batch, size - len(order_ids))
+                new_ids = [uuid.uuid4().hex for _ in range(count)]
+                Payment.objects.bulk_create([
+                    Payment(user=user, paypal_order_id=order_id, amount=10,
+                            status=statuses[(len(order_ids) + i) % len(statuses)])
+                    for i, order_id in enumerate(new_ids)
+                ], batch_size=batch)
+                order_ids.extend(new_ids)
+
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(f'ANALYZE {Payment._meta.db_table}')
+
+            step = max(len(order_ids) // lookups, 1)
+            sample = order_ids[::step][:lookups]
+            start = time.perf_counter()
+            for order_id in sample:
+                Payment.objects.filter(paypal_order_id=order_id).first()
+            elapsed = time.perf_counter() - start
+
+            plan = Payment.objects.filter(paypal_order_id=sample[0]).explain()
+            self.stdout.write(self.style.SUCCESS(
+                f'{size:>10,} rows: {elapsed / len(sample) * 1000:.3f} ms/lookup ({len(sample)} lookups)'
+            ))
+            self.stdout.write(f'    plan: {plan.splitlines()[0]}')
@@ -0,0 +1,125 @@
+import time
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from payments.models import Payment, PaymentStatus, allowed_sources
+from payments.paypal import PayPalClient, PayPalError
+from users.webhooks import PayPalEventHandler
+
+# Estado de la captura en PayPal -> estado del pago
+CAPTURE_STATUS_MAP = {
+    'COMPLETED': PaymentStatus.COMPLETED,
+    'DECLINED': PaymentStatus.DENIED,
+    'FAILED': PaymentStatus.DENIED,
+    'REFUNDED': PaymentStatus.REFUNDED,
+    'PARTIALLY_REFUNDED': PaymentStatus.COMPLETED,
+}
+
+
+def payment_status_from_order(order: dict):
+    """Map a PayPal order to the Payment status it implies (None = no change)."""
+    order_status = order.get('status')
+    if order_status == 'COMPLETED':
+        for unit in order.get('purchase_units', []):
+            for capture in unit.get('payments', {}).get('captures', []):
+                return CAPTURE_STATUS_MAP.get(capture.get('status'))
+        return PaymentStatus.COMPLETED
+    if order_status == 'APPROVED':
+        return PaymentStatus.APPROVED
+    if order_status == 'VOIDED':
+        return PaymentStatus.DENIED
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Reconcile PENDING/APPROVED payments against PayPal (repairs lost webhooks)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent PayPal requests')
+        parser.add_argument('--batch-size', type=int, default=200, help='Payments per batched update')
+        parser.add_argument('--min-age', type=int, default=30,
+                            help='Only payments created more than N minutes ago')
+        parser.add_argument('--base-url', type=str, default=None, help='PayPal API base URL (e.g. a local stub)')
+        parser.add_argument('--dry-run', action='store_true', help='Report changes without writing')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.handler = PayPalEventHandler()
+        workers = options['workers']
+        client = PayPalClient(base_url=options['base_url'], pool_size=workers)
+
+        candidates = Payment.objects.filter(
+            status__in=[PaymentStatus.PENDING, PaymentStatus.APPROVED],
+            created_at__lt=timezone.now() - timedelta(minutes=options['min_age']),
+        ).order_by('pk')
+        total = candidates.count()
+        self.stdout.write(f'{total} payments to reconcile ({workers} workers)')
+
+        def fetch(order_id):
+            try:
+                return order_id, payment_status_from_order(client.get_order(order_id)), None
+            except PayPalError as e:
+                return order_id, None, str(e)
+
+        self.stats = {'checked': 0, 'errors': 0}
+        self.applied = {}
+        start = time.perf_counter()
+        order_ids = candidates.values_list('paypal_order_id', flat=True).iterator(chunk_size=options['batch_size'])
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Un lote a la vez: memoria acotada aunque haya millones de candidatos
+            while True:
+                batch = list(islice(order_ids, options['batch_size']))
+                if not batch:
+                    break
+                changes = []
+                for order_id, status, error in executor.map(fetch, batch):
+                    self.stats['checked'] += 1
+                    if error:
+                        self.stats['errors'] += 1
+                        self.stderr.write(f'  {order_id}: {error}')
+                    elif status:
+                        changes.append((order_id, status))
+                self._apply(changes)
+                self._progress(total, start)
+
+        label = 'would change' if self.dry_run else 'changed'
+        summary = ', '.join(f'{status}: {count}' for status, count in self.applied.items()) or 'none'
+        self.stdout.write(self.style.SUCCESS(f'✓ Done. Payments {label}: {summary}; errors: {self.stats["errors"]}'))
+
+    def _progress(self, total, start):
+        elapsed = time.perf_counter() - start
+        rate = self.stats['checked'] / elapsed if elapsed else 0
+        self.stdout.write(f'  {self.stats["checked"]}/{total} checked ({rate:.1f} orders/s)')
+
+    def _apply(self, changes):
+        by_status = {}
+        for order_id, status in changes:
+            by_status.setdefault(status, []).append(order_id)
+
+        if self.dry_run:
+            for status, order_ids in by_status.items():
+                count = Payment.objects.filter(
+                    paypal_order_id__in=order_ids, status__in=allowed_sources(status)
+                ).count()
+                self.applied[status] = self.applied.get(status, 0) + count
+            return
+
+        with transaction.atomic():
+            for status, order_ids in by_status.items():
+                # Bloquear los pagos que realmente cambian (para las suscripciones)
+                affected = list(
+                    Payment.objects.select_for_update()
+                    .filter(paypal_order_id__in=order_ids, status__in=allowed_sources(status))
+                    .select_related('user')
+                )
+                Payment.objects.bulk_transition([p.paypal_order_id for p in affected], status)
+
+                if status == PaymentStatus.COMPLETED:
+                    for payment in affected:
+                        self.handler.activate_subscription(payment)
+
+                self.applied[status] = self.applied.get(status, 0) + len(affected)
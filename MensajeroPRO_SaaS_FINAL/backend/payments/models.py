@@ -1,8 +1,202 @@
+from django.conf import settings
 from django.db import models
-from django.contrib.auth.models import User
+from django.utils import timezone
+
+
+class PaymentStatus(models.TextChoices):
+    PENDING = 'PENDING', 'Pending'
+    APPROVED = 'APPROVED', 'Approved'
+    COMPLETED = 'COMPLETED', 'Completed'
+    DENIED = 'DENIED', 'Denied'
+    REFUNDED = 'REFUNDED', 'Refunded'
+
+
+# Transiciones permitidas: estado actual -> estados siguientes
+PAYMENT_TRANSITIONS = {
+    PaymentStatus.PENDING: {PaymentStatus.APPROVED, PaymentStatus.COMPLETED, PaymentStatus.DENIED},
+    PaymentStatus.APPROVED: {PaymentStatus.COMPLETED, PaymentStatus.DENIED},
+    PaymentStatus.COMPLETED: {PaymentStatus.REFUNDED},
+    PaymentStatus.DENIED: set(),
+    PaymentStatus.REFUNDED: set(),
+}
+
+
+def allowed_sources(status: str) -> list:
+    """States from which a payment may move to `status`."""
+    return [source for source, targets in PAYMENT_TRANSITIONS.items() if status in targets]
+
+
+class InvalidTransition(ValueError):
+    """Payment status change not allowed by PAYMENT_TRANSITIONS."""
+
+
+class PaymentQuerySet(models.QuerySet):
+    
+    def bulk_transition(self, order_ids, status: str) -> int:
+        """
+        Move many payments to `status` in one UPDATE.
+        
+        Only rows whose current status allows the transition are changed
+        (``WHERE paypal_order_id IN (...) AND status IN (...)``); the rest are
+        left untouched.
+        
+        Returns:
+            number of payments updated
+        """
+        status = PaymentStatus(status)
+        updates = {'status': status}
+        if status == PaymentStatus.COMPLETED:
+            updates['completed_at'] = timezone.now()
+        return self.filter(
+            paypal_order_id__in=list(order_ids),
+            status__in=allowed_sources(status),
+        ).update(**updates)
+    
+    def apply_transitions(self, changes) -> dict:
+        """
+        Apply many (paypal_order_id, status) changes, one UPDATE per target status.
+        
+        Returns:
+            dict mapping status -> number of payments updated
+        """
+        by_status = {}
+        for order_id, status in changes:
+            by_status.setdefault(PaymentStatus(status), []).append(order_id)
+        return {status: self.bulk_transition(order_ids, status) for status, order_ids in by_status.items()}
+
 
 class Payment(models.Model):
- user=models.ForeignKey(User,on_delete=models.CASCADE)
- paypal_order_id=models.CharField(max_length=100)
- amount=models.FloatField()
- status=models.CharField(max_length=20,default='PENDING')
+    """PayPal payment for a subscription plan."""
+    
+    PLAN_CHOICES = [
+        ('basic', 'Basic'),
+        ('pro', 'Pro'),
+        ('enterprise', 'Enterprise'),
+    ]
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    paypal_order_id = models.CharField(max_length=100, unique=True)
+    amount = models.FloatField()
+    status = models.CharField(max_length=20, choices=PaymentStatus.choices, default=PaymentStatus.PENDING)
+    plan_type = models.CharField(max_length=20, choices=PLAN_CHOICES, default='basic')
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    objects = PaymentQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.paypal_order_id} ({self.status})"
+    
+    def can_transition_to(self, status: str) -> bool:
+        return PaymentStatus(status) in PAYMENT_TRANSITIONS[PaymentStatus(self.status)]
+    
+    def transition_to(self, status: str, save: bool = True):
+        """Change status, enforcing PAYMENT_TRANSITIONS."""
+        if not self.can_transition_to(status):
+            raise InvalidTransition(f"Payment {self.paypal_order_id}: {self.status} -> {status} not allowed")
+        self.status = PaymentStatus(status)
+        if self.status == PaymentStatus.COMPLETED:
+            self.completed_at = timezone.now()
+        if save:
+            self.save(update_fields=['status', 'completed_at'])
+
+
+class Subscription(models.Model):
+    """Paid plan of a user."""
+    
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='subscription'
+    )
+    plan_type = models.CharField(max_length=20, choices=Payment.PLAN_CHOICES, default='basic')
+    is_active = models.BooleanField(default=False)
+    start_date = models.DateTimeField(default=timezone.now)
+    end_date = models.DateTimeField()
+    monthly_message_limit = models.IntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.plan_type} ({'activa' if self.is_active else 'inactiva'})"
+    
+    @property
+    def is_expired(self):
+        return self.end_date < timezone.now()
+
+
+class WebhookEvent(models.Model):
+    """
+    Inbox of PayPal webhook deliveries.
+    
+    The unique event_id makes duplicate deliveries a no-op; events are
+    processed asynchronously in order per PayPal order.
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+    
+    event_id = models.CharField(max_length=100, unique=True)
+    event_type = models.CharField(max_length=100)
+    paypal_order_id = models.CharField(max_length=100, blank=True, db_index=True)
+    payload = models.JSONField()
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['received_at']
+        indexes = [
+            models.Index(fields=['status', 'received_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} ({self.status})"
+
+
+class OutboxEmail(models.Model):
+    """
+    Transactional email written in the same transaction as the change that
+    triggers it; a background sender delivers it.
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+    
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.subject} -> {self.to} ({self.status})"
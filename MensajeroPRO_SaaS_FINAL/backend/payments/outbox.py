@@ -0,0 +1,147 @@
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 6
+RETRY_BASE_SECONDS = 60
+LEASE_SECONDS = 300  # un envío interrumpido se reintenta pasado este tiempo
+STATS_KEYS = ('sent', 'failed', 'batches', 'send_seconds')
+
+
+def queue_email(to: str, subject: str, body: str) -> OutboxEmail:
+    """
+    Add an email to the outbox.
+
+    Call it inside the transaction of the change that triggers it: the email
+    exists only if that transaction commits. A sender run is kicked off on commit.
+    """
+    email = OutboxEmail.objects.create(to=to, subject=subject, body=body)
+    transaction.on_commit(_kick_sender)
+    return email
+
+
+def _kick_sender():
+    from .tasks import send_outbox_emails
+
+    # Un solo disparo por ventana corta; el resto lo recoge el beat periódico
+    if cache.add('outbox_kick', 1, 5):
+        send_outbox_emails.delay()
+
+
+def claim_batch(batch_size: int) -> list:
+    """Lease a batch of due emails (rows locked by other senders are skipped)."""
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects
+            .select_for_update(skip_locked=True)
+            .filter(status__in=['pending', 'sending'], next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        OutboxEmail.objects.filter(pk__in=[e.pk for e in emails]).update(
+            status='sending',
+            next_attempt_at=now + timedelta(seconds=LEASE_SECONDS),
+        )
+    return emails
+
+
+def drain_outbox(batch_size: int = 50, max_batches: int = 20) -> int:
+    """
+    Send due emails in batches, one SMTP connection per batch.
+
+    Returns:
+        number of emails sent
+    """
+    total_sent = 0
+    for _ in range(max_batches):
+        emails = claim_batch(batch_size)
+        if not emails:
+            break
+
+        start = time.perf_counter()
+        sent, failed = [], []
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+            for email in emails:
+                message = EmailMessage(email.subject, email.body, settings.DEFAULT_FROM_EMAIL, [email.to],
+                                       connection=connection)
+                try:
+                    connection.send_messages([message])
+                    sent.append(email)
+                except Exception as e:
+                    failed.append((email, e))
+        except Exception as e:
+            # No se pudo abrir la conexión: todo el lote se reintenta
+            failed = [(email, e) for email in emails if email not in sent]
+        finally:
+            connection.close()
+
+        _mark_sent(sent)
+        _mark_failed(failed)
+        elapsed = time.perf_counter() - start
+        _record_stats(len(sent), len(failed), elapsed)
+        total_sent += len(sent)
+        logger.info(f"Outbox batch: {len(sent)} sent, {len(failed)} failed in {elapsed:.2f}s")
+    return total_sent
+
+
+def _mark_sent(emails):
+    if emails:
+        OutboxEmail.objects.filter(pk__in=[e.pk for e in emails]).update(
+            status='sent',
+            sent_at=timezone.now(),
+            last_error='',
+        )
+
+
+def _mark_failed(failures):
+    now = timezone.now()
+    for email, error in failures:
+        attempts = email.attempts + 1
+        OutboxEmail.objects.filter(pk=email.pk).update(
+            status='failed' if attempts >= MAX_ATTEMPTS else 'pending',
+            attempts=attempts,
+            next_attempt_at=now + timedelta(seconds=RETRY_BASE_SECONDS * (2 ** (attempts - 1))),
+            last_error=str(error)[:1000],
+        )
+        logger.warning(f"Email {email.pk} to {email.to} failed (attempt {attempts}): {str(error)}")
+
+
+def _record_stats(sent: int, failed: int, elapsed: float):
+    # Los correos ya están marcados: un fallo de las estadísticas no detiene el envío
+    try:
+        for key, amount in (('sent', sent), ('failed', failed), ('batches', 1)):
+            _incr(key, amount)
+        # Tiempo acumulado en milisegundos (incr solo acepta enteros)
+        _incr('send_seconds', int(elapsed * 1000))
+    except Exception as e:
+        logger.warning(f"Outbox stats not recorded: {str(e)}")
+
+
+def _incr(name: str, amount: int):
+    key = f'outbox_stats:{name}'
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        pass
+
+
+def outbox_stats() -> dict:
+    """Sender throughput and backlog."""
+    values = cache.get_many([f'outbox_stats:{key}' for key in STATS_KEYS])
+    data = {key: values.get(f'outbox_stats:{key}', 0) for key in STATS_KEYS}
+    seconds = data.pop('send_seconds') / 1000
+    data['send_seconds'] = round(seconds, 3)
+    data['emails_per_second'] = round(data['sent'] / seconds, 2) if seconds else 0.0
+    data['pending'] = OutboxEmail.objects.filter(status__in=['pending', 'sending']).count()
+    return data
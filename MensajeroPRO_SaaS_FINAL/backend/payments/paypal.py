@@ -1,21 +1,341 @@
-import requests, os
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+import weakref
+from typing import TYPE_CHECKING
+from django.conf import settings
+
+if TYPE_CHECKING:
+    import httpx
+    import requests
+
+logger = logging.getLogger(__name__)
+
+BASE_URLS = {
+    'sandbox': 'https://api-m.sandbox.paypal.com',
+    'live': 'https://api-m.paypal.com',
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRY_DELAY = 10  # segundos; un Retry-After mayor no debe bloquear al worker
+
+
+class PayPalError(Exception):
+    """PayPal API call failed after retries."""
+
+
+class PayPalClient:
+    """
+    PayPal REST client shared by the whole process.
+
+    - OAuth access token cached until shortly before ``expires_in``;
+      concurrent threads wait for a single refresh (single-flight).
+    - One pooled keep-alive session (no new TLS handshake per call),
+      created on first use so importing this module stays cheap.
+    - Connect/read timeouts and bounded retries with exponential backoff
+      for connection errors, 429 and 5xx. POSTs carry a PayPal-Request-Id
+      so retries are idempotent.
+    """
+
+    TOKEN_MARGIN = 60  # segundos antes de expirar para renovar
+
+    def __init__(self, client_id: str = None, secret: str = None, base_url: str = None,
+                 timeout: tuple = (3.05, 15), max_retries: int = 3, backoff: float = 0.5,
+                 pool_size: int = 10):
+        self.client_id = client_id or settings.PAYPAL_CLIENT_ID
+        self.secret = secret or settings.PAYPAL_SECRET
+        self.base_url = (base_url or getattr(settings, 'PAYPAL_BASE_URL', '')
+                         or BASE_URLS.get(settings.PAYPAL_MODE, BASE_URLS['sandbox']))
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._token = None
+        self._token_expires_at = 0
+        self._token_lock = threading.Lock()
+
+    @property
+    def session(self) -> 'requests.Session':
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def _check_credentials(self):
+        # Las credenciales son opcionales para arrancar; solo se exigen al llamar a PayPal
+        if not (self.client_id and self.secret):
+            raise PayPalError("PAYPAL_CLIENT_ID / PAYPAL_SECRET are not configured")
+
+    def access_token(self, force_refresh: bool = False) -> str:
+        """Cached OAuth token (refreshed by one thread at a time)."""
+        if not force_refresh and self._token and time.monotonic() < self._token_expires_at:
+            return self._token
+
+        with self._token_lock:
+            # Otro hilo pudo haberlo renovado mientras esperábamos
+            if not force_refresh and self._token and time.monotonic() < self._token_expires_at:
+                return self._token
+
+            self._check_credentials()
+            response = self._send(
+                'POST', '/v1/oauth2/token',
+                auth=(self.client_id, self.secret),
+                data={'grant_type': 'client_credentials'},
+            )
+            if response.status_code >= 400:
+                raise PayPalError(f"POST /v1/oauth2/token failed: {response.status_code} {response.text[:200]}")
+            data = response.json()
+            self._token = data['access_token']
+            self._token_expires_at = time.monotonic() + max(int(data.get('expires_in', 0)) - self.TOKEN_MARGIN, 0)
+            logger.info("PayPal access token refreshed")
+            return self._token
+
+    def request(self, method: str, path: str, **kwargs) -> dict:
+        """Authenticated API call; returns the JSON body."""
+        headers = kwargs.pop('headers', {})
+        if method.upper() == 'POST':
+            headers.setdefault('PayPal-Request-Id', str(uuid.uuid4()))
+
+        headers['Authorization'] = f'Bearer {self.access_token()}'
+        response = self._send(method, path, headers=headers, **kwargs)
+
+        if response.status_code == 401:
+            # Token revocado antes de tiempo: renovar una vez
+            headers['Authorization'] = f'Bearer {self.access_token(force_refresh=True)}'
+            response = self._send(method, path, headers=headers, **kwargs)
+
+        if response.status_code >= 400:
+            raise PayPalError(f"{method} {path} failed: {response.status_code} {response.text[:200]}")
+        return response.json() if response.content else {}
+
+    def _send(self, method: str, path: str, **kwargs) -> 'requests.Response':
+        """Send with timeout and bounded retry/backoff."""
+        import requests
+
+        url = f'{self.base_url}{path}'
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise PayPalError(f"{method} {path} failed: {str(e)}") from e
+                delay = self.backoff * (2 ** attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    return response
+                delay = self._retry_delay(response, attempt)
+
+            logger.warning(f"PayPal {method} {path} retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+            time.sleep(delay)
+
+    def _retry_delay(self, response, attempt: int) -> float:
+        """Retry-After of a 429/5xx (capped at MAX_RETRY_DELAY), or exponential backoff."""
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), MAX_RETRY_DELAY)
+        return self.backoff * (2 ** attempt)
+
+    def create_order(self, amount, currency: str = 'USD') -> dict:
+        """Create a CAPTURE order."""
+        return self.request('POST', '/v2/checkout/orders', json={
+            'intent': 'CAPTURE',
+            'purchase_units': [{'amount': {'currency_code': currency, 'value': str(amount)}}],
+        })
+
+    def get_order(self, order_id: str) -> dict:
+        """Fetch an order (status, purchase units, captures)."""
+        return self.request('GET', f'/v2/checkout/orders/{order_id}')
+
+    def verify_webhook_signature(self, headers, body: str) -> bool:
+        """Verify a webhook delivery with PayPal's verify-webhook-signature API."""
+        try:
+            result = self.request('POST', '/v1/notifications/verify-webhook-signature', json={
+                'auth_algo': headers.get('PAYPAL-AUTH-ALGO'),
+                'cert_url': headers.get('PAYPAL-CERT-URL'),
+                'transmission_id': headers.get('PAYPAL-TRANSMISSION-ID'),
+                'transmission_sig': headers.get('PAYPAL-TRANSMISSION-SIG'),
+                'transmission_time': headers.get('PAYPAL-TRANSMISSION-TIME'),
+                'webhook_id': settings.PAYPAL_WEBHOOK_ID,
+                'webhook_event': json.loads(body),
+            })
+        except (PayPalError, ValueError) as e:
+            logger.error(f"Error verifying webhook signature: {str(e)}")
+            return False
+        return result.get('verification_status') == 'SUCCESS'
+
+
+class AsyncPayPalClient:
+    """
+    PayPal client for the ASGI path (httpx.AsyncClient).
+
+    Same behaviour as PayPalClient: pooled keep-alive connections, cached
+    token with single-flight refresh (asyncio.Lock), timeouts and bounded
+    retries with backoff, idempotent POSTs. The connection pool and the
+    lock belong to one event loop, so each loop gets its own.
+    """
+
+    TOKEN_MARGIN = PayPalClient.TOKEN_MARGIN
+    _check_credentials = PayPalClient._check_credentials
+    _retry_delay = PayPalClient._retry_delay
+
+    def __init__(self, client_id: str = None, secret: str = None, base_url: str = None,
+                 timeout: tuple = (3.05, 15), max_retries: int = 3, backoff: float = 0.5,
+                 pool_size: int = 100):
+        self.client_id = client_id or settings.PAYPAL_CLIENT_ID
+        self.secret = secret or settings.PAYPAL_SECRET
+        self.base_url = (base_url or getattr(settings, 'PAYPAL_BASE_URL', '')
+                         or BASE_URLS.get(settings.PAYPAL_MODE, BASE_URLS['sandbox']))
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+
+        self._http = weakref.WeakKeyDictionary()  # event loop -> httpx.AsyncClient
+        self._token_locks = weakref.WeakKeyDictionary()  # event loop -> asyncio.Lock
+        self._token = None
+        self._token_expires_at = 0
+
+    @property
+    def http(self) -> 'httpx.AsyncClient':
+        """Pooled client of the running event loop (httpx is only imported on the ASGI path)."""
+        loop = asyncio.get_running_loop()
+        if loop not in self._http:
+            import httpx
+
+            # Los clientes guardan referencias a su loop: soltar los de loops ya cerrados
+            for closed in [other for other in self._http if other.is_closed()]:
+                del self._http[closed]
+                self._token_locks.pop(closed, None)
+            self._http[loop] = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+        return self._http[loop]
+
+    def _token_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if loop not in self._token_locks:
+            self._token_locks[loop] = asyncio.Lock()
+        return self._token_locks[loop]
+
+    async def access_token(self, force_refresh: bool = False) -> str:
+        """Cached OAuth token (one refresh at a time)."""
+        if not force_refresh and self._token and time.monotonic() < self._token_expires_at:
+            return self._token
+
+        async with self._token_lock():
+            if not force_refresh and self._token and time.monotonic() < self._token_expires_at:
+                return self._token
+
+            self._check_credentials()
+            response = await self._send(
+                'POST', '/v1/oauth2/token',
+                auth=(self.client_id, self.secret),
+                data={'grant_type': 'client_credentials'},
+            )
+            if response.status_code >= 400:
+                raise PayPalError(f"POST /v1/oauth2/token failed: {response.status_code} {response.text[:200]}")
+            data = response.json()
+            self._token = data['access_token']
+            self._token_expires_at = time.monotonic() + max(int(data.get('expires_in', 0)) - self.TOKEN_MARGIN, 0)
+            logger.info("PayPal access token refreshed (async)")
+            return self._token
+
+    async def request(self, method: str, path: str, **kwargs) -> dict:
+        """Authenticated API call; returns the JSON body."""
+        headers = kwargs.pop('headers', {})
+        if method.upper() == 'POST':
+            headers.setdefault('PayPal-Request-Id', str(uuid.uuid4()))
+
+        headers['Authorization'] = f'Bearer {await self.access_token()}'
+        response = await self._send(method, path, headers=headers, **kwargs)
+
+        if response.status_code == 401:
+            headers['Authorization'] = f'Bearer {await self.access_token(force_refresh=True)}'
+            response = await self._send(method, path, headers=headers, **kwargs)
+
+        if response.status_code >= 400:
+            raise PayPalError(f"{method} {path} failed: {response.status_code} {response.text[:200]}")
+        return response.json() if response.content else {}
+
+    async def _send(self, method: str, path: str, **kwargs) -> 'httpx.Response':
+        """Send with timeout and bounded retry/backoff."""
+        import httpx
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.http.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise PayPalError(f"{method} {path} failed: {str(e)}") from e
+                delay = self.backoff * (2 ** attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    return response
+                delay = self._retry_delay(response, attempt)
+
+            logger.warning(f"PayPal {method} {path} retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def create_order(self, amount, currency: str = 'USD') -> dict:
+        """Create a CAPTURE order."""
+        return await self.request('POST', '/v2/checkout/orders', json={
+            'intent': 'CAPTURE',
+            'purchase_units': [{'amount': {'currency_code': currency, 'value': str(amount)}}],
+        })
+
+    async def get_order(self, order_id: str) -> dict:
+        """Fetch an order (status, purchase units, captures)."""
+        return await self.request('GET', f'/v2/checkout/orders/{order_id}')
+
+    async def verify_webhook_signature(self, headers, body: str) -> bool:
+        """Verify a webhook delivery with PayPal's verify-webhook-signature API."""
+        try:
+            result = await self.request('POST', '/v1/notifications/verify-webhook-signature', json={
+                'auth_algo': headers.get('PAYPAL-AUTH-ALGO'),
+                'cert_url': headers.get('PAYPAL-CERT-URL'),
+                'transmission_id': headers.get('PAYPAL-TRANSMISSION-ID'),
+                'transmission_sig': headers.get('PAYPAL-TRANSMISSION-SIG'),
+                'transmission_time': headers.get('PAYPAL-TRANSMISSION-TIME'),
+                'webhook_id': settings.PAYPAL_WEBHOOK_ID,
+                'webhook_event': json.loads(body),
+            })
+        except (PayPalError, ValueError) as e:
+            logger.error(f"Error verifying webhook signature: {str(e)}")
+            return False
+        return result.get('verification_status') == 'SUCCESS'
+
+
+def approval_link(order: dict) -> str:
+    """Buyer approval URL of an order."""
+    for link in order.get('links', []):
+        if link.get('rel') in ('approve', 'payer-action'):
+            return link['href']
+    raise PayPalError(f"Order {order.get('id')} has no approval link")
+
+
+paypal_service = PayPalClient()
+async_paypal_service = AsyncPayPalClient()
 
-CLIENT=os.getenv('PAYPAL_CLIENT')
-SECRET=os.getenv('PAYPAL_SECRET')
-BASE='https://api-m.sandbox.paypal.com'
 
 def token():
- r=requests.post(f'{BASE}/v1/oauth2/token',
-  auth=(CLIENT,SECRET),
-  data={'grant_type':'client_credentials'})
- return r.json()['access_token']
+    return paypal_service.access_token()
+
 
 def create_order(amount):
- t=token()
- h={'Authorization':f'Bearer {t}'}
- data={
-  'intent':'CAPTURE',
-  'purchase_units':[{'amount':{'currency_code':'USD','value':str(amount)}}]
- }
- r=requests.post(f'{BASE}/v2/checkout/orders',json=data,headers=h)
- return r.json()
+    return paypal_service.create_order(amount)
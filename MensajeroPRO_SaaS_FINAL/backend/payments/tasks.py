@@ -0,0 +1,8 @@
+from celery import shared_task
+from .outbox import drain_outbox
+
+
+@shared_task(ignore_result=True)
+def send_outbox_emails():
+    """Deliver pending outbox emails over a reused SMTP connection."""
+    drain_outbox()
@@ -1,7 +1,9 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser
 from .paypal import create_order
 from .models import Payment
+from .outbox import outbox_stats
 
 class CreatePayPalPayment(APIView):
  def post(self,req):
@@ -12,3 +14,8 @@ class CreatePayPalPayment(APIView):
    amount=10
   )
   return Response(order)
+
+class OutboxStats(APIView):
+ permission_classes=[IsAdminUser]
+ def get(self,req):
+  return Response(outbox_stats())
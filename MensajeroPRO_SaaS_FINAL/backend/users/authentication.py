@@ -0,0 +1,141 @@
+import logging
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from .models import User, ClaimsUser
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_TTL = 300
+# Acota cuánto puede sobrevivir en caché una versión leída justo antes de un bump
+TOKEN_VERSION_TTL = 300
+CLAIM_FIELDS = ('username', 'email', 'role', 'max_businesses', 'is_superuser', 'is_staff', 'is_active')
+
+
+def _version_key(user_id):
+    return f'token_version:{user_id}'
+
+
+def _user_key(user_id):
+    return f'auth_user:{user_id}'
+
+
+def token_version(user_id: int):
+    """Current token version of a user (cached; None if the user no longer exists)."""
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = User.objects.filter(pk=user_id).values_list('token_version', flat=True).first()
+        if version is not None:
+            cache.set(key, version, TOKEN_VERSION_TTL)
+    return version
+
+
+def bump_token_version(user_ids):
+    """
+    Revoke the claims of every token issued to these users.
+    
+    Tokens keep working, but their requests fall back to the stored user
+    record until the client refreshes and gets fresh claims. The cache is
+    cleared after commit, so a concurrent request can't re-cache the old
+    version from a not yet committed transaction.
+    """
+    user_ids = list(user_ids)
+    User.objects.filter(pk__in=user_ids).update(token_version=F('token_version') + 1)
+    keys = [_version_key(user_id) for user_id in user_ids] + [_user_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def forget_cached_user(user_id: int):
+    cache.delete(_user_key(user_id))
+
+
+def cached_user(user_id: int):
+    """User record from the cache, loaded from the database on a miss."""
+    key = _user_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = User.objects.filter(pk=user_id).first()
+        if user is not None:
+            cache.set(key, user, USER_CACHE_TTL)
+    return user
+
+
+def claims_snapshot(user) -> tuple:
+    """Claim values of a loaded user (deferred fields are skipped, not fetched)."""
+    return tuple(user.__dict__.get(field) for field in CLAIM_FIELDS)
+
+
+def add_claims(token, user):
+    """Embed what the permission checks need, so requests skip the user/subscription lookups."""
+    for field in CLAIM_FIELDS:
+        token[field] = getattr(user, field)
+    token['ver'] = user.token_version
+    
+    try:
+        subscription = user.subscription
+        active = subscription.is_active
+    except Exception:
+        active = False
+    token['sub_exp'] = int(subscription.end_date.timestamp()) if active else None
+    return token
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Login: tokens carry role, limits, subscription expiry and token version."""
+    
+    @classmethod
+    def get_token(cls, user):
+        return add_claims(super().get_token(user), user)
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """Refresh: the new access token gets current claims, not the ones copied from the refresh token."""
+    
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        access = AccessToken(data['access'])
+        user = User.objects.select_related('subscription').get(pk=access[api_settings.USER_ID_CLAIM])
+        data['access'] = str(add_claims(access, user))
+        return data
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that builds request.user from the token claims.
+    
+    Claims are trusted while their version matches the user's current
+    token_version (one cache read). Stale or claim-less tokens fall back
+    to the cached user record.
+    """
+    
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+        
+        version = token_version(user_id)
+        if version is None:
+            raise AuthenticationFailed("Usuario no encontrado", code="user_not_found")
+        
+        # Tokens emitidos antes de añadir un claim se tratan como desactualizados
+        if validated_token.get('ver') == version and all(field in validated_token for field in CLAIM_FIELDS):
+            if not validated_token['is_active']:
+                raise AuthenticationFailed("Usuario inactivo o no encontrado", code="user_inactive")
+            user = ClaimsUser(
+                pk=user_id,
+                token_version=version,
+                **{field: validated_token[field] for field in CLAIM_FIELDS}
+            )
+            user.subscription_expires = validated_token.get('sub_exp')
+            return user
+        
+        user = cached_user(user_id)
+        if user is None or not user.is_active:
+            raise AuthenticationFailed("Usuario inactivo o no encontrado", code="user_inactive")
+        return user
@@ -0,0 +1,51 @@
+import logging
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_TTL = 600
+
+
+def _dashboard_key(user_id):
+    return f'dashboard:{user_id}'
+
+
+def dashboard_stats(user_id: int) -> dict:
+    """
+    Business counts and subscription state of a user, cached.
+
+    Computed in one aggregate query; invalidated by the Business signals
+    and by subscription changes in the PayPal webhook handler.
+    """
+    key = _dashboard_key(user_id)
+    stats = cache.get(key)
+    if stats is None:
+        stats = User.objects.filter(pk=user_id).annotate(
+            total=Count('businesses'),
+            active=Count('businesses', filter=Q(businesses__is_active=True)),
+        ).values(
+            'total', 'active', 'subscription__is_active', 'subscription__end_date',
+            'subscription__monthly_message_limit',
+        ).get()
+        cache.set(key, stats, DASHBOARD_TTL)
+    return stats
+
+
+def has_active_subscription(stats: dict) -> bool:
+    """Same rule as User.has_active_subscription, on cached stats (expiry checked at read time)."""
+    end_date = stats['subscription__end_date']
+    return bool(stats['subscription__is_active']) and end_date is not None and end_date >= timezone.now()
+
+
+def invalidate_dashboard(user_ids):
+    """
+    Forget cached dashboard stats (call when businesses or subscriptions
+    change). Runs after commit, so a concurrent request can't re-cache the
+    old stats before the change is visible.
+    """
+    keys = [_dashboard_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,54 @@
+from .dashboard import dashboard_stats, has_active_subscription
+from .metering import used_messages
+
+
+class Entitlements:
+    """
+    What the current user is allowed to do, computed once per request.
+
+    Role and limits come from the authenticated user; business counts and
+    subscription state come from the cached dashboard aggregates, so
+    permissions, views and serializers share one lookup instead of
+    re-running count()/subscription queries on every property access.
+    """
+    
+    def __init__(self, user, stats: dict):
+        self.user_id = user.pk
+        self.role = user.role
+        self.is_superadmin = user.is_superadmin
+        self.max_businesses = user.max_businesses
+        self.business_count = stats['total']
+        self.active_businesses = stats['active']
+        self.has_active_subscription = has_active_subscription(stats)
+        self.monthly_message_limit = stats['subscription__monthly_message_limit'] or 0
+    
+    @property
+    def can_create_business(self):
+        return self.is_superadmin or self.business_count < self.max_businesses
+    
+    @property
+    def business_limit(self):
+        return "Ilimitado" if self.is_superadmin else self.max_businesses
+    
+    @property
+    def message_limit(self):
+        """Monthly messages per business (None = unlimited)."""
+        if self.is_superadmin:
+            return None
+        return self.monthly_message_limit if self.has_active_subscription else 0
+    
+    def remaining_messages(self, business_id: int):
+        """Messages left this period for one of the user's businesses (None = unlimited)."""
+        limit = self.message_limit
+        if limit is None:
+            return None
+        return max(limit - used_messages(business_id), 0)
+
+
+def get_entitlements(request) -> Entitlements:
+    """Entitlements of request.user, built on first use and kept on the request."""
+    entitlements = getattr(request, 'entitlements', None)
+    if entitlements is None or entitlements.user_id != request.user.pk:
+        entitlements = Entitlements(request.user, dashboard_stats(request.user.pk))
+        request.entitlements = entitlements
+    return entitlements
@@ -0,0 +1,51 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from payments.models import WebhookEvent
+from users.webhooks import enqueue_webhook_event
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-enqueue PayPal webhook events from the inbox (failed ones by default); '
+        'processed events are never replayed'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', type=str, default='failed',
+                            choices=['failed', 'pending'], help='Events to replay')
+        parser.add_argument('--event-id', type=str, action='append', help='Replay specific event id(s)')
+        parser.add_argument('--order-id', type=str, help='Only events of this PayPal order')
+        parser.add_argument('--older-than', type=int, default=0,
+                            help='Only events received more than N minutes ago (useful for stuck pending)')
+        parser.add_argument('--dry-run', action='store_true', help='List the events without enqueuing')
+
+    def handle(self, *args, **options):
+        if options['event_id']:
+            events = WebhookEvent.objects.filter(event_id__in=options['event_id'])
+            processed = events.filter(status='processed').values_list('event_id', flat=True)
+            for event_id in processed:
+                self.stdout.write(self.style.WARNING(f'{event_id} already processed, skipped'))
+        else:
+            events = WebhookEvent.objects.filter(status=options['status'])
+        # Un evento aplicado no se vuelve a aplicar (cobros, reembolsos)
+        events = events.exclude(status='processed')
+        if options['order_id']:
+            events = events.filter(paypal_order_id=options['order_id'])
+        if options['older_than']:
+            events = events.filter(received_at__lt=timezone.now() - timedelta(minutes=options['older_than']))
+
+        count = 0
+        for event in events.order_by('pk').iterator():
+            self.stdout.write(
+                f'{event.event_id} {event.event_type} order={event.paypal_order_id or "-"} '
+                f'status={event.status} attempts={event.attempts} {event.last_error[:80]}'
+            )
+            if not options['dry_run']:
+                # Vuelve a 'pending': el worker lo aplica y detiene los eventos posteriores de su orden
+                WebhookEvent.objects.filter(pk=event.pk, status='failed').update(status='pending')
+                enqueue_webhook_event(event)
+            count += 1
+
+        action = 'would be replayed' if options['dry_run'] else 'replayed'
+        self.stdout.write(self.style.SUCCESS(f'✓ {count} events {action}'))
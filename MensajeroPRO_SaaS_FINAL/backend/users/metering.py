@@ -0,0 +1,197 @@
+import logging
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from core.redis import get_redis
+from .models import Business, MessageUsage
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('messages', 'prompt_tokens', 'completion_tokens')
+DIRTY_KEY = 'usage:dirty'
+LIMIT_TTL = 300
+
+
+def current_period() -> str:
+    """Billing period of today (calendar month, local time)."""
+    return timezone.localdate().strftime('%Y%m')
+
+
+def _totals_key(business_id, period):
+    return f'usage:{period}:{business_id}'
+
+
+def _delta_key(business_id, period):
+    return f'usage_delta:{period}:{business_id}'
+
+
+def record_usage(business_id: int, messages: int = 0, usage: dict = None):
+    """
+    Count messages/tokens for a business in the current period.
+
+    Updates the running totals (used by the quota check) and the pending
+    delta (flushed to Postgres in batches) in one Redis round-trip.
+    """
+    period = current_period()
+    increments = {'messages': messages}
+    if usage:
+        increments['prompt_tokens'] = usage.get('prompt_tokens', 0)
+        increments['completion_tokens'] = usage.get('completion_tokens', 0)
+
+    pipe = get_redis().pipeline()
+    for field, amount in increments.items():
+        if amount:
+            pipe.hincrby(_totals_key(business_id, period), field, amount)
+            pipe.hincrby(_delta_key(business_id, period), field, amount)
+    pipe.expire(_totals_key(business_id, period), 60 * 60 * 24 * 40)
+    pipe.sadd(DIRTY_KEY, f'{period}:{business_id}')
+    pipe.execute()
+
+
+def message_limit(business_id: int):
+    """
+    Monthly message limit of a business (None = unlimited), cached.
+    """
+    key = f'usage_limit:{business_id}'
+    limit = cache.get(key)
+    if limit is None:
+        owner = Business.objects.select_related('owner').get(pk=business_id).owner
+        if owner.is_superadmin:
+            limit = -1
+        elif owner.has_active_subscription:
+            limit = owner.subscription.monthly_message_limit
+        else:
+            limit = 0
+        cache.set(key, limit, LIMIT_TTL)
+    return None if limit == -1 else limit
+
+
+def invalidate_limit(business_ids):
+    """Forget cached limits (call when a subscription changes); runs after commit."""
+    keys = [f'usage_limit:{business_id}' for business_id in business_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def owner_plan(owner_id: int, use_cache: bool = True):
+    """
+    Plan type of a user's active subscription (None without one), cached.
+    
+    use_cache=False reads the database and leaves the cache alone (inside
+    a transaction that changes the subscription).
+    """
+    from payments.models import Subscription
+
+    key = f'owner_plan:{owner_id}'
+    plan = cache.get(key) if use_cache else None
+    if plan is None:
+        plan = Subscription.objects.filter(
+            user_id=owner_id, is_active=True, end_date__gte=timezone.now()
+        ).values_list('plan_type', flat=True).first() or ''
+        if use_cache:
+            cache.set(key, plan, LIMIT_TTL)
+    return plan or None
+
+
+def invalidate_plan(owner_ids):
+    """Forget cached plans (call when a subscription changes); runs after commit."""
+    keys = [f'owner_plan:{owner_id}' for owner_id in owner_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def used_messages(business_id: int) -> int:
+    """Messages used in the current period (seeded from Postgres if Redis lost it)."""
+    period = current_period()
+    r = get_redis()
+    key = _totals_key(business_id, period)
+    value = r.hget(key, 'messages')
+    if value is not None:
+        return int(value)
+
+    row = MessageUsage.objects.filter(business_id=business_id, period=period).values(*FIELDS).first() or {}
+    pipe = r.pipeline()
+    for field in FIELDS:
+        pipe.hsetnx(key, field, row.get(field, 0))
+    pipe.hget(key, 'messages')
+    return int(pipe.execute()[-1] or 0)
+
+
+def check_quota(business_id: int) -> bool:
+    """O(1) check: can this business spend another message this period?"""
+    limit = message_limit(business_id)
+    if limit is None:
+        return True
+    return used_messages(business_id) < limit
+
+
+def flush_usage(batch_size: int = 500) -> int:
+    """
+    Move pending deltas from Redis to MessageUsage rows.
+
+    Each delta hash is renamed atomically before reading it, so increments
+    that arrive during the flush go to a fresh delta and are never lost.
+
+    Returns:
+        number of (business, period) rows updated
+    """
+    r = get_redis()
+    flushed = 0
+    while True:
+        members = r.spop(DIRTY_KEY, batch_size)
+        if not members:
+            return flushed
+
+        deltas = {}
+        for member in members:
+            period, business_id = member.decode().split(':')
+            source = _delta_key(business_id, period)
+            claimed = f'{source}:flushing'
+            try:
+                r.rename(source, claimed)
+            except Exception:
+                continue  # nada pendiente
+            values = {k.decode(): int(v) for k, v in r.hgetall(claimed).items()}
+            deltas[(int(business_id), period)] = (values, claimed)
+
+        try:
+            _apply_deltas(deltas)
+        except Exception:
+            _restore_deltas(r, deltas)
+            raise
+
+        if deltas:
+            r.delete(*[claimed for _, claimed in deltas.values()])
+        flushed += len(deltas)
+        logger.info(f"Usage flushed for {len(deltas)} businesses")
+
+
+def _apply_deltas(deltas: dict):
+    existing = set(Business.objects.filter(
+        pk__in={business_id for business_id, _ in deltas}
+    ).values_list('pk', flat=True))
+
+    with transaction.atomic():
+        for (business_id, period), (values, _) in deltas.items():
+            if business_id not in existing:
+                continue
+            updates = {field: F(field) + values.get(field, 0) for field in FIELDS}
+            updated = MessageUsage.objects.filter(business_id=business_id, period=period).update(**updates)
+            if not updated:
+                usage, created = MessageUsage.objects.get_or_create(
+                    business_id=business_id,
+                    period=period,
+                    defaults={field: values.get(field, 0) for field in FIELDS},
+                )
+                if not created:
+                    MessageUsage.objects.filter(pk=usage.pk).update(**updates)
+
+
+def _restore_deltas(r, deltas: dict):
+    """Put claimed deltas back so the next flush retries them."""
+    pipe = r.pipeline()
+    for (business_id, period), (values, claimed) in deltas.items():
+        for field, amount in values.items():
+            pipe.hincrby(_delta_key(business_id, period), field, amount)
+        pipe.sadd(DIRTY_KEY, f'{period}:{business_id}')
+        pipe.delete(claimed)
+    pipe.execute()
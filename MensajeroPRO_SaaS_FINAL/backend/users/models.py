@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
 
@@ -20,6 +21,9 @@ class User(AbstractUser):
     # Límites de negocios según rol
     max_businesses = models.IntegerField(default=0)
     
+    # Se incrementa para invalidar los claims de los JWT emitidos
+    token_version = models.PositiveIntegerField(default=0)
+    
     # Tracking
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -64,6 +68,26 @@ class User(AbstractUser):
         return self.max_businesses
 
 
+class ClaimsUser(User):
+    """
+    User rebuilt from access token claims, without a database fetch.
+    
+    Read-only: it only carries the fields present in the token.
+    """
+    
+    subscription_expires = None
+    
+    class Meta:
+        proxy = True
+    
+    def save(self, *args, **kwargs):
+        raise TypeError("ClaimsUser is built from token claims and cannot be saved")
+    
+    @property
+    def has_active_subscription(self):
+        return self.subscription_expires is not None and self.subscription_expires > timezone.now().timestamp()
+
+
 class Business(models.Model):
     """Business/Negocio model."""
     
@@ -88,6 +112,12 @@ class Business(models.Model):
     
     # WhatsApp configuration
     whatsapp_number = models.CharField(max_length=20, blank=True)
+    whatsapp_phone_number_id = models.CharField(
+        max_length=50,
+        blank=True,
+        db_index=True,
+        help_text="Phone number ID de Meta (Cloud API)"
+    )
     whatsapp_token = models.CharField(max_length=500, blank=True)
     
     # AI configuration
@@ -112,4 +142,29 @@ class Business(models.Model):
         ]
     
     def __str__(self):
-        return f"{self.name} ({self.get_business_type_display()}) - {self.owner.username}"
\ No newline at end of file
+        return f"{self.name} ({self.get_business_type_display()}) - {self.owner.username}"
+
+
+class MessageUsage(models.Model):
+    """Messages and tokens consumed by a business in a billing period (flushed from Redis)."""
+    
+    business = models.ForeignKey(
+        Business,
+        on_delete=models.CASCADE,
+        related_name='usage'
+    )
+    period = models.CharField(max_length=6, help_text="Periodo de facturación (YYYYMM)")
+    
+    messages = models.BigIntegerField(default=0)
+    prompt_tokens = models.BigIntegerField(default=0)
+    completion_tokens = models.BigIntegerField(default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['business', 'period'], name='unique_usage_period'),
+        ]
+    
+    def __str__(self):
+        return f"{self.business_id} {self.period}: {self.messages} mensajes"
@@ -1,4 +1,5 @@
 from rest_framework import permissions
+from .entitlements import get_entitlements
 
 
 class CanCreateBusiness(permissions.BasePermission):
@@ -15,20 +16,20 @@ class CanCreateBusiness(permissions.BasePermission):
         if request.method != 'POST':
             return True
         
-        user = request.user
+        entitlements = get_entitlements(request)
         
         # Superadmin = acceso total gratis
-        if user.is_superadmin:
+        if entitlements.is_superadmin:
             return True
         
         # Usuario normal debe tener suscripción activa
-        if not user.has_active_subscription:
+        if not entitlements.has_active_subscription:
             self.message = "Necesitas una suscripción activa para crear negocios. ¡Actualiza tu plan!"
             return False
         
         # Verificar límite de negocios
-        if not user.can_create_business:
-            self.message = f"Has alcanzado el límite de {user.max_businesses} negocios. ¡Actualiza tu plan para crear más!"
+        if not entitlements.can_create_business:
+            self.message = f"Has alcanzado el límite de {entitlements.max_businesses} negocios. ¡Actualiza tu plan para crear más!"
             return False
         
         return True
@@ -43,8 +44,8 @@ class IsSuperAdminOrOwner(permissions.BasePermission):
     
     def has_object_permission(self, request, view, obj):
         # Superadmin puede todo
-        if request.user.is_superadmin:
+        if get_entitlements(request).is_superadmin:
             return True
         
         # Owner puede editar su propio negocio
-        return obj.owner == request.user
\ No newline at end of file
+        return obj.owner_id == request.user.pk
\ No newline at end of file
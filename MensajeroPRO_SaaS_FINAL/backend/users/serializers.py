@@ -6,7 +6,7 @@ class UserSerializer(serializers.ModelSerializer):
     """User serializer."""
     
     is_superadmin = serializers.ReadOnlyField()
-    can_create_business = serializers.ReadOnlyField()
+    can_create_business = serializers.SerializerMethodField()
     business_limit = serializers.SerializerMethodField()
     
     class Meta:
@@ -26,8 +26,19 @@ class UserSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'role']
     
+    def _entitlements(self, obj):
+        entitlements = self.context.get('entitlements')
+        if entitlements is not None and entitlements.user_id == obj.pk:
+            return entitlements
+        return None
+    
     def get_business_limit(self, obj):
-        return obj.get_business_limit()
+        entitlements = self._entitlements(obj)
+        return entitlements.business_limit if entitlements else obj.get_business_limit()
+    
+    def get_can_create_business(self, obj):
+        entitlements = self._entitlements(obj)
+        return entitlements.can_create_business if entitlements else obj.can_create_business
 
 
 class BusinessSerializer(serializers.ModelSerializer):
@@ -45,6 +56,7 @@ class BusinessSerializer(serializers.ModelSerializer):
             'name',
             'description',
             'whatsapp_number',
+            'whatsapp_phone_number_id',
             'whatsapp_token',
             'ai_context',
             'is_active',
@@ -60,4 +72,10 @@ class BusinessSerializer(serializers.ModelSerializer):
         """Validate business name."""
         if len(value) < 3:
             raise serializers.ValidationError("El nombre debe tener al menos 3 caracteres")
-        return value
\ No newline at end of file
+        return value
+
+
+class BusinessListSerializer(BusinessSerializer):
+    """Business serializer for list pages: the owner is sent once per response, not per row."""
+    
+    owner = serializers.PrimaryKeyRelatedField(read_only=True)
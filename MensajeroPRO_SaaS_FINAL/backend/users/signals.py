@@ -0,0 +1,27 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from .models import User, Business
+from .dashboard import invalidate_dashboard
+from .authentication import forget_cached_user, bump_token_version, claims_snapshot
+
+
+@receiver(post_save, sender=Business)
+@receiver(post_delete, sender=Business)
+def invalidate_dashboard_on_business_change(sender, instance, **kwargs):
+    invalidate_dashboard([instance.owner_id])
+
+
+@receiver(post_init, sender=User)
+def remember_claims(sender, instance, **kwargs):
+    instance._claims_snapshot = claims_snapshot(instance)
+
+
+@receiver(post_save, sender=User)
+def forget_cached_user_on_save(sender, instance, created, **kwargs):
+    forget_cached_user(instance.pk)
+    # Cambios hechos fuera del webhook (admin, shell): activo, rol, staff, límites...
+    current = claims_snapshot(instance)
+    if not created and current != instance._claims_snapshot:
+        bump_token_version([instance.pk])
+        instance.refresh_from_db(fields=['token_version'])
+    instance._claims_snapshot = current
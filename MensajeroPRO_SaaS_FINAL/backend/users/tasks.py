@@ -0,0 +1,87 @@
+import logging
+from celery import shared_task
+from django.db import transaction
+from django.utils import timezone
+from .metering import flush_usage
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def flush_usage_counters():
+    """Periodic flush of Redis usage counters to Postgres."""
+    flush_usage()
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=30, ignore_result=True)
+def process_paypal_event(self, webhook_event_id: int):
+    """
+    Apply one inbox event.
+
+    Events of the same PayPal order are applied strictly in arrival order:
+    if an earlier one is still pending, this one waits. Failures are
+    recorded on the row and retried with exponential backoff; once the
+    retries are exhausted the event is marked 'failed' for good (it no
+    longer holds back later events; see replay_webhook_events).
+    """
+    from payments.models import WebhookEvent
+
+    final = self.request.retries >= self.max_retries
+    with transaction.atomic():
+        webhook_event = WebhookEvent.objects.select_for_update().get(pk=webhook_event_id)
+        if webhook_event.status != 'pending':
+            return
+
+        waiting = webhook_event.paypal_order_id and WebhookEvent.objects.filter(
+            paypal_order_id=webhook_event.paypal_order_id,
+            pk__lt=webhook_event.pk,
+            status='pending',
+        ).exists()
+
+        if waiting:
+            error = WebhookEventBlocked(f"Earlier events of order {webhook_event.paypal_order_id} still pending")
+            if final:
+                record_webhook_failure(webhook_event, error, final)
+        else:
+            error = apply_webhook_event(webhook_event, final)
+        if error is None or final:
+            return
+
+    raise self.retry(exc=error, countdown=self.default_retry_delay * (2 ** self.request.retries))
+
+
+class WebhookEventBlocked(Exception):
+    """An earlier event of the same PayPal order has not been applied yet."""
+
+
+def apply_webhook_event(webhook_event, final: bool = True):
+    """
+    Run the handler and record the outcome on the inbox row; returns the error, if any.
+
+    A failure leaves the row 'pending' for the next retry, or 'failed' when
+    it was the last attempt (final=True).
+    """
+    from .webhooks import PayPalEventHandler
+
+    webhook_event.attempts += 1
+    try:
+        with transaction.atomic():
+            PayPalEventHandler().handle(webhook_event.payload)
+    except Exception as e:
+        logger.error(f"Error processing PayPal event {webhook_event.event_id}: {str(e)}", exc_info=True)
+        record_webhook_failure(webhook_event, e, final)
+        return e
+
+    webhook_event.status = 'processed'
+    webhook_event.last_error = ''
+    webhook_event.processed_at = timezone.now()
+    webhook_event.save(update_fields=['status', 'attempts', 'last_error', 'processed_at'])
+    return None
+
+
+def record_webhook_failure(webhook_event, error, final: bool):
+    webhook_event.status = 'failed' if final else 'pending'
+    webhook_event.last_error = str(error)
+    webhook_event.save(update_fields=['status', 'attempts', 'last_error'])
+    if final:
+        logger.error(f"PayPal event {webhook_event.event_id} failed after {webhook_event.attempts} attempts")
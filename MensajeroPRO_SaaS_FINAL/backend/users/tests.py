@@ -0,0 +1,40 @@
+from django.core.cache import cache
+from rest_framework.test import APITestCase
+from .models import Business, User
+
+
+class BusinessListQueryBudgetTests(APITestCase):
+    """The business list costs the same number of queries for 1 or 50 businesses."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='enterprise', email='e@example.com',
+                                        role='admin', max_businesses=50)
+        Business.objects.bulk_create(
+            Business(owner=cls.owner, name=f'Negocio {i}') for i in range(50)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.owner)
+
+    def test_first_page_query_budget(self):
+        # Agregados del dashboard (1), conteo del paginador (1) y la página con el dueño (1)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/businesses/', secure=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total'], 50)
+        self.assertEqual(len(response.data['businesses']), 20)
+        self.assertFalse(response.data['can_create_more'])
+        self.assertIsNotNone(response.data['next'])
+
+    def test_last_page_query_budget_with_cached_dashboard(self):
+        self.client.get('/api/businesses/', secure=True)
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/businesses/?page=3', secure=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['businesses']), 10)
+        self.assertIsNone(response.data['next'])
@@ -3,10 +3,13 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.pagination import PageNumberPagination
+from django.db import transaction
 from django.shortcuts import get_object_or_404
-from .models import Business
-from .serializers import BusinessSerializer
+from .models import User, Business
+from .serializers import BusinessSerializer, BusinessListSerializer, UserSerializer
 from .permissions import CanCreateBusiness
+from .entitlements import get_entitlements
 
 logger = logging.getLogger(__name__)
 
@@ -17,43 +20,50 @@ class BusinessListCreateView(APIView):
     permission_classes = [IsAuthenticated, CanCreateBusiness]
     
     def get(self, request):
-        """Get all businesses for current user."""
-        businesses = Business.objects.filter(owner=request.user)
-        serializer = BusinessSerializer(businesses, many=True)
+        """Get the businesses of the current user (paginated, PAGE_SIZE per page)."""
+        user = request.user
+        entitlements = get_entitlements(request)
+        businesses = Business.objects.filter(owner=user).select_related('owner').order_by('-created_at')
+        
+        paginator = PageNumberPagination()
+        page = paginator.paginate_queryset(businesses, request, view=self)
         
         return Response({
-            'businesses': serializer.data,
-            'total': businesses.count(),
-            'limit': request.user.get_business_limit(),
-            'can_create_more': request.user.can_create_business
+            'businesses': BusinessListSerializer(page, many=True).data,
+            'owner': UserSerializer(user, context={'entitlements': entitlements}).data,
+            'total': paginator.page.paginator.count,
+            'limit': entitlements.business_limit,
+            'can_create_more': entitlements.can_create_business,
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
         })
     
     def post(self, request):
         """Create new business."""
-        # Verificar si puede crear más negocios
-        if not request.user.can_create_business:
-            # Si no es superadmin y llegó al límite
-            if not request.user.is_superadmin:
+        serializer = BusinessSerializer(data=request.data)
+        
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        with transaction.atomic():
+            # Bloquear al usuario: dos POST simultáneos no pueden pasar ambos el límite
+            owner = User.objects.select_for_update().get(pk=request.user.pk)
+            if not owner.is_superadmin and owner.businesses.count() >= owner.max_businesses:
                 return Response({
                     'error': 'Has alcanzado el límite de negocios',
                     'message': 'Actualiza tu plan para crear más negocios',
-                    'current_limit': request.user.max_businesses,
+                    'current_limit': owner.max_businesses,
                     'upgrade_required': True
                 }, status=status.HTTP_403_FORBIDDEN)
-        
-        serializer = BusinessSerializer(data=request.data)
-        
-        if serializer.is_valid():
-            business = serializer.save(owner=request.user)
-            
-            logger.info(f"Business created: {business.name} by {request.user.username}")
             
-            return Response({
-                'business': BusinessSerializer(business).data,
-                'message': 'Negocio creado exitosamente'
-            }, status=status.HTTP_201_CREATED)
+            business = serializer.save(owner=owner)
         
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        logger.info(f"Business created: {business.name} by {request.user.username}")
+        
+        return Response({
+            'business': BusinessSerializer(business).data,
+            'message': 'Negocio creado exitosamente'
+        }, status=status.HTTP_201_CREATED)
 
 
 class BusinessDetailView(APIView):
@@ -66,7 +76,7 @@ class BusinessDetailView(APIView):
         business = get_object_or_404(Business, id=business_id)
         
         # Verificar ownership (superadmin puede ver todos)
-        if not request.user.is_superadmin and business.owner != request.user:
+        if not get_entitlements(request).is_superadmin and business.owner_id != request.user.pk:
             return None
         
         return business
@@ -129,36 +139,30 @@ class UserDashboardView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        """Get user dashboard data."""
+        """Get user dashboard data (aggregates served from cache)."""
         user = request.user
-        
-        # Business stats
-        businesses = Business.objects.filter(owner=user)
-        active_businesses = businesses.filter(is_active=True).count()
-        
-        # Subscription info
-        has_subscription = user.has_active_subscription
+        entitlements = get_entitlements(request)
         
         dashboard_data = {
             'user': {
                 'username': user.username,
                 'email': user.email,
                 'role': user.get_role_display(),
-                'is_superadmin': user.is_superadmin,
+                'is_superadmin': entitlements.is_superadmin,
             },
             'businesses': {
-                'total': businesses.count(),
-                'active': active_businesses,
-                'limit': user.get_business_limit(),
-                'can_create_more': user.can_create_business,
+                'total': entitlements.business_count,
+                'active': entitlements.active_businesses,
+                'limit': entitlements.business_limit,
+                'can_create_more': entitlements.can_create_business,
             },
             'subscription': {
-                'active': has_subscription,
-                'needs_upgrade': not user.is_superadmin and not user.can_create_business,
+                'active': entitlements.has_active_subscription,
+                'needs_upgrade': not entitlements.can_create_business,
             },
             'permissions': {
-                'unlimited_access': user.is_superadmin,
-                'requires_payment': not user.is_superadmin and not has_subscription,
+                'unlimited_access': entitlements.is_superadmin,
+                'requires_payment': not entitlements.is_superadmin and not entitlements.has_active_subscription,
             }
         }
         
@@ -1,39 +1,83 @@
+import json
 import logging
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny
-from django.core.mail import send_mail
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from datetime import timedelta
 from django.utils import timezone
-from .models import Payment, Subscription
-from .paypal import paypal_service
+from core.celery import shard_queue
+from payments.models import Payment, PaymentStatus, Subscription, WebhookEvent
+from payments.paypal import paypal_service, async_paypal_service
+from payments.outbox import queue_email
+from ai.prompts import refresh_budgets
+from .metering import invalidate_limit, invalidate_plan
+from .dashboard import invalidate_dashboard
+from .authentication import bump_token_version
+from .models import User, Business
 
 logger = logging.getLogger(__name__)
 
-# Plan limits
+# Plan limits (inbound_*: token bucket of the WhatsApp admission control)
 PLAN_LIMITS = {
     'basic': {
         'max_businesses': 1,
         'monthly_messages': 1000,
+        'inbound_per_minute': 30,
+        'inbound_burst': 60,
         'price': 10.00,
     },
     'pro': {
         'max_businesses': 5,
         'monthly_messages': 10000,
+        'inbound_per_minute': 120,
+        'inbound_burst': 300,
         'price': 50.00,
     },
     'enterprise': {
         'max_businesses': 50,
         'monthly_messages': 100000,
+        'inbound_per_minute': 600,
+        'inbound_burst': 1500,
         'price': 200.00,
     },
 }
 
 
+def event_order_id(event: dict) -> str:
+    """PayPal order id an event refers to (orders carry it in `id`, captures in related_ids)."""
+    resource = event.get('resource', {})
+    if event.get('event_type', '').startswith('CHECKOUT.ORDER.'):
+        return resource.get('id') or ''
+    return resource.get('supplementary_data', {}).get('related_ids', {}).get('order_id') or ''
+
+
+def enqueue_webhook_event(webhook_event: WebhookEvent):
+    """Send an inbox event to its order's shard queue (FIFO per order)."""
+    from .tasks import process_paypal_event
+
+    queue = shard_queue(
+        settings.PAYPAL_WEBHOOK_QUEUE,
+        webhook_event.paypal_order_id or webhook_event.event_id,
+        settings.PAYPAL_WEBHOOK_SHARDS,
+    )
+    process_paypal_event.apply_async(args=[webhook_event.pk], queue=queue)
+
+
 class PayPalWebhookView(APIView):
-    """Handle PayPal webhook events."""
+    """
+    Handle PayPal webhook events.
+    
+    Verified events are stored in the WebhookEvent inbox and acknowledged
+    right away; a Celery worker applies them (see PayPalEventHandler).
+    """
     
     permission_classes = [AllowAny]
     
@@ -55,29 +99,26 @@ class PayPalWebhookView(APIView):
                     status=status.HTTP_401_UNAUTHORIZED
                 )
             
-            # Process event
-            event_type = request.data.get('event_type')
-            resource = request.data.get('resource', {})
+            event = json.loads(raw_body)
+            event_id = event.get('id')
+            if not event_id:
+                return Response({'error': 'Missing event id'}, status=status.HTTP_400_BAD_REQUEST)
             
-            logger.info(f"Processing PayPal webhook event: {event_type}")
-            
-            # Handle different event types
-            if event_type == 'CHECKOUT.ORDER.APPROVED':
-                self._handle_order_approved(resource)
-                
-            elif event_type == 'PAYMENT.CAPTURE.COMPLETED':
-                self._handle_payment_completed(resource)
-                
-            elif event_type == 'PAYMENT.CAPTURE.DENIED':
-                self._handle_payment_denied(resource)
-                
-            elif event_type == 'PAYMENT.CAPTURE.REFUNDED':
-                self._handle_payment_refunded(resource)
-                
-            else:
-                logger.info(f"Unhandled event type: {event_type}")
+            # Persist in the inbox; the unique event_id drops PayPal retries
+            try:
+                with transaction.atomic():
+                    webhook_event = WebhookEvent.objects.create(
+                        event_id=event_id,
+                        event_type=event.get('event_type', ''),
+                        paypal_order_id=event_order_id(event),
+                        payload=event,
+                    )
+                    transaction.on_commit(lambda: enqueue_webhook_event(webhook_event))
+            except IntegrityError:
+                logger.info(f"Duplicate PayPal webhook ignored: {event_id}")
+                return Response({'status': 'duplicate'}, status=status.HTTP_200_OK)
             
-            return Response({'status': 'success'}, status=status.HTTP_200_OK)
+            return Response({'status': 'accepted'}, status=status.HTTP_200_OK)
             
         except Exception as e:
             logger.error(f"Error processing webhook: {str(e)}", exc_info=True)
@@ -85,153 +126,209 @@ class PayPalWebhookView(APIView):
                 {'error': 'Internal server error'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPayPalWebhookView(View):
+    """
+    PayPalWebhookView for ASGI deployments (SERVER_MODE='asgi').
     
-    def _handle_order_approved(self, resource):
-        """Handle order approval event."""
-        try:
-            order_id = resource.get('id')
-            
-            payment = Payment.objects.filter(
-                paypal_order_id=order_id
-            ).first()
-            
-            if payment:
-                payment.status = 'APPROVED'
-                payment.save()
-                logger.info(f"Order approved: {order_id}")
-                
-        except Exception as e:
-            logger.error(f"Error handling order approval: {str(e)}")
+    The signature check is awaited on the async PayPal client and the
+    inbox insert uses the async ORM, so slow PayPal verification calls
+    don't hold a worker.
+    """
     
-    def _handle_payment_completed(self, resource):
-        """Handle payment completion event."""
+    async def post(self, request):
         try:
-            # Get order ID from resource
-            order_id = None
-            if 'supplementary_data' in resource:
-                related_ids = resource['supplementary_data'].get('related_ids', {})
-                order_id = related_ids.get('order_id')
+            raw_body = request.body.decode('utf-8')
+            
+            is_valid = await async_paypal_service.verify_webhook_signature(
+                headers=request.headers,
+                body=raw_body
+            )
+            if not is_valid:
+                logger.warning("Invalid webhook signature received")
+                return JsonResponse({'error': 'Invalid signature'}, status=401)
             
-            if not order_id:
-                logger.warning("No order_id found in payment completion event")
-                return
+            event = json.loads(raw_body)
+            event_id = event.get('id')
+            if not event_id:
+                return JsonResponse({'error': 'Missing event id'}, status=400)
             
-            payment = Payment.objects.filter(
-                paypal_order_id=order_id
-            ).first()
+            try:
+                webhook_event = await WebhookEvent.objects.acreate(
+                    event_id=event_id,
+                    event_type=event.get('event_type', ''),
+                    paypal_order_id=event_order_id(event),
+                    payload=event,
+                )
+            except IntegrityError:
+                logger.info(f"Duplicate PayPal webhook ignored: {event_id}")
+                return JsonResponse({'status': 'duplicate'})
             
-            if not payment:
-                logger.warning(f"Payment not found for order: {order_id}")
-                return
+            await sync_to_async(enqueue_webhook_event, thread_sensitive=False)(webhook_event)
+            return JsonResponse({'status': 'accepted'})
             
-            # Update payment status
-            payment.status = 'COMPLETED'
-            payment.completed_at = timezone.now()
-            payment.save()
+        except Exception as e:
+            logger.error(f"Error processing webhook: {str(e)}", exc_info=True)
+            return JsonResponse({'error': 'Internal server error'}, status=500)
+
+
+class PayPalEventHandler:
+    """Apply PayPal webhook events to payments and subscriptions."""
+    
+    def handle(self, event: dict):
+        event_type = event.get('event_type')
+        resource = event.get('resource', {})
+        
+        logger.info(f"Processing PayPal webhook event: {event_type}")
+        
+        # Handle different event types
+        if event_type == 'CHECKOUT.ORDER.APPROVED':
+            self._handle_order_approved(resource)
             
-            # Create or update subscription WITH business limits
-            self._create_subscription_with_limits(payment)
+        elif event_type == 'PAYMENT.CAPTURE.COMPLETED':
+            self._handle_payment_completed(resource)
             
-            # Send confirmation email
-            self._send_payment_confirmation_email(payment)
+        elif event_type == 'PAYMENT.CAPTURE.DENIED':
+            self._handle_payment_denied(resource)
             
-            logger.info(f"Payment completed: {payment.id}")
+        elif event_type == 'PAYMENT.CAPTURE.REFUNDED':
+            self._handle_payment_refunded(resource)
             
-        except Exception as e:
-            logger.error(f"Error handling payment completion: {str(e)}", exc_info=True)
+        else:
+            logger.info(f"Unhandled event type: {event_type}")
+    
+    def _handle_order_approved(self, resource):
+        """Handle order approval event."""
+        order_id = resource.get('id')
+        
+        if Payment.objects.bulk_transition([order_id], PaymentStatus.APPROVED):
+            logger.info(f"Order approved: {order_id}")
+    
+    def _handle_payment_completed(self, resource):
+        """Handle payment completion event."""
+        # Get order ID from resource
+        order_id = None
+        if 'supplementary_data' in resource:
+            related_ids = resource['supplementary_data'].get('related_ids', {})
+            order_id = related_ids.get('order_id')
+        
+        if not order_id:
+            logger.warning("No order_id found in payment completion event")
+            return
+        
+        payment = Payment.objects.select_for_update().filter(
+            paypal_order_id=order_id
+        ).first()
+        
+        if not payment:
+            logger.warning(f"Payment not found for order: {order_id}")
+            return
+        
+        if not payment.can_transition_to(PaymentStatus.COMPLETED):
+            logger.info(f"Payment {order_id} already {payment.status}, completion ignored")
+            return
+        
+        # Update payment status
+        payment.transition_to(PaymentStatus.COMPLETED)
+        
+        # Create or update subscription WITH business limits + confirmation email
+        self.activate_subscription(payment)
+        
+        logger.info(f"Payment completed: {payment.id}")
     
     def _handle_payment_denied(self, resource):
         """Handle payment denial event."""
-        try:
-            order_id = resource.get('supplementary_data', {}).get('related_ids', {}).get('order_id')
-            
-            if order_id:
-                Payment.objects.filter(paypal_order_id=order_id).update(
-                    status='DENIED'
-                )
+        order_id = resource.get('supplementary_data', {}).get('related_ids', {}).get('order_id')
+        
+        if order_id:
+            if Payment.objects.bulk_transition([order_id], PaymentStatus.DENIED):
                 logger.info(f"Payment denied: {order_id}")
-                
-        except Exception as e:
-            logger.error(f"Error handling payment denial: {str(e)}")
     
     def _handle_payment_refunded(self, resource):
         """Handle payment refund event."""
-        try:
-            order_id = resource.get('supplementary_data', {}).get('related_ids', {}).get('order_id')
-            
-            if order_id:
-                payment = Payment.objects.filter(paypal_order_id=order_id).first()
-                if payment:
-                    payment.status = 'REFUNDED'
-                    payment.save()
-                    
-                    # Deactivate subscription and reset limits
-                    user = payment.user
-                    Subscription.objects.filter(
-                        user=user,
-                        is_active=True
-                    ).update(is_active=False)
-                    
-                    # Reset business limit to 0
-                    user.max_businesses = 0
-                    user.save()
-                    
-                    logger.info(f"Payment refunded and limits reset: {order_id}")
-                    
-        except Exception as e:
-            logger.error(f"Error handling payment refund: {str(e)}")
+        order_id = resource.get('supplementary_data', {}).get('related_ids', {}).get('order_id')
+        
+        if order_id:
+            payment = Payment.objects.select_for_update().filter(paypal_order_id=order_id).first()
+            if payment and payment.can_transition_to(PaymentStatus.REFUNDED):
+                payment.transition_to(PaymentStatus.REFUNDED)
+                self.revoke_subscriptions([payment.user_id])
+                logger.info(f"Payment refunded and limits reset: {order_id}")
+    
+    def activate_subscription(self, payment):
+        """Grant the plan of a completed payment and queue the confirmation email."""
+        self._create_subscription_with_limits(payment)
+        self._send_payment_confirmation_email(payment)
+    
+    def revoke_subscriptions(self, user_ids):
+        """Deactivate subscriptions and reset business limits (refunds)."""
+        user_ids = list(user_ids)
+        Subscription.objects.filter(
+            user_id__in=user_ids,
+            is_active=True
+        ).update(is_active=False)
+        
+        # Reset business limit to 0
+        User.objects.filter(id__in=user_ids).update(max_businesses=0)
+        invalidate_limit(Business.objects.filter(owner_id__in=user_ids).values_list('id', flat=True))
+        invalidate_dashboard(user_ids)
+        bump_token_version(user_ids)
+        invalidate_plan(user_ids)
+        refresh_budgets(user_ids)
     
     def _create_subscription_with_limits(self, payment):
         """Create or extend subscription with business limits based on plan."""
-        try:
-            plan_type = payment.plan_type
-            plan_limits = PLAN_LIMITS.get(plan_type, PLAN_LIMITS['basic'])
-            
-            # Get or create subscription
-            subscription, created = Subscription.objects.get_or_create(
-                user=payment.user,
-                defaults={
-                    'plan_type': plan_type,
-                    'is_active': True,
-                    'start_date': timezone.now(),
-                    'end_date': timezone.now() + timedelta(days=30),
-                    'monthly_message_limit': plan_limits['monthly_messages']
-                }
-            )
-            
-            if not created:
-                # Extend existing subscription
-                if subscription.end_date < timezone.now():
-                    subscription.start_date = timezone.now()
-                    subscription.end_date = timezone.now() + timedelta(days=30)
-                else:
-                    subscription.end_date += timedelta(days=30)
-                
-                subscription.plan_type = plan_type
-                subscription.is_active = True
-                subscription.monthly_message_limit = plan_limits['monthly_messages']
-                subscription.save()
-            
-            # UPDATE USER BUSINESS LIMITS
-            payment.user.max_businesses = plan_limits['max_businesses']
-            payment.user.role = 'admin'  # Upgrade to admin role
-            payment.user.save()
-            
-            logger.info(
-                f"Subscription {'created' if created else 'extended'} for user {payment.user.id} "
-                f"with {plan_limits['max_businesses']} business limit"
-            )
+        plan_type = payment.plan_type
+        plan_limits = PLAN_LIMITS.get(plan_type, PLAN_LIMITS['basic'])
+        
+        # Get or create subscription
+        subscription, created = Subscription.objects.get_or_create(
+            user=payment.user,
+            defaults={
+                'plan_type': plan_type,
+                'is_active': True,
+                'start_date': timezone.now(),
+                'end_date': timezone.now() + timedelta(days=30),
+                'monthly_message_limit': plan_limits['monthly_messages']
+            }
+        )
+        
+        if not created:
+            # Extend existing subscription
+            if subscription.end_date < timezone.now():
+                subscription.start_date = timezone.now()
+                subscription.end_date = timezone.now() + timedelta(days=30)
+            else:
+                subscription.end_date += timedelta(days=30)
             
-        except Exception as e:
-            logger.error(f"Error creating subscription: {str(e)}")
+            subscription.plan_type = plan_type
+            subscription.is_active = True
+            subscription.monthly_message_limit = plan_limits['monthly_messages']
+            subscription.save()
+        
+        # UPDATE USER BUSINESS LIMITS
+        payment.user.max_businesses = plan_limits['max_businesses']
+        payment.user.role = 'admin'  # Upgrade to admin role
+        payment.user.save()
+        invalidate_limit(payment.user.businesses.values_list('id', flat=True))
+        invalidate_dashboard([payment.user_id])
+        bump_token_version([payment.user_id])
+        invalidate_plan([payment.user_id])
+        refresh_budgets([payment.user_id])
+        
+        logger.info(
+            f"Subscription {'created' if created else 'extended'} for user {payment.user.id} "
+            f"with {plan_limits['max_businesses']} business limit"
+        )
     
     def _send_payment_confirmation_email(self, payment):
-        """Send payment confirmation email to user."""
-        try:
-            plan_limits = PLAN_LIMITS.get(payment.plan_type, PLAN_LIMITS['basic'])
-            
-            subject = 'Pago Confirmado - MensajeroPRO'
-            message = f"""
+        """Queue payment confirmation email to user."""
+        plan_limits = PLAN_LIMITS.get(payment.plan_type, PLAN_LIMITS['basic'])
+        
+        subject = 'Pago Confirmado - MensajeroPRO'
+        message = f"""
 Hola {payment.user.username},
 
 Tu pago ha sido procesado exitosamente.
@@ -246,17 +343,9 @@ Detalles:
 ¡Ya puedes crear hasta {plan_limits['max_businesses']} negocios!
 
 Equipo MensajeroPRO
-            """
-            
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [payment.user.email],
-                fail_silently=True,
-            )
-            
-            logger.info(f"Confirmation email sent to {payment.user.email}")
-            
-        except Exception as e:
-            logger.warning(f"Failed to send confirmation email: {str(e)}")
\ No newline at end of file
+        """
+        
+        # Outbox: se envía solo si la transacción del pago confirma
+        queue_email(payment.user.email, subject, message)
+        
+        logger.info(f"Confirmation email queued for {payment.user.email}")
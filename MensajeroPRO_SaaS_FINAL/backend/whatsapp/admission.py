@@ -0,0 +1,107 @@
+"""
+Admission control for inbound WhatsApp traffic.
+
+Every message takes one token from two buckets in Redis: one per business
+(rate and burst from its plan in PLAN_LIMITS) and one per customer number.
+Both are checked and charged in a single Lua call, so concurrent workers
+can't overspend them. A message that finds either bucket empty is shed
+before any quota, database or LLM work. The customer gets one polite
+notice per window; the rest are dropped silently.
+"""
+import logging
+import time
+from django.conf import settings
+from django.core.cache import cache
+from core.redis import get_redis
+from users.metering import owner_plan
+from users.webhooks import PLAN_LIMITS
+
+logger = logging.getLogger(__name__)
+
+SHED_REPLY = (
+    "Estamos recibiendo muchos mensajes en este momento. "
+    "Por favor escríbenos de nuevo en unos minutos; te atenderemos lo antes posible."
+)
+
+# KEYS: buckets; ARGV: now, cost, then rate (tokens/s) and burst of each bucket.
+# Devuelve {0, 0} si se admite, o {índice del bucket vacío, ms hasta tener saldo}.
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local balances = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[1 + 2 * i])
+    local burst = tonumber(ARGV[2 + 2 * i])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    if tokens < cost then
+        return {i, math.ceil((cost - tokens) / rate * 1000)}
+    end
+    balances[i] = tokens
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[1 + 2 * i])
+    local burst = tonumber(ARGV[2 + 2 * i])
+    redis.call('HSET', key, 'tokens', balances[i] - cost, 'ts', now)
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return {0, 0}
+"""
+
+
+class AdmissionController:
+    """Per-business and per-customer token buckets for inbound messages."""
+
+    def limits_for(self, business) -> tuple:
+        """(rate per second, burst) of a business bucket, from its owner's plan."""
+        plan = owner_plan(business.owner_id) if business is not None else None
+        limits = PLAN_LIMITS.get(plan, PLAN_LIMITS['basic'])
+        return limits['inbound_per_minute'] / 60, limits['inbound_burst']
+
+    def buckets(self, message: dict, business) -> list:
+        """[(key, rate, burst)] charged for a message."""
+        tenant = business.id if business is not None else f"pnid:{message.get('phone_number_id') or ''}"
+        rate, burst = self.limits_for(business)
+        buckets = [(f'wa_bucket:biz:{tenant}', rate, burst)]
+        if message.get('from'):
+            buckets.append((
+                f"wa_bucket:cust:{tenant}:{message['from']}",
+                settings.WHATSAPP_CUSTOMER_PER_MINUTE / 60,
+                settings.WHATSAPP_CUSTOMER_BURST,
+            ))
+        return buckets
+
+    def admit(self, message: dict, business=None) -> bool:
+        """Take one token from the message's buckets; False if it must be shed."""
+        if not settings.WHATSAPP_ADMISSION_ENABLED:
+            return True
+        buckets = self.buckets(message, business)
+        args = [time.time(), 1]
+        for _, rate, burst in buckets:
+            args.extend([rate, burst])
+        try:
+            r = get_redis()
+            rejected, retry_ms = r.register_script(TOKEN_BUCKET_SCRIPT)(
+                keys=[key for key, _, _ in buckets], args=args
+            )
+        except Exception as e:
+            # Sin Redis no hay control de admisión (mejor que rechazar todo)
+            logger.warning(f"Admission control unavailable: {str(e)}")
+            return True
+
+        if rejected:
+            logger.debug(f"Shed inbound message on {buckets[rejected - 1][0]} (retry in {retry_ms} ms)")
+        return not rejected
+
+    def shed_reply(self, message: dict, business=None) -> str:
+        """Polite notice for a shed message, once per customer per window ('' afterwards)."""
+        tenant = business.id if business is not None else message.get('phone_number_id') or ''
+        if cache.add(f"wa_shed_notice:{tenant}:{message.get('from') or ''}", 1, settings.WHATSAPP_SHED_NOTICE_TTL):
+            logger.info(f"Inbound traffic shed for business {tenant}, customer notified")
+            return SHED_REPLY
+        return ''
+
+
+admission = AdmissionController()
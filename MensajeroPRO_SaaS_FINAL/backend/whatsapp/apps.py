@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class WhatsappConfig(AppConfig):
+    name = 'whatsapp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,92 @@
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+import ai.services as ai_services
+from whatsapp.pipeline import handle_inbound, ahandle_inbound
+
+
+def _fake_response(messages):
+    content = f"Respuesta simulada a: {messages[-1]['content'][:40]}"
+    usage = SimpleNamespace(prompt_tokens=50, completion_tokens=20, total_tokens=70)
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+class FakeGroqClient:
+    """Offline stand-in for the Groq client that blocks its thread for `latency` seconds."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, messages, **kwargs):
+        time.sleep(self.latency)
+        return _fake_response(messages)
+
+
+class FakeAsyncGroqClient(FakeGroqClient):
+    """Offline stand-in for AsyncGroq: the latency is awaited, not slept."""
+
+    async def create(self, messages, **kwargs):
+        await asyncio.sleep(self.latency)
+        return _fake_response(messages)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark concurrent AI replies: sync path on a fixed pool of worker threads '
+        '(WSGI) vs the async path on one event loop (ASGI), with a simulated Groq latency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=400, help='Number of inbound messages')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Sync worker threads (e.g. gunicorn workers x threads)')
+        parser.add_argument('--fake-latency', type=float, default=0.5,
+                            help='Simulated Groq latency in seconds per call')
+
+    def handle(self, *args, **options):
+        count, workers, latency = options['count'], options['workers'], options['fake_latency']
+        ai_services.model_router.client = FakeGroqClient(latency)
+        ai_services.model_router.async_client = FakeAsyncGroqClient(latency)
+        self.stdout.write(f'Using fake clients ({latency}s per call), {count} messages')
+
+        # Solo se mide el camino LLM: sin intenciones, admisión ni caché (mensajes únicos)
+        with override_settings(AI_INTENT_ROUTER_ENABLED=False, AI_SIMILARITY_CACHE_ENABLED=False,
+                               WHATSAPP_ADMISSION_ENABLED=False):
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                start = time.perf_counter()
+                latencies = list(pool.map(self._timed, self._messages(count)))
+                self._report(f'Sync, {workers} workers', count, time.perf_counter() - start, latencies)
+
+            start = time.perf_counter()
+            latencies = asyncio.run(self._gather(self._messages(count)))
+            self._report('Async, 1 event loop', count, time.perf_counter() - start, latencies)
+
+    def _messages(self, count):
+        run = uuid.uuid4().hex[:8]
+        return [{'from': f'5210000{i:05d}', 'text': f'Hola, tengo una consulta {run}-{i}'} for i in range(count)]
+
+    def _timed(self, message):
+        start = time.perf_counter()
+        handle_inbound(message)
+        return time.perf_counter() - start
+
+    async def _gather(self, messages):
+        async def timed(message):
+            start = time.perf_counter()
+            await ahandle_inbound(message)
+            return time.perf_counter() - start
+        return await asyncio.gather(*(timed(message) for message in messages))
+
+    def _report(self, label, count, elapsed, latencies):
+        latencies = sorted(latencies)
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+        self.stdout.write(self.style.SUCCESS(
+            f'{label}: {count / elapsed:,.1f} msgs/s '
+            f'({elapsed:.2f}s, p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms)'
+        ))
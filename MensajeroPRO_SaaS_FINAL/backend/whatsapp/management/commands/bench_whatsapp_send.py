@@ -0,0 +1,134 @@
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from whatsapp.sender import WhatsAppSender
+
+
+class GraphStub(ThreadingHTTPServer):
+    """Local stand-in for the Graph API messages endpoint (handshake cost, latency and random 429s)."""
+
+    daemon_threads = True
+
+    def __init__(self, latency: float, error_rate: float, handshake: float = 0):
+        super().__init__(('127.0.0.1', 0), GraphStubHandler)
+        self.latency = latency
+        self.handshake = handshake
+        self.error_rate = error_rate
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/v19.0'
+
+
+class GraphStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True  # cabeceras y cuerpo van en escrituras separadas
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+        # Simula el handshake TLS de cada conexión nueva
+        time.sleep(self.server.handshake)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency)
+        if random.random() < self.server.error_rate:
+            self._reply(429, {'error': {'message': 'Rate limit hit', 'code': 130429}}, {'Retry-After': '0'})
+        else:
+            self._reply(200, {
+                'messaging_product': 'whatsapp',
+                'contacts': [{'input': body['to'], 'wa_id': body['to']}],
+                'messages': [{'id': f'wamid.{uuid.uuid4().hex}'}],
+            })
+
+    def _reply(self, status, data, headers=None):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark outbound WhatsApp sends against a local Graph API stub: '
+        'one connection per message vs the pooled, throttled sender'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500, help='Messages to send')
+        parser.add_argument('--numbers', type=int, default=4, help='Sender phone number ids')
+        parser.add_argument('--concurrency', type=int, default=8, help='Sender threads')
+        parser.add_argument('--latency', type=float, default=0.02, help='Stub latency in seconds')
+        parser.add_argument('--handshake', type=float, default=0.05,
+                            help='Simulated TLS handshake per new connection in seconds')
+        parser.add_argument('--error-rate', type=float, default=0.05, help='Fraction of 429 responses')
+        parser.add_argument('--mps', type=int, default=80, help='Per-number throughput limit (messages/s)')
+
+    def handle(self, *args, **options):
+        count, concurrency = options['count'], options['concurrency']
+        numbers = [f'10{i:04d}' for i in range(options['numbers'])]
+        jobs = [(f'5215500{i:06d}', numbers[i % len(numbers)]) for i in range(count)]
+
+        stub = GraphStub(options['latency'], options['error_rate'], options['handshake'])
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        try:
+            with override_settings(WHATSAPP_NUMBER_MPS=options['mps'], WHATSAPP_SEND_CONCURRENCY=concurrency):
+                self._run_baseline(stub, jobs, concurrency)
+                self._run_sender(stub, jobs)
+        finally:
+            stub.shutdown()
+
+    def _run_baseline(self, stub, jobs, concurrency):
+        import requests
+
+        def send(job):
+            to, number = job
+            response = requests.post(f'{stub.url}/{number}/messages', json={
+                'messaging_product': 'whatsapp', 'to': to, 'type': 'text', 'text': {'body': 'Hola'},
+            }, headers={'Authorization': 'Bearer stub'}, timeout=10)
+            return response.status_code < 400
+
+        def send_all():
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                return list(pool.map(send, jobs))
+
+        self._measure('One connection per message (no retry)', stub, send_all)
+
+    def _run_sender(self, stub, jobs):
+        sender = WhatsAppSender(base_url=stub.url, backoff=0.01, track=False)
+
+        def send_all():
+            futures = [sender.submit(to, 'Hola', phone_number_id=number, token='stub') for to, number in jobs]
+            return [bool(future and future.result()) for future in futures]
+
+        self._measure('Pooled sender (throttled, retries)', stub, send_all)
+
+    def _measure(self, label, stub, run):
+        stub.requests = stub.connections = 0
+        start = time.perf_counter()
+        results = run()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{label}: {len(results) / elapsed:,.1f} msgs/s ({elapsed:.2f}s, '
+            f'{sum(results)}/{len(results)} delivered, {stub.requests} requests, {stub.connections} connections)'
+        ))
@@ -0,0 +1,87 @@
+from django.db import models
+from django.utils import timezone
+
+
+class DeliveryStatus(models.TextChoices):
+    SENT = 'sent', 'Sent'
+    DELIVERED = 'delivered', 'Delivered'
+    READ = 'read', 'Read'
+    FAILED = 'failed', 'Failed'
+
+
+# Meta puede entregar los estados desordenados: solo se avanza, nunca se retrocede
+DELIVERY_TRANSITIONS = {
+    DeliveryStatus.SENT: {DeliveryStatus.DELIVERED, DeliveryStatus.READ, DeliveryStatus.FAILED},
+    DeliveryStatus.DELIVERED: {DeliveryStatus.READ},
+    DeliveryStatus.READ: set(),
+    DeliveryStatus.FAILED: set(),
+}
+
+
+def delivery_sources(status: str) -> list:
+    """States from which a message may move to `status`."""
+    return [source for source, targets in DELIVERY_TRANSITIONS.items() if status in targets]
+
+
+class OutboundMessageQuerySet(models.QuerySet):
+
+    def bulk_transition(self, wamids, status: str) -> int:
+        """
+        Move many messages to `status` in one UPDATE (only rows whose
+        current status allows it).
+
+        Returns:
+            number of messages updated
+        """
+        status = DeliveryStatus(status)
+        return self.filter(
+            wamid__in=list(wamids),
+            status__in=delivery_sources(status),
+        ).update(status=status, updated_at=timezone.now())
+
+    def apply_statuses(self, changes) -> dict:
+        """
+        Apply many (wamid, status) changes from a status webhook, one UPDATE
+        per target status. Unknown statuses are ignored.
+
+        Returns:
+            dict mapping status -> number of messages updated
+        """
+        by_status = {}
+        for wamid, status in changes:
+            if status in DeliveryStatus.values:
+                by_status.setdefault(DeliveryStatus(status), []).append(wamid)
+        return {status: self.bulk_transition(wamids, status) for status, wamids in by_status.items()}
+
+
+class OutboundMessage(models.Model):
+    """
+    Message sent through the WhatsApp Cloud API.
+
+    Created when the Graph API accepts (or finally rejects) the send; the
+    status webhooks then move it to delivered/read/failed.
+    """
+
+    business = models.ForeignKey(
+        'users.Business', null=True, blank=True, on_delete=models.SET_NULL, related_name='outbound_messages'
+    )
+    phone_number_id = models.CharField(max_length=50)
+    to = models.CharField(max_length=20)
+    wamid = models.CharField(max_length=128, unique=True, null=True, blank=True)
+
+    status = models.CharField(max_length=20, choices=DeliveryStatus.choices, default=DeliveryStatus.SENT)
+    attempts = models.PositiveIntegerField(default=1)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = OutboundMessageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.wamid or self.pk} -> {self.to} ({self.status})"
@@ -0,0 +1,236 @@
+import hashlib
+import hmac
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from core.celery import shard_queue
+from ai.services import generate_business_reply
+from ai.intents import router
+from users.metering import check_quota, record_usage
+from .admission import admission
+from .sender import send_reply
+from .tenants import tenant_router
+
+logger = logging.getLogger(__name__)
+
+# Meta reintenta el webhook; recordamos los ids ya aceptados durante un día
+SEEN_MESSAGE_TTL = 60 * 60 * 24
+
+QUOTA_EXCEEDED_REPLY = (
+    "Gracias por tu mensaje. En este momento no podemos responder automáticamente; "
+    "te contactaremos pronto."
+)
+
+
+def verify_signature(body: bytes, signature: str) -> bool:
+    """
+    Check Meta's X-Hub-Signature-256 header ('sha256=<hex>'), the HMAC-SHA256
+    of the raw body keyed with the app secret (WHATSAPP_APP_SECRET).
+    """
+    if not settings.WHATSAPP_APP_SECRET:
+        logger.warning("WHATSAPP_APP_SECRET is not configured, webhook signature not verified")
+        return False
+    if not signature or not signature.startswith('sha256='):
+        return False
+    expected = hmac.new(settings.WHATSAPP_APP_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature[len('sha256='):])
+
+
+def verify_subscription(params) -> str:
+    """
+    Answer Meta's webhook verification request (GET with hub.mode,
+    hub.verify_token and hub.challenge).
+
+    Returns:
+        the challenge to echo back, or None if the verify token doesn't match
+    """
+    token = params.get('hub.verify_token')
+    if (params.get('hub.mode') == 'subscribe' and settings.WHATSAPP_VERIFY_TOKEN and token
+            and hmac.compare_digest(token, settings.WHATSAPP_VERIFY_TOKEN)):
+        return params.get('hub.challenge', '')
+    return None
+
+
+def parse_inbound(data: dict) -> list:
+    """
+    Normalize an inbound webhook body into a list of message dicts.
+
+    Accepts both the Meta Cloud API payload (entry -> changes -> value -> messages)
+    and the legacy ``{"message": "...", "from": "..."}`` body.
+
+    Returns:
+        list of dicts with 'id', 'from', 'text', 'phone_number_id' and
+        'display_phone_number' keys
+    """
+    if 'message' in data:
+        return [{
+            'id': data.get('id'),
+            'from': data.get('from', ''),
+            'text': data['message'],
+            'phone_number_id': data.get('phone_number_id'),
+            'display_phone_number': data.get('to'),
+        }]
+
+    messages = []
+    for entry in data.get('entry', []):
+        for change in entry.get('changes', []):
+            value = change.get('value', {})
+            metadata = value.get('metadata', {})
+            for msg in value.get('messages', []):
+                if msg.get('type') != 'text':
+                    continue
+                messages.append({
+                    'id': msg.get('id'),
+                    'from': msg.get('from', ''),
+                    'text': msg['text']['body'],
+                    'phone_number_id': metadata.get('phone_number_id'),
+                    'display_phone_number': metadata.get('display_phone_number'),
+                })
+    return messages
+
+
+def parse_statuses(data: dict) -> list:
+    """
+    Delivery statuses of our outbound messages in a webhook body.
+
+    Returns:
+        list of dicts with 'id' (wamid), 'status' and 'error' keys
+    """
+    statuses = []
+    for entry in data.get('entry', []):
+        for change in entry.get('changes', []):
+            for status in change.get('value', {}).get('statuses', []):
+                errors = status.get('errors') or [{}]
+                statuses.append({
+                    'id': status.get('id'),
+                    'status': status.get('status'),
+                    'error': errors[0].get('title', ''),
+                })
+    return statuses
+
+
+def first_delivery(message: dict) -> bool:
+    """Mark a message id as seen; False if Meta already delivered it (a retry)."""
+    if message.get('id') and not cache.add(f"wa_msg_{message['id']}", 1, SEEN_MESSAGE_TTL):
+        logger.info(f"Duplicate WhatsApp message ignored: {message['id']}")
+        return False
+    return True
+
+
+def forget_delivery(message: dict):
+    """Unmark a message that could not be handled, so Meta's retry is processed."""
+    if message.get('id'):
+        cache.delete(f"wa_msg_{message['id']}")
+
+
+def conversation_key(message: dict) -> str:
+    """Key that identifies a conversation (business number + customer number)."""
+    return f"{message.get('phone_number_id') or ''}:{message.get('from') or ''}"
+
+
+def handle_inbound(message: dict, business=None, admitted: bool = False) -> str:
+    """
+    Produce the reply text for one inbound message.
+
+    Admission control runs first (unless enqueue_inbound() already admitted
+    the message): a message over its business/customer rate is shed with a
+    polite notice ('' once the customer was notified). Then the intent
+    router; the LLM is only called when no intent handler could answer and
+    the business still has message quota.
+    """
+    if not (admitted or admission.admit(message, business)):
+        return admission.shed_reply(message, business)
+
+    text = message['text']
+
+    within_quota = True
+    if business is not None:
+        within_quota = check_quota(business.id)
+        if not within_quota and settings.AI_QUOTA_MODE == 'reject':
+            return QUOTA_EXCEEDED_REPLY
+        record_usage(business.id, messages=1)
+
+    if settings.AI_INTENT_ROUTER_ENABLED:
+        routed = router.route(text, business)
+        if routed:
+            return routed['reply']
+
+    # Modo 'degrade': sin cupo solo se responden intenciones conocidas
+    if not within_quota:
+        return QUOTA_EXCEEDED_REPLY
+
+    result = generate_business_reply(text, business, customer_phone=message.get('from'))
+    if business is not None and result.get('usage'):
+        record_usage(business.id, usage=result['usage'])
+    return result.get('reply', 'Error al generar respuesta.')
+
+
+async def ahandle_inbound(message: dict, business=None, admitted: bool = False) -> str:
+    """
+    handle_inbound() for the ASGI path: the LLM call is awaited; quota
+    counters and intent handlers (Redis, PayPal) run in worker threads.
+    """
+    from ai.async_services import agenerate_business_reply
+
+    if not (admitted or await sync_to_async(admission.admit, thread_sensitive=False)(message, business)):
+        return await sync_to_async(admission.shed_reply, thread_sensitive=False)(message, business)
+
+    text = message['text']
+
+    within_quota = True
+    if business is not None:
+        within_quota = await sync_to_async(check_quota, thread_sensitive=False)(business.id)
+        if not within_quota and settings.AI_QUOTA_MODE == 'reject':
+            return QUOTA_EXCEEDED_REPLY
+        await sync_to_async(record_usage, thread_sensitive=False)(business.id, messages=1)
+
+    if settings.AI_INTENT_ROUTER_ENABLED:
+        routed = await sync_to_async(router.route, thread_sensitive=False)(text, business)
+        if routed:
+            return routed['reply']
+
+    if not within_quota:
+        return QUOTA_EXCEEDED_REPLY
+
+    result = await agenerate_business_reply(text, business, customer_phone=message.get('from'))
+    if business is not None and result.get('usage'):
+        await sync_to_async(record_usage, thread_sensitive=False)(business.id, usage=result['usage'])
+    return result.get('reply', 'Error al generar respuesta.')
+
+
+def enqueue_inbound(message: dict) -> bool:
+    """
+    Enqueue a message for the Celery workers.
+
+    Messages of the same conversation are routed to the same shard queue so
+    they are answered in order. Duplicate deliveries (same message id) are
+    dropped, and admission control runs here, so a flood is shed before it
+    reaches the queue (the polite notice is sent from this process). If
+    the message cannot be queued (broker down) it is not remembered as
+    seen and the error propagates, so Meta's retry gets another chance.
+
+    Returns:
+        True if the message was enqueued, False if it was a duplicate or shed
+    """
+    from .tasks import process_inbound_message
+
+    if not first_delivery(message):
+        return False
+
+    try:
+        business = tenant_router.resolve(message)
+        if not admission.admit(message, business):
+            send_reply(message, admission.shed_reply(message, business), business, background=True)
+            return False
+
+        queue = shard_queue(
+            settings.WHATSAPP_INBOUND_QUEUE,
+            conversation_key(message),
+            settings.WHATSAPP_INBOUND_SHARDS,
+        )
+        process_inbound_message.apply_async(args=[message], queue=queue)
+    except Exception:
+        forget_delivery(message)
+        raise
+    return True
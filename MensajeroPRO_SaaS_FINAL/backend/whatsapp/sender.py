@@ -0,0 +1,256 @@
+"""
+Outbound WhatsApp Cloud API sender.
+
+- One pooled keep-alive session per sender number (phone_number_id),
+  kept in a bounded LRU.
+- Per-number throughput limit shared by all workers (Redis token bucket,
+  WHATSAPP_NUMBER_MPS): senders wait briefly for a slot instead of
+  collecting 429s from Meta.
+- Connection errors, 429 and 5xx are retried with exponential backoff
+  (Retry-After is honoured); other 4xx fail at once.
+- submit() hands the send to a bounded pool of sender threads, for callers
+  that must not wait on the Graph API (the sync webhook).
+- Every send is recorded as an OutboundMessage; the status webhooks move
+  it to delivered/read/failed (record_statuses).
+
+WHATSAPP_GRAPH_URL points the sender at a local stub of the Graph API
+(see the bench_whatsapp_send command).
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+from core.redis import get_redis
+from .admission import TOKEN_BUCKET_SCRIPT
+from .models import DeliveryStatus, OutboundMessage
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class WhatsAppSendError(Exception):
+    """Graph API rejected the message, or it kept failing after retries."""
+
+
+class WhatsAppSender:
+    """Send messages through the WhatsApp Cloud API (one instance per process)."""
+
+    def __init__(self, base_url: str = None, timeout: tuple = (3.05, 10), max_retries: int = None,
+                 backoff: float = 0.5, track: bool = True):
+        self.base_url = base_url or settings.WHATSAPP_GRAPH_URL
+        self.timeout = timeout
+        self.max_retries = max_retries if max_retries is not None else settings.WHATSAPP_SEND_RETRIES
+        self.backoff = backoff
+        # Sin seguimiento no se escribe OutboundMessage (benchmarks contra el stub)
+        self.track = track
+
+        self._sessions = OrderedDict()  # phone_number_id -> requests.Session
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(settings.WHATSAPP_SEND_QUEUE_SIZE)
+
+    def session(self, phone_number_id: str):
+        """Keep-alive session of a sender number (LRU, WHATSAPP_SEND_SESSIONS)."""
+        with self._lock:
+            session = self._sessions.get(phone_number_id)
+            if session is not None:
+                self._sessions.move_to_end(phone_number_id)
+                return session
+
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.WHATSAPP_SEND_CONCURRENCY)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._sessions[phone_number_id] = session
+            while len(self._sessions) > settings.WHATSAPP_SEND_SESSIONS:
+                self._sessions.popitem(last=False)[1].close()
+            return session
+
+    def throttle(self, phone_number_id: str):
+        """Wait for a send slot of the number (WHATSAPP_NUMBER_MPS, shared by all workers)."""
+        rate = settings.WHATSAPP_NUMBER_MPS
+        give_up = time.monotonic() + settings.WHATSAPP_THROTTLE_WAIT
+        while True:
+            try:
+                rejected, retry_ms = get_redis().register_script(TOKEN_BUCKET_SCRIPT)(
+                    keys=[f'wa_send_bucket:{phone_number_id}'], args=[time.time(), 1, rate, rate]
+                )
+            except Exception as e:
+                logger.warning(f"WhatsApp throughput limiter unavailable: {str(e)}")
+                return
+            if not rejected:
+                return
+            delay = retry_ms / 1000
+            if time.monotonic() + delay > give_up:
+                # Se envía igual: un 429 de Meta se reintenta con backoff
+                return
+            time.sleep(delay)
+
+    def send_text(self, to: str, text: str, phone_number_id: str = None, token: str = None,
+                  business_id: int = None) -> dict:
+        """
+        Send a text message and wait for the Graph API.
+
+        Args:
+            to: Customer phone number (wa_id)
+            text: Message body
+            phone_number_id: Sender phone number id (defaults to WHATSAPP_PHONE_ID)
+            token: Access token (defaults to WHATSAPP_TOKEN)
+            business_id: Business the message is tracked under
+
+        Returns:
+            Graph API response as dict
+
+        Raises:
+            WhatsAppSendError: rejected, or still failing after the retries
+        """
+        return self.send(to, {'type': 'text', 'text': {'body': text}}, phone_number_id, token, business_id)
+
+    def send(self, to: str, message: dict, phone_number_id: str = None, token: str = None,
+             business_id: int = None) -> dict:
+        """Send any message object ({'type': ..., ...}); see send_text()."""
+        import requests
+
+        phone_number_id = phone_number_id or settings.WHATSAPP_PHONE_ID
+        token = token or settings.WHATSAPP_TOKEN
+        if not (phone_number_id and token):
+            raise WhatsAppSendError("WHATSAPP_PHONE_ID / WHATSAPP_TOKEN are not configured")
+
+        url = f'{self.base_url}/{phone_number_id}/messages'
+        payload = {'messaging_product': 'whatsapp', 'to': to, **message}
+        headers = {'Authorization': f'Bearer {token}'}
+        session = self.session(phone_number_id)
+
+        error = None
+        for attempt in range(self.max_retries + 1):
+            self.throttle(phone_number_id)
+            try:
+                response = session.post(url, json=payload, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+                delay = self.backoff * (2 ** attempt)
+            else:
+                if response.status_code < 400:
+                    data = response.json()
+                    self._record(phone_number_id, to, business_id, attempt + 1, data=data)
+                    logger.info(f"WhatsApp message sent to {to}")
+                    return data
+                error = f"{response.status_code} {response.text[:200]}"
+                if response.status_code not in RETRY_STATUSES:
+                    break
+                retry_after = response.headers.get('Retry-After')
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else self.backoff * (2 ** attempt)
+
+            if attempt < self.max_retries:
+                logger.warning(f"WhatsApp send to {to} retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+
+        self._record(phone_number_id, to, business_id, attempt + 1, error=error)
+        raise WhatsAppSendError(f"Send to {to} via {phone_number_id} failed: {error}")
+
+    def submit(self, to: str, text: str, phone_number_id: str = None, token: str = None,
+               business_id: int = None):
+        """
+        Queue a send on the sender threads (WHATSAPP_SEND_CONCURRENCY).
+
+        Returns:
+            Future of send_text(), or None if the queue is full
+            (WHATSAPP_SEND_QUEUE_SIZE) or no sender number/token is configured
+        """
+        if not ((phone_number_id or settings.WHATSAPP_PHONE_ID) and (token or settings.WHATSAPP_TOKEN)):
+            logger.debug(f"WhatsApp sender not configured, reply to {to} not sent")
+            return None
+        if not self._slots.acquire(blocking=False):
+            logger.warning(f"WhatsApp send queue full, reply to {to} dropped")
+            return None
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=settings.WHATSAPP_SEND_CONCURRENCY, thread_name_prefix='whatsapp-send'
+                )
+        future = self._executor.submit(self._send_logged, to, text, phone_number_id, token, business_id)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _send_logged(self, to, text, phone_number_id, token, business_id):
+        try:
+            return self.send_text(to, text, phone_number_id, token, business_id)
+        except Exception as e:
+            logger.error(f"Error sending WhatsApp reply: {str(e)}")
+            return None
+        finally:
+            # Hilos de larga vida: soltar la conexión a la BD como al final de un request
+            close_old_connections()
+
+    def _record(self, phone_number_id, to, business_id, attempts, data: dict = None, error: str = None):
+        if not self.track:
+            return
+        try:
+            OutboundMessage.objects.create(
+                business_id=business_id,
+                phone_number_id=phone_number_id,
+                to=to,
+                wamid=((data or {}).get('messages') or [{}])[0].get('id'),
+                status=DeliveryStatus.FAILED if error else DeliveryStatus.SENT,
+                attempts=attempts,
+                last_error=error or '',
+            )
+        except Exception as e:
+            logger.warning(f"Outbound message not tracked: {str(e)}")
+
+
+def record_statuses(statuses: list) -> dict:
+    """
+    Apply delivery statuses from the webhook (one UPDATE per status, plus
+    the error text of failed messages).
+
+    Returns:
+        dict mapping status -> number of messages updated
+    """
+    updated = OutboundMessage.objects.apply_statuses((status['id'], status['status']) for status in statuses)
+    for status in statuses:
+        if status['status'] == DeliveryStatus.FAILED and status.get('error'):
+            OutboundMessage.objects.filter(wamid=status['id']).update(last_error=status['error'])
+    return updated
+
+
+whatsapp_sender = WhatsAppSender()
+
+
+def send_text(to: str, text: str, phone_number_id: str = None, token: str = None, business_id: int = None) -> dict:
+    """Send a text message through the WhatsApp Cloud API (see WhatsAppSender.send_text)."""
+    return whatsapp_sender.send_text(to, text, phone_number_id, token, business_id)
+
+
+def send_reply(message: dict, reply: str, business=None, background: bool = False):
+    """
+    Send the reply to an inbound message from the number it was sent to,
+    with the business's token (the platform token only for WHATSAPP_PHONE_ID).
+
+    With background=True the send is queued (submit()) and the Future is
+    returned; otherwise the Graph API response.
+    """
+    if not (reply and message.get('from')):
+        return None
+    phone_number_id = message.get('phone_number_id')
+    token = business.whatsapp_token if business else None
+    # El token de la plataforma solo responde desde su propio número
+    if not token and phone_number_id and phone_number_id != settings.WHATSAPP_PHONE_ID:
+        logger.warning(f"No WhatsApp token for number {phone_number_id}, reply not sent")
+        return None
+    kwargs = {
+        'phone_number_id': phone_number_id,
+        'token': token,
+        'business_id': business.id if business else None,
+    }
+    if background:
+        return whatsapp_sender.submit(message['from'], reply, **kwargs)
+    return whatsapp_sender.send_text(message['from'], reply, **kwargs)
@@ -0,0 +1,24 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from users.models import Business
+from .tenants import tenant_router, tenant_keys
+
+
+@receiver(pre_save, sender=Business)
+def remember_tenant_keys(sender, instance, **kwargs):
+    """Keep the numbers the business had so post_save can drop the ones that changed."""
+    instance._tenant_keys_before = []
+    if instance.pk:
+        old = sender.objects.filter(pk=instance.pk).values('whatsapp_phone_number_id', 'whatsapp_number').first()
+        if old:
+            instance._tenant_keys_before = tenant_keys(old['whatsapp_phone_number_id'], old['whatsapp_number'])
+
+
+@receiver(post_save, sender=Business)
+def reindex_tenant(sender, instance, **kwargs):
+    tenant_router.update(instance, getattr(instance, '_tenant_keys_before', []))
+
+
+@receiver(post_delete, sender=Business)
+def unindex_tenant(sender, instance, **kwargs):
+    tenant_router.remove(tenant_keys(instance.whatsapp_phone_number_id, instance.whatsapp_number))
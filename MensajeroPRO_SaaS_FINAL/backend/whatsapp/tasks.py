@@ -0,0 +1,27 @@
+import logging
+from celery import shared_task
+from .pipeline import handle_inbound
+from .sender import send_reply, WhatsAppSendError
+from .tenants import tenant_router
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def process_inbound_message(message: dict):
+    """Generate the reply for an inbound WhatsApp message and send it."""
+    business = tenant_router.resolve(message)
+    # enqueue_inbound() ya aplicó el control de admisión
+    reply = handle_inbound(message, business, admitted=True)
+
+    if not message.get('from'):
+        logger.warning(f"Inbound message without sender, reply not sent: {message.get('id')}")
+        return
+    if not reply:
+        return
+
+    # El sender ya reintenta 429/5xx con backoff; reintentar la tarea volvería a generar la respuesta
+    try:
+        send_reply(message, reply, business)
+    except WhatsAppSendError as e:
+        logger.error(f"Error sending WhatsApp reply: {str(e)}")
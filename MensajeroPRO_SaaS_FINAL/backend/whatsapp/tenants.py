@@ -0,0 +1,180 @@
+"""
+Inbound tenant routing: WhatsApp phone_number_id / display number -> Business.
+
+Lookups go through an in-process LRU, then a Redis hash shared by all
+workers. The hash is built once (by whichever worker first finds it
+missing) and kept current by the Business signals, so the database is only
+read when rebuilding it (or while Redis is unavailable).
+
+The index only holds what routing, admission and the intent handlers need
+(id, owner, name, business_type, is_active). The business id is the
+reference to everything else: ai_context is read from the compiled prompt
+cache, and whatsapp_token is loaded from the database when a reply is sent,
+so neither the token nor the context is copied into Redis.
+"""
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.db.models import Q
+from core.redis import get_redis
+from users.models import Business
+
+logger = logging.getLogger(__name__)
+
+INDEX_KEY = 'wa_tenants:v3'
+# 'wa_tenants' copiaba ai_context y el token en claro; 'v2' no tenía el nombre
+LEGACY_INDEX_KEYS = ('wa_tenants', 'wa_tenants:v2')
+READY_FIELD = '_ready'  # el hash existe aunque ningún negocio tenga número
+WARM_LOCK_KEY = 'wa_tenants:warming'
+WARM_LOCK_TTL = 60
+MISS = ''  # número sin negocio
+FIELDS = ('id', 'owner_id', 'name', 'business_type', 'is_active')
+
+
+def normalize_number(number: str) -> str:
+    """Digits only: '+52 1 (55) 1234-5678' and '5215512345678' are the same number."""
+    return re.sub(r'\D', '', number or '')
+
+
+def tenant_keys(phone_number_id: str = None, whatsapp_number: str = None) -> list:
+    """Index keys under which a business is reachable."""
+    keys = []
+    if phone_number_id:
+        keys.append(f'id:{phone_number_id}')
+    number = normalize_number(whatsapp_number)
+    if number:
+        keys.append(f'num:{number}')
+    return keys
+
+
+class TenantRouter:
+    """Resolve the Business an inbound message belongs to, without a query per message."""
+
+    def __init__(self, capacity: int = None, local_ttl: int = None):
+        self.capacity = capacity if capacity is not None else settings.WHATSAPP_TENANT_CACHE_SIZE
+        # Otros procesos se enteran de los cambios por Redis; el LRU local caduca rápido
+        self.local_ttl = local_ttl if local_ttl is not None else settings.WHATSAPP_TENANT_LOCAL_TTL
+        self._local = OrderedDict()  # key -> (expires_at, payload)
+        self._lock = threading.Lock()
+
+    def resolve(self, message: dict):
+        """
+        Business of an inbound message (phone_number_id first, then display number).
+
+        Returns:
+            Business with the indexed fields loaded (the rest are deferred
+            and read from the database on access), or None if unknown/inactive
+        """
+        for key in tenant_keys(message.get('phone_number_id'), message.get('display_phone_number')):
+            payload = self._lookup(key)
+            if payload:
+                data = json.loads(payload)
+                if not data['is_active']:
+                    return None
+                return Business.from_db('default', FIELDS, [data[field] for field in FIELDS])
+        return None
+
+    def warm(self) -> int:
+        """Build the Redis index from every active business with a number (one query)."""
+        entries = {READY_FIELD: '1'}
+        businesses = Business.objects.filter(is_active=True).exclude(
+            whatsapp_phone_number_id='', whatsapp_number=''
+        ).values(*FIELDS, 'whatsapp_phone_number_id', 'whatsapp_number')
+        for data in businesses.iterator():
+            payload = json.dumps({field: data[field] for field in FIELDS})
+            for key in tenant_keys(data['whatsapp_phone_number_id'], data['whatsapp_number']):
+                entries[key] = payload
+        pipe = get_redis().pipeline()
+        pipe.hset(INDEX_KEY, mapping=entries)
+        pipe.delete(*LEGACY_INDEX_KEYS)
+        pipe.execute()
+        logger.info(f"Tenant index warmed with {len(entries) - 1} keys")
+        return len(entries) - 1
+
+    def update(self, business, old_keys=()):
+        """Re-index a business after save (old_keys = numbers it had before)."""
+        keys = tenant_keys(business.whatsapp_phone_number_id, business.whatsapp_number)
+        payload = json.dumps({field: getattr(business, field) for field in FIELDS})
+        stale = [key for key in old_keys if key not in keys]
+        try:
+            pipe = get_redis().pipeline()
+            if stale:
+                pipe.hdel(INDEX_KEY, *stale)
+            if keys:
+                pipe.hset(INDEX_KEY, mapping={key: payload for key in keys})
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Tenant index update failed: {str(e)}")
+        with self._lock:
+            for key in stale:
+                self._local.pop(key, None)
+            for key in keys:
+                self._remember(key, payload)
+
+    def remove(self, keys):
+        """Forget a deleted business."""
+        if not keys:
+            return
+        try:
+            get_redis().hdel(INDEX_KEY, *keys)
+        except Exception as e:
+            logger.warning(f"Tenant index delete failed: {str(e)}")
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def _lookup(self, key: str) -> str:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry and entry[0] > now:
+                self._local.move_to_end(key)
+                return entry[1]
+
+        try:
+            r = get_redis()
+            payload, ready = r.hmget(INDEX_KEY, key, READY_FIELD)
+            if ready is not None:
+                payload = payload.decode() if payload is not None else MISS
+            elif r.set(WARM_LOCK_KEY, 1, nx=True, ex=WARM_LOCK_TTL):
+                # Índice ausente (primer arranque, Redis reiniciado): lo reconstruye un solo proceso
+                self.warm()
+                payload = r.hget(INDEX_KEY, key)
+                payload = payload.decode() if payload is not None else MISS
+            else:
+                # Otro proceso lo está reconstruyendo: consulta puntual sin guardarla en el LRU
+                return self._load(key)
+        except Exception as e:
+            logger.warning(f"Tenant index unavailable, using database: {str(e)}")
+            payload = self._load(key)
+
+        with self._lock:
+            self._remember(key, payload)
+        return payload
+
+    def _load(self, key: str) -> str:
+        """Database fallback while Redis is down."""
+        kind, value = key.split(':', 1)
+        if kind == 'id':
+            lookup = Q(whatsapp_phone_number_id=value)
+        else:
+            lookup = Q(whatsapp_number=value) | Q(whatsapp_number=f'+{value}')
+        data = Business.objects.filter(lookup).values(*FIELDS).first()
+        return json.dumps(data) if data else MISS
+
+    def _remember(self, key: str, payload: str):
+        self._local[key] = (time.monotonic() + self.local_ttl, payload)
+        self._local.move_to_end(key)
+        while len(self._local) > self.capacity:
+            self._local.popitem(last=False)
+
+
+tenant_router = TenantRouter()
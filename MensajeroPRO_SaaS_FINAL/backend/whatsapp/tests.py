@@ -0,0 +1,126 @@
+import hashlib
+import hmac
+import json
+from unittest import mock
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from ai.intents import router
+from ai.prompts import compiled_for
+from users.models import Business, User
+from .pipeline import enqueue_inbound
+from .sender import send_reply
+from .tenants import tenant_router
+from .views import AsyncWhatsAppWebhook
+
+APP_SECRET = 'test-secret'
+
+
+def meta_body(text: str, phone_number_id: str, message_id: str = 'wamid.1') -> bytes:
+    return json.dumps({'entry': [{'changes': [{'value': {
+        'metadata': {'phone_number_id': phone_number_id, 'display_phone_number': '5215500000000'},
+        'messages': [{'id': message_id, 'from': '5215511111111', 'type': 'text', 'text': {'body': text}}],
+    }}]}]}).encode()
+
+
+def signed(body: bytes) -> str:
+    return 'sha256=' + hmac.new(APP_SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+@override_settings(WHATSAPP_APP_SECRET=APP_SECRET, WHATSAPP_INBOUND_MODE='sync')
+class AsyncWebhookTests(TransactionTestCase):
+    """Signed Meta deliveries on the ASGI view (the transaction must be visible to worker threads)."""
+
+    def setUp(self):
+        owner = User.objects.create(username='owner', email='owner@example.com')
+        self.business = Business.objects.create(
+            owner=owner, name='Taquería', whatsapp_phone_number_id='PN1', whatsapp_token='business-token'
+        )
+        tenant_router.clear_local()
+        cache.clear()
+
+    def post(self, body: bytes):
+        request = AsyncRequestFactory().post(
+            '/api/whatsapp/', data=body, content_type='application/json',
+            headers={'X-Hub-Signature-256': signed(body)},
+        )
+        return AsyncWhatsAppWebhook.as_view()(request)
+
+    async def test_signed_message_reply_is_sent_with_business_token(self):
+        with mock.patch('whatsapp.views.ahandle_inbound', mock.AsyncMock(return_value='¡Hola!')), \
+                mock.patch('whatsapp.sender.whatsapp_sender.submit') as submit:
+            response = await self.post(meta_body('hola', 'PN1'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {'reply': '¡Hola!'})
+        submit.assert_called_once_with(
+            '5215511111111', '¡Hola!', phone_number_id='PN1', token='business-token', business_id=self.business.id
+        )
+
+    async def test_meta_retry_is_answered_once(self):
+        handle = mock.AsyncMock(return_value='¡Hola!')
+        with mock.patch('whatsapp.views.ahandle_inbound', handle), \
+                mock.patch('whatsapp.sender.whatsapp_sender.submit'):
+            await self.post(meta_body('hola', 'PN1'))
+            response = await self.post(meta_body('hola', 'PN1'))
+
+        self.assertEqual(json.loads(response.content), {'status': 'duplicate'})
+        handle.assert_called_once()
+
+    async def test_unsigned_message_is_rejected(self):
+        request = AsyncRequestFactory().post(
+            '/api/whatsapp/', data=meta_body('hola', 'PN1'), content_type='application/json'
+        )
+        response = await AsyncWhatsAppWebhook.as_view()(request)
+
+        self.assertEqual(response.status_code, 401)
+
+
+@mock.patch('whatsapp.pipeline.admission.admit', return_value=True)
+@mock.patch('whatsapp.pipeline.tenant_router.resolve', return_value=None)
+class EnqueueInboundTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_message_is_not_marked_seen_when_the_broker_fails(self, resolve, admit):
+        message = {'id': 'wamid.2', 'from': '5215511111111', 'text': 'hola', 'phone_number_id': 'PN1'}
+        with mock.patch('whatsapp.tasks.process_inbound_message.apply_async', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                enqueue_inbound(message)
+
+        with mock.patch('whatsapp.tasks.process_inbound_message.apply_async') as apply_async:
+            self.assertTrue(enqueue_inbound(message))
+            self.assertFalse(enqueue_inbound(message))
+        apply_async.assert_called_once()
+
+
+class ResolvedTenantQueryTests(TestCase):
+    """A resolved tenant answers intents from the index and the prompt cache."""
+
+    def setUp(self):
+        owner = User.objects.create(username='owner', email='owner@example.com')
+        self.business = Business.objects.create(
+            owner=owner, name='Taquería', business_type='restaurant',
+            whatsapp_phone_number_id='PN1', whatsapp_token='business-token',
+            ai_context='Horario:\nAbrimos de 9 a 18 h\n\nMenú:\nTacos $20',
+        )
+        cache.clear()
+        compiled_for(self.business)
+        self.message = {'id': 'wamid.3', 'from': '5215511111111', 'text': 'hola', 'phone_number_id': 'PN1'}
+        tenant_router.resolve(self.message)  # construye el índice si hace falta
+
+    def test_intent_replies_do_not_query_the_business(self):
+        with self.assertNumQueries(0):
+            business = tenant_router.resolve(self.message)
+            hours = router.route('¿cuál es el horario?', business)
+            booking = router.route('quiero reservar', business)
+
+        self.assertIn('Abrimos de 9 a 18 h', hours['reply'])
+        self.assertIn('Taquería', booking['reply'])
+
+    def test_sending_loads_only_the_token(self):
+        business = tenant_router.resolve(self.message)
+        with mock.patch('whatsapp.sender.whatsapp_sender.submit') as submit, self.assertNumQueries(1):
+            send_reply(self.message, '¡Hola!', business, background=True)
+
+        self.assertEqual(submit.call_args.kwargs['token'], 'business-token')
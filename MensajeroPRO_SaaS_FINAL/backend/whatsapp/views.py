@@ -1,14 +1,159 @@
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import AllowAny
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from ai.services import ai_reply
-from payments.paypal import create_order
+from users.authentication import ClaimsJWTAuthentication
+from .pipeline import (
+    parse_inbound, parse_statuses, handle_inbound, ahandle_inbound, enqueue_inbound,
+    first_delivery, forget_delivery, verify_signature, verify_subscription,
+)
+from .sender import record_statuses, send_reply
+from .tenants import tenant_router
+
+
+def subscription_response(request):
+    """Echo hub.challenge to Meta's verification request, or 403."""
+    challenge = verify_subscription(request.GET)
+    if challenge is None:
+        return HttpResponse('Token de verificación inválido', status=403)
+    return HttpResponse(challenge, content_type='text/plain')
+
+
+def owns_business(user, business) -> bool:
+    """Whether an authenticated (unsigned) caller may try replies of `business`."""
+    return business is None or business.owner_id == user.id or user.is_superuser
+
 
 class WhatsAppWebhook(APIView):
- def post(self,req):
-  msg=req.data['message']
-  r=ai_reply(msg)
-  if 'pagar' in msg.lower():
-   order=create_order(10)
-   link=order['links'][1]['href']
-   return Response({'reply':f'Paga aquí: {link}'})
-  return Response({'reply':r})
+    """
+    Inbound WhatsApp webhook.
+
+    Meta's deliveries (messages and status callbacks) carry no credentials
+    and are accepted when X-Hub-Signature-256 matches WHATSAPP_APP_SECRET;
+    only these are sent to the customer or queued. Unsigned requests need an
+    authenticated user, must target one of their businesses and just get
+    the reply in the body (legacy body, tests from the panel).
+    """
+
+    permission_classes = [AllowAny]
+    # Meta entrega en ráfagas; el control de admisión limita por negocio y cliente
+    throttle_classes = []
+
+    def get(self, request):
+        return subscription_response(request)
+
+    def post(self, request):
+        signed = verify_signature(request.body, request.headers.get('X-Hub-Signature-256'))
+        if not signed:
+            return self.preview(request)
+
+        statuses = parse_statuses(request.data)
+        if statuses:
+            record_statuses(statuses)
+        messages = parse_inbound(request.data)
+
+        # Modo síncrono (legacy): la respuesta va en el body y se envía en segundo plano
+        if settings.WHATSAPP_INBOUND_MODE != 'async':
+            if not messages:
+                return Response({'status': 'ignored'})
+            message = messages[0]
+            # Reintentos de Meta: no volver a responder (ni cobrar) el mismo mensaje
+            if not first_delivery(message):
+                return Response({'status': 'duplicate'})
+            try:
+                business = tenant_router.resolve(message)
+                reply = handle_inbound(message, business)
+                send_reply(message, reply, business, background=True)
+            except Exception:
+                forget_delivery(message)
+                raise
+            return Response({'reply': reply})
+
+        # Modo asíncrono: encolar y confirmar en milisegundos
+        queued = sum(1 for message in messages if enqueue_inbound(message))
+        return Response({'status': 'queued', 'queued': queued})
+
+    def preview(self, request):
+        if not request.user.is_authenticated:
+            return Response({'error': 'Firma inválida'}, status=status.HTTP_401_UNAUTHORIZED)
+        messages = parse_inbound(request.data)
+        if not messages:
+            return Response({'status': 'ignored'})
+        message = messages[0]
+        business = tenant_router.resolve(message)
+        if not owns_business(request.user, business):
+            return Response({'error': 'Negocio no encontrado'}, status=status.HTTP_403_FORBIDDEN)
+        return Response({'reply': handle_inbound(message, business)})
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncWhatsAppWebhook(View):
+    """
+    Inbound WhatsApp webhook for ASGI deployments (SERVER_MODE='asgi').
+
+    Same contract as WhatsAppWebhook; in sync mode the reply is produced
+    with the async Groq client, so a slow model call does not hold a worker.
+    """
+
+    async def get(self, request):
+        return subscription_response(request)
+
+    async def post(self, request):
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'JSON inválido'}, status=400)
+        if not verify_signature(request.body, request.headers.get('X-Hub-Signature-256')):
+            return await self.preview(request, data)
+
+        statuses = parse_statuses(data)
+        if statuses:
+            await sync_to_async(record_statuses, thread_sensitive=False)(statuses)
+        messages = parse_inbound(data)
+
+        if settings.WHATSAPP_INBOUND_MODE != 'async':
+            if not messages:
+                return JsonResponse({'status': 'ignored'})
+            message = messages[0]
+            if not await sync_to_async(first_delivery, thread_sensitive=False)(message):
+                return JsonResponse({'status': 'duplicate'})
+            try:
+                business = await sync_to_async(tenant_router.resolve, thread_sensitive=False)(message)
+                reply = await ahandle_inbound(message, business)
+                # El token del negocio se lee de la base de datos: fuera del event loop
+                await sync_to_async(send_reply, thread_sensitive=False)(message, reply, business, background=True)
+            except Exception:
+                await sync_to_async(forget_delivery, thread_sensitive=False)(message)
+                raise
+            return JsonResponse({'reply': reply})
+
+        queued = 0
+        for message in messages:
+            if await sync_to_async(enqueue_inbound, thread_sensitive=False)(message):
+                queued += 1
+        return JsonResponse({'status': 'queued', 'queued': queued})
+
+    async def preview(self, request, data):
+        # Sin firma de Meta: misma autenticación que la vista DRF
+        try:
+            auth = await sync_to_async(ClaimsJWTAuthentication().authenticate, thread_sensitive=False)(request)
+        except APIException:
+            auth = None
+        if auth is None:
+            return JsonResponse({'error': 'Firma inválida'}, status=401)
+        messages = parse_inbound(data)
+        if not messages:
+            return JsonResponse({'status': 'ignored'})
+        message = messages[0]
+        business = await sync_to_async(tenant_router.resolve, thread_sensitive=False)(message)
+        if not owns_business(auth[0], business):
+            return JsonResponse({'error': 'Negocio no encontrado'}, status=403)
+        return JsonResponse({'reply': await ahandle_inbound(message, business)})